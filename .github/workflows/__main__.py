@@ -0,0 +1,43 @@
+# Runs one or more workflow scripts in a single Python process:
+#   python .github/workflows <command> [<args>...] [--- <command> [<args>...]]...
+# Commands are the names of the scripts without their extension, IE: `python .github/workflows gha set_output sha 1234 --- bump-version`
+# Commands run in order and stop at the first one which fails, the exit code is the exit code of that command
+import sys
+
+import script_runner
+
+COMMAND_SEPARATOR = '---'
+
+def main(argv: list[str]) -> int:
+    if len(argv) == 0 or argv[0] in ('-h', '--help', '--list'):
+        print(f"Usage: python {sys.argv[0]} <command> [<args>...] [{COMMAND_SEPARATOR} <command> [<args>...]]...")
+        print()
+        print("Commands:")
+        for command in script_runner.get_commands():
+            print(f"  {command}")
+        return 0 if len(argv) > 0 else 1
+
+    invocations: list[list[str]] = [[]]
+    for arg in argv:
+        if arg == COMMAND_SEPARATOR:
+            invocations.append([])
+        else:
+            invocations[-1].append(arg)
+
+    commands = script_runner.get_commands()
+    for invocation in invocations:
+        if len(invocation) == 0:
+            print(f"::error::Bad command line, '{COMMAND_SEPARATOR}' must separate commands.")
+            return 1
+        if invocation[0] not in commands:
+            print(f"::error::Unknown command '{invocation[0]}', valid commands are: {', '.join(commands)}")
+            return 1
+
+    for command, *args in invocations:
+        exit_code = script_runner.run(command, args)
+        if exit_code != 0:
+            return exit_code
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# Benchmarks the release tooling scripts against a synthetic set of packages
+# This is meant to be run locally to measure performance work on the scripts and catch regressions, it is not used by the workflow
+import argparse
+import contextlib
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+import zipfile
+
+from pathlib import Path
+
+import gha
+import nuget
+import script_runner
+
+from package_comparison import should_ignore
+
+# These are always released by compare-nuget-packages.py so they're always generated to keep it from failing
+always_release_packages = ['Bonsai', 'Bonsai.Core', 'Bonsai.Design', 'Bonsai.Editor', 'Bonsai.Player']
+
+#==================================================================================================
+# Synthetic package generation
+#==================================================================================================
+def get_package_names(count: int) -> list[str]:
+    names = always_release_packages[:count]
+    # Long dotted names are included on purpose since they're the worst case for file name parsing
+    while len(names) < count:
+        names.append(f"Bonsai.Synthetic{len(names)}.Scripting.Expressions.Design")
+    return names
+
+def get_entry_content(rng: random.Random, size: int) -> bytes:
+    # Half random and half repetitive data so that deflate has something to do without being trivial
+    random_size = size // 2
+    pattern = rng.randbytes(64)
+    return rng.randbytes(random_size) + (pattern * ((size - random_size) // len(pattern) + 1))[:size - random_size]
+
+def write_package(path: Path, name: str, version: str, entries: dict[str, bytes], date_time: tuple):
+    def write_entry(package: zipfile.ZipFile, file_name: str, content: bytes | str):
+        info = zipfile.ZipInfo(file_name, date_time)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        package.writestr(info, content)
+
+    # NuGet regenerates the relationship and core properties parts with random IDs on every pack, should_ignore filters them out
+    core_properties_id = uuid.uuid4().hex
+    with zipfile.ZipFile(path, 'w') as package:
+        write_entry(package, '_rels/.rels', f'<?xml version="1.0" encoding="utf-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"><Relationship Type="http://schemas.microsoft.com/packaging/2010/07/manifest" Target="/{name}.nuspec" Id="R{uuid.uuid4().hex[:16].upper()}" /><Relationship Type="http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties" Target="/package/services/metadata/core-properties/{core_properties_id}.psmdcp" Id="R{uuid.uuid4().hex[:16].upper()}" /></Relationships>')
+        write_entry(package, f'{name}.nuspec', f'<?xml version="1.0" encoding="utf-8"?><package xmlns="http://schemas.microsoft.com/packaging/2013/05/nuspec.xsd"><metadata><id>{name}</id><version>{version}</version><authors>Bonsai Foundation</authors><description>Synthetic package</description></metadata></package>')
+        for file_name, content in entries.items():
+            write_entry(package, file_name, content)
+        write_entry(package, f'package/services/metadata/core-properties/{core_properties_id}.psmdcp', f'<?xml version="1.0" encoding="utf-8"?><coreProperties><dc:identifier xmlns:dc="http://purl.org/dc/elements/1.1/">{name}</dc:identifier><version>{version}</version></coreProperties>')
+
+def generate_packages(output_path: Path, package_count: int, entry_count: int, entry_size: int, changed_fraction: float, seed: int) -> dict[str, Path]:
+    rng = random.Random(seed)
+    paths = {
+        'previous': output_path / 'previous',
+        'next': output_path / 'next',
+        'release': output_path / 'release',
+    }
+    for path in paths.values():
+        path.mkdir(parents=True)
+
+    names = get_package_names(package_count)
+    changed_names = set(rng.sample(names, round(package_count * changed_fraction)))
+
+    for name in names:
+        entries = { }
+        for i in range(entry_count):
+            # Entry sizes vary so the tooling sees a mix of small and large entries
+            size = max(1, int(entry_size * rng.uniform(0.5, 1.5)))
+            entries[f'lib/net472/{name}.{i}.dll'] = get_entry_content(rng, size)
+
+        # Packing the same sources twice results in different timestamps
+        write_package(paths['previous'] / f'{name}.99.99.99.nupkg', name, '99.99.99', entries, (2024, 1, 1, 0, 0, 0))
+
+        if name in changed_names:
+            changed_entry = rng.choice(list(entries))
+            content = bytearray(entries[changed_entry])
+            content[rng.randrange(len(content))] ^= 0xFF
+            entries[changed_entry] = bytes(content)
+
+        write_package(paths['next'] / f'{name}.99.99.99.nupkg', name, '99.99.99', entries, (2024, 6, 1, 0, 0, 0))
+        write_package(paths['release'] / f'{name}.2.10.0.nupkg', name, '2.10.0', entries, (2024, 6, 1, 0, 0, 0))
+
+    return paths
+
+def get_uncompressed_size(packages_path: Path) -> int:
+    ret = 0
+    for file_name in os.listdir(packages_path):
+        with zipfile.ZipFile(packages_path / file_name, 'r') as package:
+            ret += sum(info.file_size for info in package.infolist() if not should_ignore(info))
+    return ret
+
+#==================================================================================================
+# Benchmarking
+#==================================================================================================
+class StageResult:
+    def __init__(self, name: str, wall_time: float, peak_memory: int, processed_bytes: int | None, exit_code: int):
+        self.name = name
+        self.wall_time = wall_time
+        self.peak_memory = peak_memory
+        self.processed_bytes = processed_bytes
+        self.exit_code = exit_code
+
+def run_stage(name: str, function, processed_bytes: int | None = None) -> StageResult:
+    exit_code = 0
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        # The scripts are chatty, their output isn't interesting here
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+    except SystemExit as ex:
+        exit_code = ex.code if isinstance(ex.code, int) else 1
+    finally:
+        wall_time = time.perf_counter() - start
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # Scripts might fail intentionally, make sure that doesn't leak into the next stage
+        gha.errors_were_printed = False
+
+    return StageResult(name, wall_time, peak_memory, processed_bytes, exit_code)
+
+def run_script(command: str, *args: str):
+    exit_code = script_runner.run(command, list(args))
+    if exit_code != 0:
+        sys.exit(exit_code)
+
+def benchmark(paths: dict[str, Path], work_path: Path, name_iterations: int) -> list[StageResult]:
+    results = []
+    # Throughput is relative to the uncompressed size of every entry which could be compared, even if the comparer was able to skip some of them
+    compared_bytes = get_uncompressed_size(paths['previous']) + get_uncompressed_size(paths['next'])
+
+    file_names = os.listdir(paths['next']) + os.listdir(paths['release'])
+    def parse_names():
+        for _ in range(name_iterations):
+            for file_name in file_names:
+                nuget.get_package_name(file_name)
+    results.append(run_stage(f'nuget.get_package_name (x{len(file_names) * name_iterations})', parse_names))
+
+    manifest_path = work_path / 'ReleaseManifest'
+    results.append(run_stage('compare-nuget-packages.py', lambda: run_script('compare-nuget-packages', str(paths['previous']), str(paths['next']), str(paths['release']), str(manifest_path)), compared_bytes))
+
+    fingerprints_path = work_path / 'fingerprints'
+    shutil.copytree(paths['next'], fingerprints_path)
+    results.append(run_stage('create-package-fingerprints.py', lambda: run_script('create-package-fingerprints', str(fingerprints_path)), get_uncompressed_size(paths['next'])))
+
+    filtered_path = work_path / 'filtered'
+    shutil.copytree(paths['release'], filtered_path)
+    results.append(run_stage('filter-release-packages.py', lambda: run_script('filter-release-packages', str(manifest_path), str(filtered_path))))
+
+    return results
+
+def format_results(results: list[StageResult]) -> list[str]:
+    lines = [
+        '| Stage | Wall time | Throughput | Peak memory | Exit code |',
+        '|-------|----------:|-----------:|------------:|----------:|',
+    ]
+    for result in results:
+        throughput = '-'
+        if result.processed_bytes is not None and result.wall_time > 0:
+            throughput = f'{result.processed_bytes / result.wall_time / 1024 / 1024:.1f} MB/s'
+        lines.append(f'| {result.name} | {result.wall_time:.3f} s | {throughput} | {result.peak_memory / 1024 / 1024:.1f} MB | {result.exit_code} |')
+    return lines
+
+def main(argv: list[str]) -> None:
+    parser = argparse.ArgumentParser(prog=Path(argv[0]).name, description='Benchmark the release tooling scripts against synthetic packages.')
+    parser.add_argument('--packages', type=int, default=30, help='number of packages to generate')
+    parser.add_argument('--entries', type=int, default=8, help='number of payload entries per package')
+    parser.add_argument('--entry-size', type=int, default=256 * 1024, help='average size of each payload entry in bytes')
+    parser.add_argument('--changed', type=float, default=0.2, help='fraction of packages which differ between the previous and next sets')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the synthetic package generator')
+    parser.add_argument('--name-iterations', type=int, default=1000, help='how many times to parse every package file name')
+    parser.add_argument('--output', type=Path, default=None, help='keep the generated packages in this directory instead of a temporary one')
+    args = parser.parse_args(argv[1:])
+
+    with tempfile.TemporaryDirectory() as temp_path:
+        output_path = args.output if args.output is not None else Path(temp_path)
+        if output_path.exists() and any(output_path.iterdir()):
+            gha.print_error(f"Output path '{output_path}' is not empty.")
+            sys.exit(1)
+
+        print(f"Generating {args.packages} packages with {args.entries} entries of ~{args.entry_size} bytes each ({args.changed:.0%} changed)...")
+        start = time.perf_counter()
+        paths = generate_packages(output_path / 'packages', args.packages, args.entries, args.entry_size, args.changed, args.seed)
+        print(f"Generated in {time.perf_counter() - start:.3f} s")
+
+        work_path = output_path / 'work'
+        work_path.mkdir()
+        lines = format_results(benchmark(paths, work_path, args.name_iterations))
+
+    print()
+    with gha.JobSummary() if 'GITHUB_STEP_SUMMARY' in os.environ else contextlib.nullcontext() as md:
+        for line in lines:
+            print(line)
+            if md is not None:
+                md.write_line(line)
+
+    gha.fail_if_errors()
+
+if __name__ == '__main__':
+    gha.run_script(main)
@@ -16,33 +16,35 @@ def get_environment_variable(name):
 
     return ret
 
-version_file_path = get_environment_variable('version_file_path')
-just_released_version = get_environment_variable('just_released_version').strip('v')
+def main(argv: list[str]) -> None:
+    version_file_path = get_environment_variable('version_file_path')
+    just_released_version = get_environment_variable('just_released_version').strip('v')
 
-if not nuget.is_valid_version(just_released_version):
-    gha.print_error('The specified just-released version is not a valid semver version.')
+    if not nuget.is_valid_version(just_released_version):
+        gha.print_error('The specified just-released version is not a valid semver version.')
 
-gha.fail_if_errors()
+    gha.fail_if_errors()
 
-#==================================================================================================
-# Bump version number
-#==================================================================================================
+    #==============================================================================================
+    # Bump version number
+    #==============================================================================================
+
+    just_released = nuget.get_version_parts(just_released_version)
+    version = just_released.replace(patch=just_released.patch + 1, prerelease=None, build_metadata=None)
 
-version = nuget.get_version_parts(just_released_version)
-version.patch += 1
-version.prerelease = None
-version.build_metadata = None
+    print(f"Bumping to version {version}")
 
-print(f"Bumping to version {version}")
+    with open(version_file_path, 'w') as f:
+        f.write("<!-- [auto-generated] This file is automatically re-created when Bonsai releases and generally should not be modified by hand [/auto-generated] -->\n")
+        f.write("<Project>\n")
+        f.write("  <PropertyGroup>\n")
+        f.write(f"    <BonsaiVersion>{version}</BonsaiVersion>\n")
+        f.write("  </PropertyGroup>\n")
+        f.write("</Project>")
 
-with open(version_file_path, 'w') as f:
-    f.write("<!-- [auto-generated] This file is automatically re-created when Bonsai releases and generally should not be modified by hand [/auto-generated] -->\n")
-    f.write("<Project>\n")
-    f.write("  <PropertyGroup>\n")
-    f.write(f"    <BonsaiVersion>{version}</BonsaiVersion>\n")
-    f.write("  </PropertyGroup>\n")
-    f.write("</Project>")
+    gha.set_environment_variable('NEXT_VERSION', str(version))
 
-gha.set_environment_variable('NEXT_VERSION', str(version))
+    gha.fail_if_errors()
 
-gha.fail_if_errors()
+if __name__ == '__main__':
+    gha.run_script(main)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# Records the reference dummy packages built from a commit in the package cache so that later runs can predict them (see predict-release-manifest.py)
+import json
+import os
+import sys
+
+from pathlib import Path
+
+import gha
+import nuget
+import msbuild
+import source_fingerprints
+
+from package_comparison import create_fingerprint
+
+def main(argv: list[str]) -> None:
+    if len(argv) != 4:
+        gha.print_error('Usage: cache-dummy-packages.py <cache-path> <dummy-packages-path> <ref>')
+        sys.exit(1)
+    else:
+        cache_path = Path(argv[1])
+        packages_path = Path(argv[2])
+        ref = argv[3]
+
+    if not packages_path.exists():
+        gha.print_error(f"Dummy packages path '{packages_path}' does not exist.")
+
+    try:
+        # Entries are only a few kilobytes each, so the cache can hold quite a few runs worth of them
+        entry_limit = int(os.getenv('cache_entry_limit') or '5000')
+    except ValueError as ex:
+        gha.print_error(f"Invalid configuration: {ex}")
+
+    # Must match how the dummy builds fingerprinted their packages (see create-package-fingerprints.py)
+    normalize_debug_information = (os.getenv('FINGERPRINT_NORMALIZED_DIGESTS') or 'false').lower() == 'true'
+    # Whether the dummy builds included symbols, packages built with and without them are cached separately
+    dummy_build_symbols = (os.getenv('DUMMY_BUILD_SYMBOLS') or 'false').lower() == 'true'
+    gha.fail_if_errors()
+
+    graph = msbuild.ProjectGraph(Path('.'), 'Bonsai.sln')
+    fingerprints = source_fingerprints.get_fingerprints(graph, source_fingerprints.get_tree(ref))
+    cache = source_fingerprints.PackageCache(cache_path, dummy_build_symbols)
+
+    cached_count = 0
+    for package in nuget.PackageDirectoryIndex(packages_path):
+        fingerprint = fingerprints.get(package.name)
+        if fingerprint is None:
+            print(f"⬜ '{package.name}' cannot be predicted")
+            continue
+
+        if package.fingerprint_path is not None:
+            with open(package.fingerprint_path, 'r', encoding='utf-8') as f:
+                package_fingerprint = json.load(f)
+        elif package.nupkg_path is not None:
+            package_fingerprint = create_fingerprint(package.nupkg_path, normalize_debug_information)
+        else:
+            continue
+
+        cache.put(package.name, fingerprint, package_fingerprint)
+        cached_count += 1
+
+    pruned_count = cache.prune(entry_limit)
+    print(f"Cached {cached_count} packages from '{ref}', pruned {pruned_count} old entries.")
+    gha.fail_if_errors()
+
+if __name__ == '__main__':
+    gha.run_script(main)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# Indexes how large each package is and what makes it large, then checks the packages against their size budgets and the previous release
+# The index records the compressed and uncompressed size of every entry of every package, it only needs the central directory of each package
+# Symbol packages aren't indexed since they aren't restored by users
+# The index is attached to releases so that the next run can compare against it, packages which weren't released are carried over from the previous index
+# so that it always describes the latest release of every package
+import json
+import os
+import sys
+
+from pathlib import Path
+from zipfile import ZipFile
+
+import gha
+import nuget
+
+from package_comparison import should_ignore
+
+INDEX_VERSION = 1
+
+# Growth smaller than this is never reported no matter the threshold, otherwise tiny packages would be flagged for trivial changes
+MINIMUM_REPORTED_GROWTH = 64 * 1024
+
+# Duplicated entries smaller than this aren't worth reporting (IE: icons and license files)
+MINIMUM_REPORTED_DUPLICATE_SIZE = 64 * 1024
+
+LARGEST_ENTRY_COUNT = 20
+
+#==================================================================================================
+# Indexing
+#==================================================================================================
+def index_package(path: Path, version: str) -> dict:
+    entries = { }
+    with ZipFile(path, 'r') as package:
+        for info in package.infolist():
+            if should_ignore(info):
+                continue
+            entries[info.filename] = {
+                'compressed_size': info.compress_size,
+                'uncompressed_size': info.file_size,
+                'crc': info.CRC,
+            }
+
+    return {
+        'version': version,
+        'file_size': path.stat().st_size,
+        'compressed_size': sum(entry['compressed_size'] for entry in entries.values()),
+        'uncompressed_size': sum(entry['uncompressed_size'] for entry in entries.values()),
+        'entries': entries,
+    }
+
+def index_packages(path: Path) -> dict[str, dict]:
+    index = { }
+    for package in nuget.PackageDirectoryIndex(path):
+        if package.nupkg_path is not None:
+            index[package.name] = index_package(package.nupkg_path, package.version)
+    return index
+
+def load_index(path: Path) -> dict[str, dict]:
+    if path.is_dir():
+        return index_packages(path)
+
+    with open(path, 'r') as index_file:
+        index = json.load(index_file)
+    if index.get('version') != INDEX_VERSION:
+        raise ValueError(f"Unsupported package size index version {index.get('version')}")
+    return index['packages']
+
+#==================================================================================================
+# Budgets and growth
+#==================================================================================================
+def format_change(size: int, previous_size: int) -> str:
+    change = size - previous_size
+    if previous_size == 0:
+        return f"{change:+,} bytes"
+    return f"{change:+,} bytes ({change / previous_size:+.1%})"
+
+# The entries which contributed the most to a package growing, for explaining why it grew
+def get_grown_entries(package: dict, previous_package: dict) -> list[tuple[str, int]]:
+    changes = []
+    for name, entry in package['entries'].items():
+        previous_entry = previous_package['entries'].get(name)
+        change = entry['compressed_size'] - (previous_entry['compressed_size'] if previous_entry is not None else 0)
+        if change > 0:
+            changes.append((name, change))
+    changes.sort(key=lambda change: change[1], reverse=True)
+    return changes[:5]
+
+def main(argv: list[str]) -> None:
+    if len(argv) != 3:
+        gha.print_error('Usage: check-package-sizes.py <packages-path> <index-output-path>')
+        sys.exit(1)
+    else:
+        packages_path = Path(argv[1])
+        index_output_path = Path(argv[2])
+
+    if not packages_path.exists():
+        gha.print_error(f"Packages path '{packages_path}' does not exist.")
+
+    # The previous release's index (or a directory of its packages) is optional, growth isn't checked without it
+    previous_path_string = os.getenv('PACKAGE_SIZE_PREVIOUS') or ''
+    previous_path = Path(previous_path_string) if previous_path_string != '' else None
+    if previous_path is not None and not previous_path.exists():
+        gha.print_error(f"Previous package sizes '{previous_path}' do not exist.")
+
+    # Budgets are the maximum size of a package file in MB as a list of `<package-id>=<budget>` separated by semicolons, `*` sets the budget for every other package
+    # IE: `*=50;Bonsai.Vision=120`
+    budgets: dict[str, float] = { }
+    for budget_string in (os.getenv('PACKAGE_SIZE_BUDGETS') or '').split(';'):
+        budget_string = budget_string.strip()
+        if budget_string == '':
+            continue
+        package_id, _, budget = budget_string.partition('=')
+        try:
+            budgets[package_id.strip().lower()] = float(budget) * 1024 * 1024
+        except ValueError:
+            gha.print_error(f"PACKAGE_SIZE_BUDGETS entry '{budget_string}' is not in the form `<package-id>=<budget in MB>`.")
+
+    # The maximum growth of a package compared to the previous release in percent
+    growth_threshold = None
+    growth_threshold_string = os.getenv('PACKAGE_SIZE_GROWTH_THRESHOLD') or ''
+    if growth_threshold_string != '':
+        try:
+            growth_threshold = float(growth_threshold_string)
+        except ValueError:
+            gha.print_error(f"PACKAGE_SIZE_GROWTH_THRESHOLD must be a percentage, got '{growth_threshold_string}'.")
+
+    # Exceeding a budget or the growth threshold only warns by default
+    enforcement = (os.getenv('PACKAGE_SIZE_ENFORCEMENT') or 'warning').lower()
+    if enforcement not in ('warning', 'error'):
+        gha.print_error(f"PACKAGE_SIZE_ENFORCEMENT must be 'warning' or 'error', got '{enforcement}'.")
+    gha.fail_if_errors()
+
+    report_problem = gha.print_error if enforcement == 'error' else gha.print_warning
+
+    with gha.profile_phase('index packages'):
+        packages = index_packages(packages_path)
+
+    previous_packages: dict[str, dict] = { }
+    if previous_path is not None:
+        try:
+            previous_packages = load_index(previous_path)
+        except (ValueError, KeyError, json.JSONDecodeError) as ex:
+            gha.print_error(f"Failed to load previous package sizes from '{previous_path}': {ex}")
+            gha.fail_if_errors()
+
+    # Package IDs are case insensitive
+    previous_packages_by_id = { name.lower(): package for name, package in previous_packages.items() }
+
+    over_budget = set()
+    over_growth = set()
+    for name, package in sorted(packages.items()):
+        budget = budgets.get(name.lower(), budgets.get('*'))
+        if budget is not None and package['file_size'] > budget:
+            over_budget.add(name)
+            report_problem(f"Package '{name}' is {package['file_size']:,} bytes, which exceeds its budget of {int(budget):,} bytes.")
+
+        previous_package = previous_packages_by_id.get(name.lower())
+        if growth_threshold is None or previous_package is None:
+            continue
+
+        growth = package['file_size'] - previous_package['file_size']
+        if growth < MINIMUM_REPORTED_GROWTH or growth * 100 <= previous_package['file_size'] * growth_threshold:
+            continue
+
+        over_growth.add(name)
+        grown_entries = ', '.join(f"'{entry_name}' ({change:+,})" for entry_name, change in get_grown_entries(package, previous_package))
+        report_problem(f"Package '{name}' grew by {format_change(package['file_size'], previous_package['file_size'])} since {previous_package['version']}, which exceeds the threshold of {growth_threshold}%. Largest growth: {grown_entries}")
+
+    #==============================================================================================
+    # Duplicates
+    #==============================================================================================
+    # The latest release of every package is what users end up restoring, so the previous release's packages are carried over into the new index
+    index_packages_by_name = dict(packages)
+    current_ids = { name.lower() for name in packages }
+    for name, package in previous_packages.items():
+        if name.lower() not in current_ids:
+            index_packages_by_name[name] = package
+
+    # Entries are considered identical when both their CRC and uncompressed size match, which only needs the central directory
+    # Neither is a cryptographic hash, but a coincidental match of both between blobs this large isn't a realistic concern for a report
+    blobs: dict[tuple[int, int], list[tuple[str, str, int]]] = { }
+    for name, package in index_packages_by_name.items():
+        for entry_name, entry in package['entries'].items():
+            if entry['uncompressed_size'] >= MINIMUM_REPORTED_DUPLICATE_SIZE:
+                blobs.setdefault((entry['crc'], entry['uncompressed_size']), []).append((name, entry_name, entry['compressed_size']))
+
+    # Duplicates are sorted by how much would be saved by only shipping them once
+    duplicates = []
+    for (_, uncompressed_size), occurrences in blobs.items():
+        if len({ name for name, _, _ in occurrences }) < 2:
+            continue
+        wasted_size = sum(compressed_size for _, _, compressed_size in occurrences) - min(compressed_size for _, _, compressed_size in occurrences)
+        duplicates.append((wasted_size, uncompressed_size, sorted(occurrences)))
+    duplicates.sort(key=lambda duplicate: duplicate[0], reverse=True)
+
+    #==============================================================================================
+    # Index and summary
+    #==============================================================================================
+    index_output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(index_output_path, 'w') as index_file:
+        json.dump({ 'version': INDEX_VERSION, 'packages': dict(sorted(index_packages_by_name.items())) }, index_file, indent=1)
+
+    total_size = sum(package['file_size'] for package in packages.values())
+    print(f"Indexed {len(packages)} packages ({total_size:,} bytes), {len(index_packages_by_name) - len(packages)} carried over from the previous release")
+
+    with gha.JobSummary() as md:
+        md.write_line("# Package sizes")
+        md.write_line()
+        if len(packages) == 0:
+            md.write_line("*There are no packages.*")
+        else:
+            md.write_line("| Package | Version | Size | Uncompressed | Entries | Change |")
+            md.write_line("|---------|---------|-----:|-------------:|--------:|-------:|")
+            for name, package in sorted(packages.items(), key=lambda item: item[1]['file_size'], reverse=True):
+                previous_package = previous_packages_by_id.get(name.lower())
+                change = format_change(package['file_size'], previous_package['file_size']) if previous_package is not None else 'New' if previous_path is not None else ''
+                marker = ' ⚠️' if name in over_budget or name in over_growth else ''
+                md.write_line(f"| {name}{marker} | {package['version']} | {package['file_size']:,} | {package['uncompressed_size']:,} | {len(package['entries'])} | {change} |")
+            md.write_line(f"| **Total** | | **{total_size:,}** | | | |")
+
+            largest_entries = sorted(((entry['compressed_size'], name, entry_name) for name, package in packages.items() for entry_name, entry in package['entries'].items()), reverse=True)
+            md.write_line()
+            md.write_line("# Largest package entries")
+            md.write_line()
+            md.write_line("| Package | Entry | Size | Uncompressed |")
+            md.write_line("|---------|-------|-----:|-------------:|")
+            for compressed_size, name, entry_name in largest_entries[:LARGEST_ENTRY_COUNT]:
+                md.write_line(f"| {name} | `{entry_name}` | {compressed_size:,} | {packages[name]['entries'][entry_name]['uncompressed_size']:,} |")
+
+        if len(duplicates) > 0:
+            md.write_line()
+            md.write_line("# Entries duplicated across packages")
+            md.write_line()
+            md.write_line("| Entry | Uncompressed | Wasted | Packages |")
+            md.write_line("|-------|-------------:|-------:|----------|")
+            for wasted_size, uncompressed_size, occurrences in duplicates:
+                entry_names = sorted({ f"`{entry_name}`" for _, entry_name, _ in occurrences })
+                md.write_line(f"| {'<br>'.join(entry_names)} | {uncompressed_size:,} | {wasted_size:,} | {', '.join(sorted({ name for name, _, _ in occurrences }))} |")
+
+    if len(duplicates) > 0:
+        print(f"{len(duplicates)} entries are duplicated across packages, wasting {sum(duplicate[0] for duplicate in duplicates):,} bytes")
+
+    gha.fail_if_errors()
+
+if __name__ == '__main__':
+    gha.run_script(main)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# Updates the test timings used to shard tests (see test_timings.py) with the TRX results of a run
+# TRX files are expected to be in a directory named after the runtime identifier of the platform they ran on, IE: <test-results-path>/*/win-x64/*.trx
+import os
+import sys
+
+from pathlib import Path
+
+import gha
+import msbuild
+import test_timings
+
+def get_environment_variable(name: str, default: str) -> str:
+    ret = os.getenv(name)
+    if ret is None or ret == '':
+        return default
+    return ret
+
+def main(argv: list[str]) -> None:
+    if len(argv) != 3:
+        gha.print_error('Usage: collect-test-timings.py <test-results-path> <timings-path>')
+        sys.exit(1)
+    else:
+        test_results_path = Path(argv[1])
+        timings_path = Path(argv[2])
+
+    try:
+        # How much the durations of this run count towards the new timings, the rest comes from the history so that one slow run doesn't reshuffle the shards
+        smoothing = float(get_environment_variable('timing_smoothing', '0.5'))
+        if not 0 < smoothing <= 1:
+            raise ValueError(f"timing_smoothing must be greater than 0 and at most 1, got {smoothing}")
+    except ValueError as ex:
+        gha.print_error(f"Invalid configuration: {ex}")
+    gha.fail_if_errors()
+
+    graph = msbuild.ProjectGraph(Path('.'), 'Bonsai.sln')
+    test_projects = { project.name: project.path for project in graph.projects.values() if project.is_test_project }
+
+    # (runtime identifier, configuration, project path) => framework => seconds
+    run_durations: dict[tuple[str, str, str], dict[str, float]] = { }
+    for trx_path in sorted(test_results_path.rglob('*.trx')):
+        try:
+            result = test_timings.read_trx(trx_path)
+        except Exception as ex:
+            gha.print_warning(f"Failed to read '{trx_path}': {ex}")
+            continue
+
+        if result is None:
+            print(f"Skipping '{trx_path}' since it does not contain any timings")
+            continue
+
+        assembly_name, framework, configuration, duration = result
+        project_path = test_projects.get(assembly_name)
+        if project_path is None:
+            print(f"Skipping '{trx_path}' since '{assembly_name}' is not a test project in the solution")
+            continue
+
+        rid = trx_path.parent.name
+        frameworks = run_durations.setdefault((rid, configuration, project_path), { })
+        # A test assembly might have been run more than once if the job was re-run, only its latest run matters
+        frameworks[framework] = duration
+
+    # The timing of a project is the time it takes to run all of its frameworks, averaged across configurations
+    new_durations: dict[str, dict[str, list[float]]] = { }
+    for (rid, _, project_path), frameworks in run_durations.items():
+        new_durations.setdefault(rid, { }).setdefault(project_path, []).append(sum(frameworks.values()))
+
+    durations = test_timings.load(timings_path)
+    for rid, projects in new_durations.items():
+        rid_durations = durations.setdefault(rid, { })
+        for project_path, project_durations in projects.items():
+            duration = sum(project_durations) / len(project_durations)
+            previous_duration = rid_durations.get(project_path)
+            rid_durations[project_path] = duration if previous_duration is None else previous_duration + (duration - previous_duration) * smoothing
+
+    # Projects which no longer exist are dropped
+    for rid_durations in durations.values():
+        for project_path in list(rid_durations):
+            if project_path not in graph.projects:
+                del rid_durations[project_path]
+
+    timings_path.parent.mkdir(parents=True, exist_ok=True)
+    test_timings.save(timings_path, durations)
+
+    with gha.JobSummary() as md:
+        md.write_line("# Test timings")
+        md.write_line()
+        if len(run_durations) == 0:
+            md.write_line("*No test results were found.*")
+        else:
+            md.write_line("| Platform | Project | This run | Average |")
+            md.write_line("|----------|---------|---------:|--------:|")
+            for rid in sorted(new_durations):
+                for project_path in sorted(new_durations[rid]):
+                    project_durations = new_durations[rid][project_path]
+                    md.write_line(f"| {rid} | `{project_path}` | {sum(project_durations) / len(project_durations):.1f}s | {durations[rid][project_path]:.1f}s |")
+
+    print(f"Collected timings for {len(run_durations)} test runs from '{test_results_path}'")
+    gha.fail_if_errors()
+
+if __name__ == '__main__':
+    gha.run_script(main)
@@ -1,18 +1,14 @@
 #!/usr/bin/env python3
-import hashlib
+import concurrent.futures
 import os
 import sys
 
 from pathlib import Path
-from zipfile import ZipFile, ZipInfo
 
 import gha
 import nuget
 
-# Symbol packages will change even for changes that we don't care about because the deterministic hash embedded in the PDB
-# is affected by the MVID of a package's dependencies. We don't want to release a new package when the only things that
-# changed were external to the package, so we don't check them.
-CHECK_SYMBOL_PACKAGES = False
+from package_comparison import ComparisonMode, DigestCache, PackageComparer, get_tiers
 
 # The following packages will always release no matter what
 always_release_packages = set([
@@ -23,204 +19,228 @@ always_release_packages = set([
     'Bonsai.Player',
 ])
 
-if len(sys.argv) != 5:
-    gha.print_error('Usage: compare-nuget-packages.py <previous-dummy-packages-path> <next-dummy-packages-path> <release-packages-path> <release-manifest-path>')
-    sys.exit(1)
-else:
-    previous_packages_path = Path(sys.argv[1])
-    next_packages_path = Path(sys.argv[2])
-    release_packages_path = Path(sys.argv[3])
-    release_manifest_path = Path(sys.argv[4])
-
-if not previous_packages_path.exists():
-    gha.print_error(f"Previous packages path '{previous_packages_path}' does not exist.")
-if not next_packages_path.exists():
-    gha.print_error(f"Next packages path '{next_packages_path}' does not exist.")
-if not release_packages_path.exists():
-    gha.print_error(f"Release packages path '{previous_packages_path}' does not exist.")
-if release_manifest_path.exists():
-    gha.print_error(f"Release manifest '{release_manifest_path}' already exists.")
-gha.fail_if_errors()
-
 def verbose_log(message: str):
     gha.print_debug(message)
 
-def should_ignore(file: ZipInfo) -> bool:
-    # Ignore metadata files which change on every pack
-    if file.filename == '_rels/.rels':
-        return True
-    if file.filename.startswith('package/services/metadata/core-properties/') and file.filename.endswith('.psmdcp'):
-        return True
-    
-    # Don't care about explicit directories
-    if file.is_dir():
-        return True
-    
-    return False
-
-def nuget_packages_are_equivalent(a_path: Path, b_path: Path, is_snupkg: bool = False) -> bool:
-    verbose_log(f"Comparing '{a_path}' and '{b_path}'")
-
-    # One package exists and the other does not
-    if a_path.exists() != b_path.exists():
-        verbose_log(f"Not equivalent: Only one package actually exists")
-        return False
-    
-    # The package doesn't exist at all, assume mistake unless we're checking the optional symbol packages
-    if not a_path.exists():
-        if is_snupkg:
-            verbose_log("Equivalent: Neither package exists")
-            return True
-        raise FileNotFoundError(f"Neither package exists: '{a_path}' or '{b_path}'")
-    
-    # From this point on: Check everything and emit messages for debugging purposes
-    is_equivalent = True
-
-    # Check if corresponding symbol packages are equivalent
-    if CHECK_SYMBOL_PACKAGES and not is_snupkg:
-        if not nuget_packages_are_equivalent(a_path.with_suffix(".snupkg"), b_path.with_suffix(".snupkg"), True):
-            verbose_log("Not equivalent: Symbol packages are not equivalent")
-            is_equivalent = False
-        else:
-            verbose_log("Symbol packages are equivalent")
-
-    # Compare the contents of the packages
-    # NuGet package packing is unfortunately not fully deterministic so we cannot compare the packages directly
-    # https://github.com/NuGet/Home/issues/8601
-    with ZipFile(a_path, 'r') as a_zip, ZipFile(b_path, 'r') as b_zip:
-        b_infos = { }
-        for b_info in b_zip.infolist():
-            if should_ignore(b_info):
-                continue
-            assert b_info.filename not in b_infos
-            b_infos[b_info.filename] = b_info
-
-        for a_info in a_zip.infolist():
-            if should_ignore(a_info):
-                continue
-
-            b_info = b_infos.pop(a_info.filename, None)
-            if b_info is None:
-                verbose_log(f"Not equivalent: '{a_info.filename}' exists in '{a_path}' but not in '{b_path}'")
-                is_equivalent = False
-                continue
-
-            if a_info.CRC != b_info.CRC:
-                verbose_log(f"Not equivalent: CRCs of '{a_info.filename}' do not match between '{a_path}' and '{b_path}'")
-                is_equivalent = False
-                continue
-            
-            if a_info.file_size != b_info.file_size:
-                verbose_log(f"Not equivalent: File sizes of '{a_info.filename}' do not match between '{a_path}' and '{b_path}'")
-                is_equivalent = False
-                continue
-
-            a_hash = hashlib.file_digest(a_zip.open(a_info), 'sha256').hexdigest() # type: ignore
-            b_hash = hashlib.file_digest(b_zip.open(b_info), 'sha256').hexdigest() # type: ignore
-            if a_hash != b_hash:
-                verbose_log(f"Not equivalent: SHA256 hashes of '{a_info.filename}' do not match between '{a_path}' and '{b_path}'")
-                is_equivalent = False
-                continue
-
-        # Ensure every file in B was processed
-        if len(b_infos) > 0:
-            is_equivalent = False
-            verbose_log(f"Not equivalent: The following file(s) exist in '{a_path}' but not in '{b_path}'")
-            for filename in b_infos:
-                verbose_log(f"  '{filename}'")
-
-    return is_equivalent
-
-different_packages = []
-force_released_packages = []
-next_packages = set()
-for file in os.listdir(next_packages_path):
-    if not file.endswith(".nupkg"):
-        continue
-
-    # We don't tolerate build metadata here because the nuget_packages_are_equivalent call doesn't either
-    if not file.endswith(".99.99.99.nupkg"):
-        gha.print_error(f"Package '{file}' does not have a dummy version.")
-
-    package_name = nuget.get_package_name(file)
-    next_packages.add(package_name)
-
-    if not nuget_packages_are_equivalent(next_packages_path / file, previous_packages_path / file):
-        verbose_log(f"'{file}' differs")
-        different_packages.append(package_name)
-    elif package_name in always_release_packages:
-        force_released_packages.append(package_name)
-
-previous_packages = set()
-for file in os.listdir(previous_packages_path):
-    if file.endswith(".nupkg"):
-        previous_packages.add(nuget.get_package_name(file))
-
-release_packages = set()
-for file in os.listdir(release_packages_path):
-    if file.endswith(".nupkg"):
-        release_packages.add(nuget.get_package_name(file))
-
-with gha.JobSummary() as md:
-    def write_both(line: str = ''):
-        print(line)
-        md.write_line(line)
-    
-    print()
-    different_packages.sort()
-    md.write_line("# Packages with changes\n")
-    if len(different_packages) == 0:
-        print("There are no packages with any changes.")
-        md.write_line("*There are no packages with any changes.*")
+def main(argv: list[str]) -> None:
+    if len(argv) != 5:
+        gha.print_error('Usage: compare-nuget-packages.py <previous-dummy-packages-path> <next-dummy-packages-path> <release-packages-path> <release-manifest-path>')
+        sys.exit(1)
     else:
-        print("The following packages have changes:")
-        for package in different_packages:
-            print(f"  {package}")
-            md.write_line(f"* {package}")
-
-    if len(force_released_packages) > 0:
-        write_both()
-        write_both("The following packages are configured to release anyway despite not being changed:")
-        md.write_line()
-        force_released_packages.sort()
-        for package in force_released_packages:
-            print(f"  {package}")
-            md.write_line(f"* {package}")
-
-        different_packages += force_released_packages
-        different_packages.sort()
+        previous_packages_path = Path(argv[1])
+        next_packages_path = Path(argv[2])
+        release_packages_path = Path(argv[3])
+        release_manifest_path = Path(argv[4])
+
+    if not previous_packages_path.exists():
+        gha.print_error(f"Previous packages path '{previous_packages_path}' does not exist.")
+    if not next_packages_path.exists():
+        gha.print_error(f"Next packages path '{next_packages_path}' does not exist.")
+    if not release_packages_path.exists():
+        gha.print_error(f"Release packages path '{previous_packages_path}' does not exist.")
+    if release_manifest_path.exists():
+        gha.print_error(f"Release manifest '{release_manifest_path}' already exists.")
+
+    # The number of workers is configurable so that comparison can run serially (the default) or across all cores of the runner
+    worker_count = 1
+    worker_count_string = os.getenv('COMPARE_WORKERS')
+    if worker_count_string is not None and worker_count_string != '':
+        if worker_count_string == 'auto':
+            worker_count = os.cpu_count() or 1
+        elif not worker_count_string.isdigit() or int(worker_count_string) < 1:
+            gha.print_error(f"COMPARE_WORKERS must be a positive integer or 'auto', got '{worker_count_string}'.")
+        else:
+            worker_count = int(worker_count_string)
+
+    # Decide mode stops comparing a package at its first difference, diagnose mode checks everything and logs every difference
+    # Debug messages are only visible when debug logging is enabled for the run, so we default to diagnosing only then
+    comparison_mode = ComparisonMode.DIAGNOSE if os.getenv('RUNNER_DEBUG') == '1' else ComparisonMode.DECIDE
+    comparison_mode_string = os.getenv('COMPARE_MODE')
+    if comparison_mode_string is not None and comparison_mode_string != '':
+        try:
+            comparison_mode = ComparisonMode(comparison_mode_string.lower())
+        except ValueError:
+            gha.print_error(f"COMPARE_MODE must be 'decide' or 'diagnose', got '{comparison_mode_string}'.")
+
+    # The deep hash tier is optional since the CRC and size of each entry are already a strong indication of equivalence
+    deep_hash = (os.getenv('COMPARE_DEEP_HASH') or 'true').lower() != 'false'
+
+    # Symbol packages change even for changes we don't care about because the deterministic ID embedded in each PDB (and the assembly pointing at it)
+    # is affected by the MVIDs of a package's dependencies. We don't want to release a new package when the only things that changed were external to it,
+    # so symbol packages are only checked when opted into, in which case assemblies and PDBs are compared with those fields masked out (see pdb_normalizer.py)
+    # The reference dummy builds must include symbols for this to do anything, see Bonsai.yml
+    check_symbol_packages = (os.getenv('COMPARE_SYMBOL_PACKAGES') or 'false').lower() == 'true'
+    if check_symbol_packages and not deep_hash:
+        gha.print_error("COMPARE_SYMBOL_PACKAGES requires the deep hash tier, since that's where assemblies and PDBs are normalized.")
+
+    # Opt-in fast path for the deep hash tier which compares the compressed bytes of entries before falling back to hashing them
+    compare_raw_streams = (os.getenv('COMPARE_RAW_STREAMS') or 'false').lower() == 'true'
+
+    # Unique blobs are only inflated and hashed once no matter how many packages or comparisons they appear in, 0 disables this
+    digest_cache = None
+    digest_cache_size_string = os.getenv('COMPARE_DIGEST_CACHE_ENTRIES') or '4096'
+    if not digest_cache_size_string.isdigit():
+        gha.print_error(f"COMPARE_DIGEST_CACHE_ENTRIES must be a non-negative integer, got '{digest_cache_size_string}'.")
+    elif int(digest_cache_size_string) > 0:
+        digest_cache = DigestCache(int(digest_cache_size_string))
+
+    gha.fail_if_errors()
+
+    # Each package is logged as its own group, the session keeps the groups of packages compared in parallel from interleaving
+    def compare_package(session: gha.CommandSession, comparer: PackageComparer, file: str) -> bool:
+        with session.group(f"Comparing {file}") as group, gha.profile_phase(f"package {file}"):
+            is_equivalent = comparer.packages_are_equivalent(next_packages_path / file, previous_packages_path / file)
+            if not is_equivalent:
+                verbose_log(f"'{file}' differs")
+            group.title = f"{'⬜' if is_equivalent else '🟧'} {file} {'is unchanged' if is_equivalent else 'differs'}"
+        return is_equivalent
+
+    # Each directory is only scanned once, packages which are only present as a fingerprint are included
+    with gha.profile_phase('index packages'):
+        previous_index = nuget.PackageDirectoryIndex(previous_packages_path)
+        next_index = nuget.PackageDirectoryIndex(next_packages_path)
+        release_index = nuget.PackageDirectoryIndex(release_packages_path)
+
+    different_packages = []
+    force_released_packages = []
+    next_packages = next_index.names()
+    previous_packages = previous_index.names()
+    release_packages = release_index.names()
+
+    # Predicted packages (see predict-release-manifest.py) are only fingerprints, there's no symbol package to compare
+    # Comparing them anyway would silently find every symbol package equivalent since neither side has one
+    if check_symbol_packages:
+        for index in (previous_index, next_index):
+            for package in index:
+                if package.nupkg_path is None:
+                    gha.print_error(f"Symbol packages cannot be compared since '{package.name}' in '{index.path}' is only a fingerprint, the reference dummy packages must be built rather than predicted.")
+        gha.fail_if_errors()
+
+    next_package_list = list(next_index)
+    for package in next_package_list:
+        # We don't tolerate build metadata here because the packages_are_equivalent call doesn't either
+        if package.version != '99.99.99':
+            gha.print_error(f"Package '{package.file_name}' does not have a dummy version.")
+
+    # Packages are compared on one pool while their large entries are hashed on another
+    # The pools must be separate since package workers block on the entry workers
+    with gha.profile_phase('compare packages'), gha.CommandSession() as session, \
+        concurrent.futures.ThreadPoolExecutor(worker_count) as package_executor, concurrent.futures.ThreadPoolExecutor(worker_count) as entry_executor:
+        comparer = PackageComparer(
+            mode=comparison_mode,
+            tiers=get_tiers(deep_hash),
+            check_symbol_packages=check_symbol_packages,
+            log=verbose_log,
+            entry_executor=entry_executor if worker_count > 1 else None,
+            compare_raw_streams=compare_raw_streams,
+            digest_cache=digest_cache,
+            normalize_debug_information=check_symbol_packages,
+        )
+
+        print(f"Comparing {len(next_package_list)} packages in {comparison_mode.value} mode using {', '.join(tier.name for tier in comparer.tiers)} tiers")
+        if worker_count > 1:
+            print(f"Comparing using {worker_count} workers")
+            results = package_executor.map(lambda package: compare_package(session, comparer, package.file_name), next_package_list)
+        else:
+            results = map(lambda package: compare_package(session, comparer, package.file_name), next_package_list)
 
-    # Ensure the next dummy reference and release package sets contain the same packages
-    def list_missing_peers(heading: str, md_heading: str, packages: set[str]) -> bool:
-        if len(packages) == 0:
-            return False
+        # Results are processed in the same order as a serial run
+        for package, is_equivalent in zip(next_package_list, results):
+            if not is_equivalent:
+                different_packages.append(package.name)
+            elif package.name in always_release_packages:
+                force_released_packages.append(package.name)
 
-        sorted_packages = list(packages)
-        sorted_packages.sort()
+    with gha.JobSummary() as md:
+        def write_both(line: str = ''):
+            print(line)
+            md.write_line(line)
 
         print()
-        print(heading)
-        md.write_line(f"# {md_heading}")
-        md.write_line()
-        md.write_line(heading)
-        md.write_line()
-        for package in sorted_packages:
-            print(f"  {package}")
-            md.write_line(f"* {package}")
-        return True
-
-    list_missing_peers("The following packages are new for this release:", "New packages", next_packages - previous_packages)
-    list_missing_peers("The following packages were removed during this release:", "Removed packages", previous_packages - next_packages)
-
-    if list_missing_peers("The following packages exist in the release package artifact, but not in the next dummy reference artifact:", "⚠ Missing reference packages", release_packages - next_packages):
-        gha.print_error("Some packages exist in the release package artifact, but not in the next dummy reference artifact.")
-    if list_missing_peers("The following packages exist in the next dummy reference artifact, but not in the release package artifact:", "⚠ Missing release packages", next_packages - release_packages):
-        gha.print_error("Some packages exist in the next dummy reference artifact, but not in the release package artifact.")
-    if list_missing_peers("The following packages are marked to always release but do not exist:", "⚠ Missing always-release packages", always_release_packages - release_packages):
-        gha.print_error("Some packages exist in the always-release list, but not in the release package artifact.")
-
-with open(release_manifest_path, 'x') as manifest:
-    for package in different_packages:
-        manifest.write(f"{package}\n")
-
-gha.fail_if_errors()
+        different_packages.sort()
+        md.write_line("# Packages with changes\n")
+        if len(different_packages) == 0:
+            print("There are no packages with any changes.")
+            md.write_line("*There are no packages with any changes.*")
+        else:
+            print("The following packages have changes:")
+            for package in different_packages:
+                print(f"  {package}")
+                md.write_line(f"* {package}")
+
+        if len(force_released_packages) > 0:
+            write_both()
+            write_both("The following packages are configured to release anyway despite not being changed:")
+            md.write_line()
+            force_released_packages.sort()
+            for package in force_released_packages:
+                print(f"  {package}")
+                md.write_line(f"* {package}")
+
+            different_packages += force_released_packages
+            different_packages.sort()
+
+        # Ensure the next dummy reference and release package sets contain the same packages
+        def list_missing_peers(heading: str, md_heading: str, packages: set[str]) -> bool:
+            if len(packages) == 0:
+                return False
+
+            sorted_packages = list(packages)
+            sorted_packages.sort()
+
+            print()
+            print(heading)
+            md.write_line(f"# {md_heading}")
+            md.write_line()
+            md.write_line(heading)
+            md.write_line()
+            for package in sorted_packages:
+                print(f"  {package}")
+                md.write_line(f"* {package}")
+            return True
+
+        list_missing_peers("The following packages are new for this release:", "New packages", next_packages - previous_packages)
+        list_missing_peers("The following packages were removed during this release:", "Removed packages", previous_packages - next_packages)
+
+        if list_missing_peers("The following packages exist in the release package artifact, but not in the next dummy reference artifact:", "⚠ Missing reference packages", release_packages - next_packages):
+            gha.print_error("Some packages exist in the release package artifact, but not in the next dummy reference artifact.")
+        if list_missing_peers("The following packages exist in the next dummy reference artifact, but not in the release package artifact:", "⚠ Missing release packages", next_packages - release_packages):
+            gha.print_error("Some packages exist in the next dummy reference artifact, but not in the release package artifact.")
+        if list_missing_peers("The following packages are marked to always release but do not exist:", "⚠ Missing always-release packages", always_release_packages - release_packages):
+            gha.print_error("Some packages exist in the always-release list, but not in the release package artifact.")
+
+        if comparer.identical_files > 0:
+            md.write_line()
+            md.write_line(f"{comparer.identical_files} packages were identical files and didn't need to be compared entry by entry.")
+            print()
+            print(f"{comparer.identical_files} packages were identical files")
+
+        if digest_cache is not None and digest_cache.hits + digest_cache.misses > 0:
+            md.write_line()
+            md.write_line("# Digest cache")
+            md.write_line()
+            md.write_line("| Hits | Misses | Evictions | Bytes not inflated again | Compressed bytes hashed for lookups |")
+            md.write_line("|-----:|-------:|----------:|-------------------------:|------------------------------------:|")
+            md.write_line(f"| {digest_cache.hits} | {digest_cache.misses} | {digest_cache.evictions} | {digest_cache.hit_bytes:,} | {digest_cache.key_bytes:,} |")
+            print()
+            print(f"Digest cache: {digest_cache.hits} hits ({digest_cache.hit_bytes:,} bytes not inflated again), {digest_cache.misses} misses, {digest_cache.evictions} evictions")
+
+        # Symbol packages are opt-in because of their cost, so it's always reported
+        if check_symbol_packages:
+            md.write_line()
+            md.write_line("# Symbol packages")
+            md.write_line()
+            md.write_line("| Symbol packages compared | Time comparing symbol packages | Time normalizing assemblies and PDBs |")
+            md.write_line("|-------------------------:|-------------------------------:|-------------------------------------:|")
+            md.write_line(f"| {comparer.symbol_package_comparisons} | {comparer.symbol_package_seconds:.2f}s | {comparer.normalization_seconds:.2f}s |")
+            print()
+            print(f"Symbol packages: {comparer.symbol_package_comparisons} compared in {comparer.symbol_package_seconds:.2f}s, {comparer.normalization_seconds:.2f}s spent normalizing assemblies and PDBs")
+
+    with open(release_manifest_path, 'x') as manifest:
+        for package in different_packages:
+            manifest.write(f"{package}\n")
+
+    gha.fail_if_errors()
+
+if __name__ == '__main__':
+    gha.run_script(main)
@@ -1,64 +1,248 @@
 #!/usr/bin/env python3
+import copy
 import json
 import os
+import subprocess
+
+from pathlib import Path
 
 import gha
+import msbuild
+import test_timings
+
+# Symbol packages can only be compared when both reference dummy builds include symbols (see compare-nuget-packages.py)
+# The previous dummy build uses the build tooling of the previous release, so they're only included once that tooling supports it
+DUMMY_BUILD_SYMBOLS_PROPERTY = 'IncludeReferenceDummyBuildSymbols'
+
+# Solution filters used to prune the matrix (see main)
+SOLUTION_PATH = 'Bonsai.sln'
+BUILD_FILTER_PATH = 'artifacts/Affected.slnf'
+TEST_FILTER_PATH = 'artifacts/AffectedTests.slnf'
+
+def get_changed_files(base_ref: str) -> list[str] | None:
+    # A new branch has no previous commit to compare against
+    if base_ref == '' or set(base_ref) == set('0'):
+        return None
+
+    try:
+        # Three dots compares against the merge base, so changes made to the base in the meantime don't count
+        result = subprocess.run(['git', 'diff', '--name-only', f'{base_ref}...HEAD'], capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as ex:
+        gha.print_warning(f"Failed to determine which files changed since '{base_ref}', everything will be built: {ex.stderr.strip()}")
+        return None
+    return [line for line in result.stdout.splitlines() if line != '']
 
-matrix = [ ]
-
-def add(name: str, runner_os: str, rid: str, configurations: list[str] = ['Debug', 'Release']):
-    platform = {
-        'name': name,
-        'os': runner_os,
-        'rid': rid,
-    }
-
-    ret = { }
-    for configuration in configurations:
-        job = {
-            'platform': platform.copy(),
-            'configuration': configuration,
-            'configuration-lower': configuration.lower(),
-            'job-title': f"{name} {configuration}",
-            'artifacts-suffix': '',
+def main(argv: list[str]) -> None:
+    matrix = [ ]
+
+    def add(name: str, runner_os: str, rid: str, configurations: list[str] = ['Debug', 'Release']):
+        platform = {
+            'name': name,
+            'os': runner_os,
+            'rid': rid,
         }
-        matrix.append(job)
-        ret[configuration] = job
-    return ret
-
-windows = add('Windows x64', 'windows-latest', 'win-x64')
-linux = add('Linux x64', 'ubuntu-22.04', 'linux-x64')
-
-# Collect packages and create installer from Windows Release x64
-windows['Release']['collect-packages'] = True
-windows['Release']['create-installer'] = True
-
-# Build dummy packages to determine which ones changed (not relevant for pull requests since we won't publish)
-def add_dummy(name: str, artifacts_suffix: str):
-    dummy = add(name, 'ubuntu-latest', 'linux-x64', ['Release'])['Release']
-    dummy['skip-tests'] = True
-    dummy['collect-packages'] = True
-    dummy['dummy-build'] = True
-    dummy['title'] = name # Don't include configuration in dummy target titles
-    dummy['artifacts-suffix'] = artifacts_suffix
-    return dummy
-
-enable_package_comparison = os.getenv('enable_package_comparison') == 'true'
-github_event_name = os.getenv('GITHUB_EVENT_NAME')
-
-if github_event_name != 'pull_request' and enable_package_comparison:
-    add_dummy('Previous Dummy', '-dummy-prev')['checkout-ref'] = 'refs/tags/latest'
-    add_dummy('Next Dummy', '-dummy-next')
-
-# Fail early if we won't be able to do package comparison and the run must publish packages to make logical sense
-# Package comparison requires the `latest` tag to exist, but it will usually either be missing or invalid for forks so we require it to be opt-in
-if not enable_package_comparison:
-    if github_event_name == 'release' or (github_event_name == 'workflow_dispatch' and os.getenv('will_publish_packages') == 'true'):
-        gha.print_error('Release aborted. We would not be able to determine which packages need to be released as this repository is not configured for package comparison.')
-
-# Output
-matrix_json = json.dumps({ "include": matrix }, indent=2)
-print(matrix_json)
-gha.set_output('matrix', matrix_json)
-
-gha.fail_if_errors()
+
+        ret = { }
+        for configuration in configurations:
+            job = {
+                'platform': platform.copy(),
+                'configuration': configuration,
+                'configuration-lower': configuration.lower(),
+                'job-title': f"{name} {configuration}",
+                'artifacts-suffix': '',
+            }
+            matrix.append(job)
+            ret[configuration] = job
+        return ret
+
+    windows = add('Windows x64', 'windows-latest', 'win-x64')
+    add('Linux x64', 'ubuntu-22.04', 'linux-x64')
+
+    # Collect packages and create installer from Windows Release x64
+    windows['Release']['collect-packages'] = True
+    windows['Release']['create-installer'] = True
+
+    # Build dummy packages to determine which ones changed (not relevant for pull requests since we won't publish)
+    def add_dummy(name: str, artifacts_suffix: str):
+        dummy = add(name, 'ubuntu-latest', 'linux-x64', ['Release'])['Release']
+        dummy['skip-tests'] = True
+        dummy['collect-packages'] = True
+        dummy['dummy-build'] = True
+        dummy['title'] = name # Don't include configuration in dummy target titles
+        dummy['artifacts-suffix'] = artifacts_suffix
+        return dummy
+
+    enable_package_comparison = os.getenv('enable_package_comparison') == 'true'
+    github_event_name = os.getenv('GITHUB_EVENT_NAME')
+
+    # The dummy builds can be skipped when every dummy package was predicted from its source fingerprint (see predict-release-manifest.py)
+    skip_dummy_builds = os.getenv('skip_dummy_builds') == 'true'
+
+    next_dummy = None
+    if github_event_name != 'pull_request' and enable_package_comparison and not skip_dummy_builds:
+        add_dummy('Previous Dummy', '-dummy-prev')['checkout-ref'] = 'refs/tags/latest'
+        next_dummy = add_dummy('Next Dummy', '-dummy-next')
+    dummy_build_symbols = False
+    if next_dummy is not None and os.getenv('dummy_build_symbols') == 'true':
+        result = subprocess.run(['git', 'show', 'refs/tags/latest:tooling/Versioning.props'], capture_output=True, text=True)
+        if result.returncode != 0 or DUMMY_BUILD_SYMBOLS_PROPERTY not in result.stdout:
+            gha.print_warning(f"The previous release does not support {DUMMY_BUILD_SYMBOLS_PROPERTY}, symbol packages will not be compared until it does.")
+        else:
+            dummy_build_symbols = True
+            for job in matrix:
+                if job.get('dummy-build'):
+                    job['dummy-build-symbols'] = True
+    gha.set_output('dummy-build-symbols', dummy_build_symbols)
+
+    # Fail early if we won't be able to do package comparison and the run must publish packages to make logical sense
+    # Package comparison requires the `latest` tag to exist, but it will usually either be missing or invalid for forks so we require it to be opt-in
+    if not enable_package_comparison:
+        if github_event_name == 'release' or (github_event_name == 'workflow_dispatch' and os.getenv('will_publish_packages') == 'true'):
+            gha.print_error('Release aborted. We would not be able to determine which packages need to be released as this repository is not configured for package comparison.')
+
+    # Prune the matrix down to the projects affected by the changes being built
+    # Jobs which produce artifacts always build everything, but they only run the affected tests
+    change_base_ref = os.getenv('change_base_ref') or ''
+    enable_matrix_pruning = os.getenv('enable_matrix_pruning') != 'false'
+
+    graph = None
+    def get_graph() -> msbuild.ProjectGraph:
+        nonlocal graph
+        if graph is None:
+            graph = msbuild.ProjectGraph(Path('.'), SOLUTION_PATH)
+        return graph
+
+    affected_projects = None
+    if enable_matrix_pruning and github_event_name in ('push', 'pull_request'):
+        changed_files = get_changed_files(change_base_ref)
+        if changed_files is not None:
+            print(f"{len(changed_files)} files changed since {change_base_ref}")
+            try:
+                affected_projects = get_graph().get_affected_projects(changed_files)
+            except Exception as ex:
+                # The build itself will report broken projects, no reason to fail here
+                gha.print_warning(f"Failed to load the project graph, everything will be built: {ex}")
+
+    if affected_projects is not None:
+        affected_project_paths = sorted(project.path for project in affected_projects)
+        affected_test_project_paths = sorted(project.path for project in affected_projects if project.is_test_project)
+
+        pruned_matrix = []
+        for job in matrix:
+            # Dummy builds are compared against each other and must be complete
+            if job.get('dummy-build'):
+                pruned_matrix.append(job)
+                continue
+
+            solution_filters = { }
+            if not job.get('collect-packages') and not job.get('create-installer'):
+                if len(affected_project_paths) == 0:
+                    print(f"Dropping '{job['job-title']}' since no projects are affected")
+                    continue
+                job['solution'] = BUILD_FILTER_PATH
+                solution_filters[BUILD_FILTER_PATH] = affected_project_paths
+
+            if len(affected_test_project_paths) == 0:
+                job['skip-tests'] = True
+            else:
+                job['test-solution'] = TEST_FILTER_PATH
+                solution_filters[TEST_FILTER_PATH] = affected_test_project_paths
+
+            if len(solution_filters) > 0:
+                job['solution-filters'] = solution_filters
+            pruned_matrix.append(job)
+        matrix = pruned_matrix
+
+        with gha.JobSummary() as md:
+            md.write_line("# Affected projects")
+            md.write_line()
+            if len(affected_project_paths) == 0:
+                md.write_line("*No projects are affected by the changes.*")
+            for path in affected_project_paths:
+                md.write_line(f"* `{path}`")
+
+    # Split the tests of each job into shards which run in parallel jobs, balanced using the test timings of previous runs
+    # The first shard runs in the original job, the others get jobs of their own which only build the test projects they run
+    try:
+        test_shard_count = int(os.getenv('test_shard_count') or '1')
+        if test_shard_count < 1:
+            raise ValueError(f"test_shard_count must be at least 1, got {test_shard_count}")
+    except ValueError as ex:
+        gha.print_error(f"Invalid configuration: {ex}")
+        test_shard_count = 1
+
+    test_timings_path = os.getenv('test_timings_path')
+    shard_summaries: list[tuple[str, int, list[str], float]] = []
+    if test_shard_count > 1:
+        durations = { }
+        try:
+            durations = test_timings.load(Path(test_timings_path) if test_timings_path else None)
+            if len(durations) == 0:
+                print("There are no test timings, tests will be sharded assuming they all take as long as each other")
+
+            if affected_projects is not None:
+                test_project_paths = affected_test_project_paths
+            else:
+                test_project_paths = sorted(project.path for project in get_graph().projects.values() if project.is_test_project)
+        except Exception as ex:
+            gha.print_warning(f"Failed to load the test projects, tests will not be sharded: {ex}")
+            test_project_paths = []
+
+        sharded_matrix = []
+        for job in matrix:
+            sharded_matrix.append(job)
+            if job.get('dummy-build') or job.get('skip-tests'):
+                continue
+
+            shards = test_timings.create_shards(test_project_paths, durations.get(job['platform']['rid'], { }), test_shard_count)
+            if len(shards) < 2:
+                continue
+
+            for index, (shard_project_paths, estimated_duration) in enumerate(shards):
+                shard_number = index + 1
+                test_filter_path = f'artifacts/Tests-{shard_number}.slnf'
+                shard_summaries.append((job['job-title'], shard_number, shard_project_paths, estimated_duration))
+
+                if index == 0:
+                    shard_job = job
+                    # The shard filter replaces the filter of affected tests
+                    shard_job.get('solution-filters', { }).pop(TEST_FILTER_PATH, None)
+                else:
+                    shard_job = copy.deepcopy(job)
+                    for key in ('collect-packages', 'create-installer', 'solution-filters'):
+                        shard_job.pop(key, None)
+
+                    shard_build_filter_path = f'artifacts/Tests-{shard_number}-build.slnf'
+                    shard_projects = set(get_graph().projects[path] for path in shard_project_paths)
+                    shard_job['solution'] = shard_build_filter_path
+                    shard_job['solution-filters'] = { shard_build_filter_path: sorted(project.path for project in get_graph().get_referenced_projects(shard_projects)) }
+                    shard_job['artifacts-suffix'] = f"{job['artifacts-suffix']}-tests-{shard_number}"
+                    sharded_matrix.append(shard_job)
+
+                shard_job['shard-suffix'] = f" (tests {shard_number}/{len(shards)})"
+                shard_job['test-solution'] = test_filter_path
+                shard_job.setdefault('solution-filters', { })[test_filter_path] = shard_project_paths
+        matrix = sharded_matrix
+
+        if len(shard_summaries) > 0:
+            with gha.JobSummary() as md:
+                md.write_line("# Test shards")
+                md.write_line()
+                md.write_line("| Job | Shard | Estimated duration | Projects |")
+                md.write_line("|-----|------:|-------------------:|----------|")
+                for job_title, shard_number, shard_project_paths, estimated_duration in shard_summaries:
+                    md.write_line(f"| {job_title} | {shard_number} | {estimated_duration:.0f}s | {', '.join(f'`{path}`' for path in shard_project_paths)} |")
+
+    for job in matrix:
+        job.setdefault('solution', SOLUTION_PATH)
+        job.setdefault('test-solution', job['solution'])
+
+    # Output
+    matrix_json = json.dumps({ "include": matrix }, indent=2)
+    print(matrix_json)
+    gha.set_output('matrix', matrix_json)
+
+    gha.fail_if_errors()
+
+if __name__ == '__main__':
+    gha.run_script(main)
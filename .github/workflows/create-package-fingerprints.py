@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+import os
+import sys
+
+from pathlib import Path
+
+import gha
+
+from package_comparison import write_fingerprint
+
+def main(argv: list[str]) -> None:
+    if len(argv) != 2:
+        gha.print_error('Usage: create-package-fingerprints.py <packages-path>')
+        sys.exit(1)
+    else:
+        packages_path = Path(argv[1])
+
+    if not packages_path.exists():
+        gha.print_error(f"Packages path '{packages_path}' does not exist.")
+    gha.fail_if_errors()
+
+    # Normalized hashes of assemblies and PDBs are only needed when symbol packages will be compared (see compare-nuget-packages.py)
+    normalize_debug_information = (os.getenv('FINGERPRINT_NORMALIZED_DIGESTS') or 'false').lower() == 'true'
+
+    file_names = os.listdir(packages_path)
+    file_names.sort()
+    for file_name in file_names:
+        extension = Path(file_name).suffix.lower()
+        if extension != '.nupkg' and extension != '.snupkg':
+            continue
+
+        fingerprint_path = write_fingerprint(packages_path / file_name, normalize_debug_information)
+        print(f"Fingerprinted '{file_name}' to '{fingerprint_path.name}'")
+
+    gha.fail_if_errors()
+
+if __name__ == '__main__':
+    gha.run_script(main)
@@ -1,54 +1,215 @@
 #!/usr/bin/env python3
+import concurrent.futures
+import hashlib
 import os
+import shutil
 import sys
+import time
 import zipfile
 
+from pathlib import Path
+
 import gha
+import nuget
+import offline_packages
+import parallel_deflate
+import zip_delta
+
+# This must not be `Packages`, which is where Bonsai.exe installs packages
+OFFLINE_PACKAGES_DIRECTORY = 'OfflinePackages'
 
-if len(sys.argv) != 3:
-    gha.print_error('Usage: create-portable-zip.py <output_path> <release|debug>')
-    sys.exit(1)
-else:
-    output_path = sys.argv[1]
-    configuration = sys.argv[2].lower()
-
-with zipfile.ZipFile(output_path, 'x', zipfile.ZIP_DEFLATED, compresslevel=9) as output:
-    output.mkdir('Extensions')
-
-    output.write(f'artifacts/bin/Bonsai/{configuration}-repacked/Bonsai.exe', 'Bonsai.exe')
-
-    nuget_config = [
-        '<?xml version="1.0" encoding="utf-8"?>',
-        '<configuration>',
-        '  <packageSources>',
-    ]
-
-    nuget_api_url = os.getenv('NUGET_API_URL')
-    if nuget_api_url is not None and nuget_api_url != 'https://api.nuget.org/v3/index.json':
-        nuget_config.append(f'    <add key="NuGet Package Testing Feed" value="{nuget_api_url}" />')
-
-    # Unstable builds of Bonsai will automatically reference the GitHub Packages feed
-    if os.getenv('IS_FULL_RELEASE') == 'false':
-        repo_owner = os.getenv('GITHUB_REPOSITORY_OWNER') or 'bonsai-rx'
-        nuget_config.append(f'    <add key="Bonsai Unstable" value="https://nuget.pkg.github.com/{repo_owner}/index.json" />')
-        nuget_config.append('  </packageSources>')
-        nuget_config.append('  <packageSourceCredentials>')
-        nuget_config.append('    <!--')
-        nuget_config.append('      To authenticate with the Bonsai Unstable package feed, you need to manually authenticate with GitHub by filling the YOUR_GITHUB_XYZ fields below.')
-        nuget_config.append('      You can create a personal access token by following the instructions at the link below, you only need to grant the read:packages scope.')
-        nuget_config.append('      https://docs.github.com/authentication/keeping-your-account-and-data-secure/managing-your-personal-access-tokens#creating-a-personal-access-token-classic')
-        nuget_config.append('    -->')
-        nuget_config.append('    <Bonsai_x0020_Unstable>')
-        nuget_config.append('      <add key="Username" value="YOUR_GITHUB_USERNAME" />')
-        nuget_config.append('      <add key="ClearTextPassword" value="YOUR_GITHUB_PERSONAL_ACCESS_TOKEN" />')
-        nuget_config.append('    </Bonsai_x0020_Unstable>')
-        nuget_config.append('  </packageSourceCredentials>')
+def main(argv: list[str]) -> None:
+    if len(argv) != 3:
+        gha.print_error('Usage: create-portable-zip.py <output_path> <release|debug>')
+        sys.exit(1)
     else:
-        nuget_config.append('  </packageSources>')
+        output_path = argv[1]
+        configuration = argv[2].lower()
+
+    compression_level = 9
+    compression_level_string = os.getenv('PORTABLE_ZIP_COMPRESSION_LEVEL')
+    if compression_level_string is not None and compression_level_string != '':
+        if not compression_level_string.isdigit() or int(compression_level_string) > 9:
+            gha.print_error(f"PORTABLE_ZIP_COMPRESSION_LEVEL must be an integer between 0 and 9, got '{compression_level_string}'.")
+        else:
+            compression_level = int(compression_level_string)
+
+    # Large files are compressed across all cores of the runner by default, setting this to 1 compresses them serially instead
+    worker_count = os.cpu_count() or 1
+    worker_count_string = os.getenv('PORTABLE_ZIP_WORKERS')
+    if worker_count_string is not None and worker_count_string != '' and worker_count_string != 'auto':
+        if not worker_count_string.isdigit() or int(worker_count_string) < 1:
+            gha.print_error(f"PORTABLE_ZIP_WORKERS must be a positive integer or 'auto', got '{worker_count_string}'.")
+        else:
+            worker_count = int(worker_count_string)
+
+    # In reproducible mode (the default) the zip only depends on the contents of its files, so rebuilding the same Bonsai.exe results in a byte-identical zip
+    # Timestamps are taken from SOURCE_DATE_EPOCH if it's set (https://reproducible-builds.org/specs/source-date-epoch/), otherwise the earliest time zip supports is used
+    reproducible = (os.getenv('PORTABLE_ZIP_REPRODUCIBLE') or 'true').lower() != 'false'
+    reproducible_date_time = (1980, 1, 1, 0, 0, 0)
+    source_date_epoch = os.getenv('SOURCE_DATE_EPOCH')
+    if source_date_epoch is not None and source_date_epoch != '':
+        if not source_date_epoch.isdigit():
+            gha.print_error(f"SOURCE_DATE_EPOCH must be a non-negative integer, got '{source_date_epoch}'.")
+        else:
+            reproducible_date_time = max(reproducible_date_time, time.gmtime(int(source_date_epoch))[:6])
+
+    # Optionally create a delta from a previous portable zip so that users can update without downloading the whole thing (see zip_delta.py)
+    delta_base_path = os.getenv('PORTABLE_ZIP_DELTA_BASE') or None
+    delta_output_path = os.getenv('PORTABLE_ZIP_DELTA_OUTPUT') or None
+    if (delta_base_path is None) != (delta_output_path is None):
+        gha.print_error("PORTABLE_ZIP_DELTA_BASE and PORTABLE_ZIP_DELTA_OUTPUT must be specified together.")
+    elif delta_base_path is not None and not reproducible:
+        gha.print_warning("Portable zip deltas are only effective for reproducible zips.")
+    # Optionally include the given packages (and everything they depend on) in the zip as a local package source so Bonsai can be installed without network access
+    # This is a semicolon-separated list of package IDs, IE: `Bonsai;Bonsai.StarterPack`
+    offline_package_ids = [id.strip() for id in (os.getenv('PORTABLE_ZIP_OFFLINE_PACKAGES') or '').split(';') if id.strip() != '']
+    offline_packages_path = Path(os.getenv('PORTABLE_ZIP_PACKAGES_PATH') or f'artifacts/package/{configuration}')
+    if len(offline_package_ids) > 0 and not offline_packages_path.is_dir():
+        gha.print_error(f"Offline packages were requested but the packages directory '{offline_packages_path}' does not exist.")
+    gha.fail_if_errors()
+
+    def get_entry_info(name: str, is_directory: bool = False) -> zipfile.ZipInfo:
+        info = zipfile.ZipInfo(name, reproducible_date_time)
+        # zipfile records the OS it's running on by default, Unix attributes are always used instead so the zip is the same no matter which runner created it
+        info.create_system = 3
+        if is_directory:
+            info.external_attr = (0o40755 << 16) | 0x10
+            info.CRC = info.compress_size = info.file_size = 0
+        else:
+            info.external_attr = 0o100644 << 16
+            info.compress_type = zipfile.ZIP_DEFLATED
+        return info
+
+    # Resolve the offline packages before the zip is created so missing packages are reported up front
+    offline_package_list: list[offline_packages.OfflinePackage] = []
+    if len(offline_package_ids) > 0:
+        with gha.profile_phase('resolve offline packages'):
+            global_packages = offline_packages.GlobalPackagesFolder(offline_packages.GlobalPackagesFolder.get_default_path())
+            offline_package_list, missing_packages = offline_packages.resolve(offline_package_ids, nuget.PackageDirectoryIndex(offline_packages_path), global_packages)
+
+        for dependent, id, version_range in missing_packages:
+            if dependent == '':
+                gha.print_error(f"Offline package '{id}' was not found in '{offline_packages_path}' or the NuGet global packages folder.")
+            else:
+                # The package can still be installed from a remote feed, so this doesn't fail the build
+                gha.print_warning(f"Offline package '{id}' {version_range or ''} (a dependency of '{dependent}') was not found, it will not be available offline.")
+        gha.fail_if_errors()
+
+    with zipfile.ZipFile(output_path, 'x', zipfile.ZIP_DEFLATED, compresslevel=compression_level) as output, \
+        concurrent.futures.ThreadPoolExecutor(worker_count) as executor:
+        # Entries are always written in the same order
+        output.mkdir(get_entry_info('Extensions/', is_directory=True) if reproducible else 'Extensions')
+
+        # The chunked compression used for parallel compression doesn't depend on the number of workers but it's slightly different from compressing serially,
+        # so it's always used in reproducible mode to keep the output from depending on the runner's core count
+        with gha.profile_phase('compress Bonsai.exe'):
+            parallel_deflate.write(output, f'artifacts/bin/Bonsai/{configuration}-repacked/Bonsai.exe', get_entry_info('Bonsai.exe') if reproducible else 'Bonsai.exe', compression_level, executor if worker_count > 1 or reproducible else None)
+
+        # Packages are already compressed, so they're stored as-is (which also lets zip deltas copy unchanged packages between releases)
+        if len(offline_package_list) > 0:
+            with gha.profile_phase('add offline packages'):
+                output.mkdir(get_entry_info(f'{OFFLINE_PACKAGES_DIRECTORY}/', is_directory=True) if reproducible else OFFLINE_PACKAGES_DIRECTORY)
+                for package in offline_package_list:
+                    entry_name = f'{OFFLINE_PACKAGES_DIRECTORY}/{package.file_name}'
+                    info = get_entry_info(entry_name) if reproducible else zipfile.ZipInfo.from_file(package.path, entry_name)
+                    info.compress_type = zipfile.ZIP_STORED
+                    with open(package.path, 'rb') as source, output.open(info, 'w') as destination:
+                        shutil.copyfileobj(source, destination, 1024 * 1024)
+
+        nuget_config = [
+            '<?xml version="1.0" encoding="utf-8"?>',
+            '<configuration>',
+            '  <packageSources>',
+        ]
+
+        # The offline packages come first so they're used before any remote feed (relative paths are relative to NuGet.config)
+        if len(offline_package_list) > 0:
+            nuget_config.append(f'    <add key="Bonsai Offline Packages" value="{OFFLINE_PACKAGES_DIRECTORY}" />')
+
+        nuget_api_url = os.getenv('NUGET_API_URL')
+        if nuget_api_url is not None and nuget_api_url != 'https://api.nuget.org/v3/index.json':
+            nuget_config.append(f'    <add key="NuGet Package Testing Feed" value="{nuget_api_url}" />')
+
+        # Unstable builds of Bonsai will automatically reference the GitHub Packages feed
+        if os.getenv('IS_FULL_RELEASE') == 'false':
+            repo_owner = os.getenv('GITHUB_REPOSITORY_OWNER') or 'bonsai-rx'
+            nuget_config.append(f'    <add key="Bonsai Unstable" value="https://nuget.pkg.github.com/{repo_owner}/index.json" />')
+            nuget_config.append('  </packageSources>')
+            nuget_config.append('  <packageSourceCredentials>')
+            nuget_config.append('    <!--')
+            nuget_config.append('      To authenticate with the Bonsai Unstable package feed, you need to manually authenticate with GitHub by filling the YOUR_GITHUB_XYZ fields below.')
+            nuget_config.append('      You can create a personal access token by following the instructions at the link below, you only need to grant the read:packages scope.')
+            nuget_config.append('      https://docs.github.com/authentication/keeping-your-account-and-data-secure/managing-your-personal-access-tokens#creating-a-personal-access-token-classic')
+            nuget_config.append('    -->')
+            nuget_config.append('    <Bonsai_x0020_Unstable>')
+            nuget_config.append('      <add key="Username" value="YOUR_GITHUB_USERNAME" />')
+            nuget_config.append('      <add key="ClearTextPassword" value="YOUR_GITHUB_PERSONAL_ACCESS_TOKEN" />')
+            nuget_config.append('    </Bonsai_x0020_Unstable>')
+            nuget_config.append('  </packageSourceCredentials>')
+        else:
+            nuget_config.append('  </packageSources>')
+
+        nuget_config.append('</configuration>')
+        nuget_config.append('')
+
+        output.writestr(get_entry_info('NuGet.config') if reproducible else 'NuGet.config', '\r\n'.join(nuget_config))
+
+    if len(offline_package_list) > 0:
+        with gha.JobSummary() as md:
+            md.write_line("# Portable zip offline packages")
+            md.write_line()
+            md.write_line("| Package | Version | Source | Size |")
+            md.write_line("|---------|---------|--------|-----:|")
+            for package in offline_package_list:
+                md.write_line(f"| {package.id} | {package.version} | {'Built' if package.is_built else 'Restored'} | {package.path.stat().st_size:,} |")
+        print(f"Added {len(offline_package_list)} offline packages to the portable zip")
+
+    # The content hash lets later steps recognize a zip they've already seen
+    # (It's only stable across runs in reproducible mode, and assumes the same versions of zlib and Python since different versions can compress differently.
+    # Python matters since parallel_deflate falls back to serial compression on versions of zipfile it doesn't support.)
+    with open(output_path, 'rb') as f:
+        content_hash = hashlib.file_digest(f, 'sha256').hexdigest()
+    print(f"Portable zip content hash: {content_hash}")
+    gha.set_output('content-hash', content_hash)
+
+    if delta_base_path is not None and delta_output_path is not None:
+        if not os.path.exists(delta_base_path):
+            gha.print_warning(f"Previous portable zip '{delta_base_path}' does not exist, a delta will not be created.")
+        else:
+            with open(delta_base_path, 'rb') as f:
+                delta_base = f.read()
+            with open(output_path, 'rb') as f:
+                delta_target = f.read()
+
+            with gha.profile_phase('create delta'):
+                statistics = zip_delta.ZipDeltaStatistics()
+                delta = zip_delta.create(delta_base, delta_target, statistics)
+
+            # The delta is only published if it actually recreates this zip
+            with gha.profile_phase('verify delta'):
+                try:
+                    reconstructed_hash = hashlib.sha256(zip_delta.apply(delta_base, delta)).hexdigest()
+                except ValueError as ex:
+                    reconstructed_hash = None
+                    gha.print_error(f"Failed to apply the portable zip delta: {ex}")
+
+            if reconstructed_hash is not None and reconstructed_hash != content_hash:
+                gha.print_error(f"Applying the portable zip delta resulted in {reconstructed_hash} rather than {content_hash}.")
+            elif reconstructed_hash is not None:
+                with open(delta_output_path, 'xb') as f:
+                    f.write(delta)
+                print(f"Created delta '{delta_output_path}' from '{delta_base_path}': {len(delta):,} bytes rather than {len(delta_target):,} bytes")
+                gha.set_output('delta-path', delta_output_path)
 
-    nuget_config.append('</configuration>')
-    nuget_config.append('')
+                with gha.JobSummary() as md:
+                    md.write_line("# Portable zip delta")
+                    md.write_line()
+                    md.write_line("| Delta size | Zip size | Copied entries | Diffed entries | Stored entries |")
+                    md.write_line("|-----------:|---------:|---------------:|---------------:|---------------:|")
+                    md.write_line(f"| {len(delta):,} | {len(delta_target):,} | {statistics.copied_entries} | {statistics.diffed_entries} | {statistics.literal_entries} |")
 
-    output.writestr('NuGet.config', '\r\n'.join(nuget_config))
+    gha.fail_if_errors()
 
-gha.fail_if_errors()
+if __name__ == '__main__':
+    gha.run_script(main)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# Writes the solution filters listed in the build matrix (see create-build-matrix.py)
+import json
+import os
+import sys
+
+from pathlib import Path
+
+import gha
+import msbuild
+
+def main(argv: list[str]) -> None:
+    if len(argv) != 2:
+        gha.print_error('Usage: create-solution-filters.py <solution-path>')
+        sys.exit(1)
+    else:
+        solution_path = argv[1]
+
+    solution_filters_json = os.getenv('SOLUTION_FILTERS')
+    if solution_filters_json is None or solution_filters_json == '':
+        gha.print_error("SOLUTION_FILTERS must be set.")
+        sys.exit(1)
+
+    solution_filters: dict[str, list[str]] = json.loads(solution_filters_json)
+    for filter_path, project_paths in solution_filters.items():
+        Path(filter_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(filter_path, 'x', encoding='utf-8') as f:
+            f.write(msbuild.create_solution_filter(solution_path, filter_path, project_paths))
+
+        print(f"{filter_path}:")
+        for project_path in project_paths:
+            print(f"  {project_path}")
+
+    gha.fail_if_errors()
+
+if __name__ == '__main__':
+    gha.run_script(main)
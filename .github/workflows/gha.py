@@ -1,20 +1,32 @@
 #!/usr/bin/env python3
 # GitHub Actions Utility Functions
 # https://docs.github.com/en/actions/reference/workflow-commands-for-github-actions
+import contextlib
+import cProfile
 import io
+import json
+import mmap
 import os
+import pstats
+import runpy
 import sys
+import threading
+import time
+import tracemalloc
 
 errors_were_printed = False
 
 def fail_if_errors():
-    if errors_were_printed:
+    # Forked processes only fail for their own errors
+    if errors_were_printed or (session is not None and not session.is_forked_child and session.errors_were_printed()):
         print("Exiting due to previous errors.")
         sys.exit(1)
 
 def print_error(message):
     global errors_were_printed
     errors_were_printed = True
+    if session is not None:
+        session.mark_error()
     print(f"::error::{message}")
 
 def print_warning(message):
@@ -26,7 +38,9 @@ def print_notice(message):
 def print_debug(message):
     print(f"::debug::{message}")
 
-def github_file_command(command, message):
+FILE_COMMANDS = ('OUTPUT', 'ENV', 'PATH')
+
+def get_command_file(command):
     command = f"GITHUB_{command}"
     command_file = os.getenv(command)
 
@@ -37,7 +51,16 @@ def github_file_command(command, message):
     if not os.path.exists(command_file):
         print_error(f"'{command}' points to non-existent file '{command_file}')")
         sys.exit(1)
-    
+
+    return command_file
+
+def github_file_command(command, message):
+    # Command sessions resolve the command files once when they start
+    if session is not None:
+        session.write_command(command, message)
+        return
+
+    command_file = get_command_file(command)
     with open(command_file, 'a') as command_file_handle:
         command_file_handle.write(message)
         command_file_handle.write('\n')
@@ -82,23 +105,402 @@ class JobSummary:
         if self.file is not None:
             self.file.__exit__(exc_type, exc_val, exc_tb)
 
-if __name__ == "__main__":
-    args = sys.argv
+#==================================================================================================
+# Command sessions
+#==================================================================================================
+# By default every command is written immediately, which is slow when a script emits thousands of them.
+# Within a command session, output and file commands are buffered and written in batches and everything is flushed when the session ends:
+#
+#     with gha.CommandSession() as session:
+#         with session.group('Title') as group:
+#             gha.print_debug('...')
+#             group.title = 'Better title' # Groups are written as a whole when they end, so their title can be changed until then
+#
+# Sessions are safe to use from worker threads. Output printed within a group is buffered per thread so groups never interleave.
+# They're also safe to use from worker processes forked while the session is active: Forked processes write through immediately
+# (they can't be relied on to flush at exit) and errors they print are shared with the parent process for fail_if_errors.
+#
+# Worker processes which are spawned rather than forked (IE: multiprocessing's 'spawn' and 'forkserver' start methods, the default outside of Linux) are
+# not supported. They import this module from scratch so they don't see the session at all: their output and commands are written directly, and
+# errors they print are not seen by the parent's fail_if_errors, so the parent must check their results itself.
+#
+# The file command paths (GITHUB_OUTPUT, etc.) are resolved once when the session starts, changing them while the session is active has no effect.
+class CommandGroup:
+    def __init__(self, title: str):
+        self.title = title
+        self.lines: list[str] = []
+
+class SessionOutput(io.TextIOBase):
+    def __init__(self, session: 'CommandSession'):
+        self.session = session
+
+    def write(self, text: str) -> int:
+        self.session.write_output(text)
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+class CommandSession:
+    # Buffered output is written out once it gets this big
+    OUTPUT_FLUSH_THRESHOLD = 64 * 1024
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.thread_state = threading.local()
+        self.output: list[str] = []
+        self.output_size = 0
+        self.commands: dict[str, list[str]] = { }
+        self.command_file_paths: dict[str, str | None] = { }
+        self.command_files: dict[str, int] = { }
+        self.is_forked_child = False
+        self.stdout = sys.stdout
+        # Shared with forked processes so that errors printed by them aren't lost (or printed twice)
+        self.error_flag = mmap.mmap(-1, 1)
+
+    def __enter__(self):
+        global session
+        if session is not None:
+            raise RuntimeError("Only one command session can be active at a time.")
+
+        # Command files which are missing are only reported if they're actually used (see write_command)
+        for command in FILE_COMMANDS:
+            command_file = os.getenv(f"GITHUB_{command}")
+            self.command_file_paths[command] = command_file if command_file is not None and os.path.exists(command_file) else None
+
+        self.stdout.flush()
+        sys.stdout = SessionOutput(self)
+        session = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        global session, errors_were_printed
+        try:
+            self.flush()
+        finally:
+            sys.stdout = self.stdout
+            session = None
+            for command_file in self.command_files.values():
+                os.close(command_file)
+            self.command_files.clear()
+
+            if self.errors_were_printed():
+                errors_were_printed = True
+
+    def mark_error(self) -> None:
+        self.error_flag[0] = 1
+
+    def errors_were_printed(self) -> bool:
+        return self.error_flag[0] != 0
+
+    def group(self, title: str):
+        @contextlib.contextmanager
+        def buffer_group():
+            groups = getattr(self.thread_state, 'groups', None)
+            if groups is None:
+                groups = self.thread_state.groups = []
+
+            group = CommandGroup(title)
+            groups.append(group)
+            try:
+                yield group
+            finally:
+                groups.pop()
+                text = ''.join(group.lines)
+                if text != '' and not text.endswith('\n'):
+                    text += '\n'
+
+                # GitHub Actions doesn't support nested groups, so they're just merged into their parent
+                if len(groups) > 0:
+                    groups[-1].lines.append(text)
+                else:
+                    self.write_output(f"::group::{group.title}\n{text}::endgroup::\n")
+        return buffer_group()
+
+    def write_output(self, text: str) -> None:
+        groups = getattr(self.thread_state, 'groups', None)
+        if groups:
+            groups[-1].lines.append(text)
+            return
+
+        with self.lock:
+            self.output.append(text)
+            self.output_size += len(text)
+            if self.is_forked_child or self.output_size >= self.OUTPUT_FLUSH_THRESHOLD:
+                self.flush_output()
+
+    def write_command(self, command: str, message: str) -> None:
+        command_file = self.command_file_paths.get(command)
+        if command_file is None:
+            # This reports why the command file isn't available
+            command_file = get_command_file(command)
+
+        with self.lock:
+            self.commands.setdefault(command_file, []).append(f"{message}\n")
+            if self.is_forked_child:
+                self.flush_commands()
+
+    def flush_output(self) -> None:
+        with self.lock:
+            if len(self.output) == 0:
+                return
+            self.stdout.write(''.join(self.output))
+            self.stdout.flush()
+            self.output.clear()
+            self.output_size = 0
+
+    def flush_commands(self) -> None:
+        with self.lock:
+            for command_file, messages in self.commands.items():
+                if len(messages) == 0:
+                    continue
+
+                handle = self.command_files.get(command_file)
+                if handle is None:
+                    handle = self.command_files[command_file] = os.open(command_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+
+                # Appends of a single write are atomic, so commands written by different processes never interleave
+                data = ''.join(messages).encode('utf-8')
+                written = os.write(handle, data)
+                if written != len(data):
+                    raise IOError(f"Failed to write to '{command_file}', only {written} of {len(data)} bytes were written.")
+                messages.clear()
+
+    def flush(self) -> None:
+        with self.lock:
+            self.flush_output()
+            self.flush_commands()
+
+    def after_fork_in_child(self) -> None:
+        # The lock might've been held by another thread of the parent when it forked and the buffers belong to the parent, which will flush them itself
+        self.lock = threading.RLock()
+        self.thread_state = threading.local()
+        self.output = []
+        self.output_size = 0
+        self.commands = { }
+        self.command_files = { }
+        self.is_forked_child = True
+
+session: CommandSession | None = None
+
+def after_fork_in_child() -> None:
+    # Errors printed by the parent are the parent's to report
+    global errors_were_printed
+    errors_were_printed = False
+    if session is not None:
+        session.after_fork_in_child()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=after_fork_in_child)
+
+#==================================================================================================
+# Profiling
+#==================================================================================================
+# Profiling is opt-in and enabled by setting GHA_PY_PROFILE to a comma-separated list of the following:
+#   timings      Per-phase wall-clock timings (always collected when profiling, '1' and 'true' are also accepted)
+#   cprofile     cProfile hotspots (only the main thread is profiled)
+#   tracemalloc  Peak memory allocated by Python
+# Scripts are profiled when they're run using run_script (which every workflow script and the script runner do), they can mark their own phases using profile_phase.
+# Results are rendered to the job summary and written as JSON to the directory in GHA_PY_PROFILE_PATH (artifacts/profiles by default.)
+PROFILE_OPTIONS = ('timings', 'cprofile', 'tracemalloc')
+# Limits for how much of a profile is shown in the job summary (the saved profile has every phase)
+PROFILE_PHASE_COUNT = 20
+PROFILE_HOTSPOT_COUNT = 15
+
+class Profiler:
+    def __init__(self, options: set[str], script_name: str, arguments: list[str]):
+        self.script_name = script_name
+        self.arguments = arguments
+        self.lock = threading.Lock()
+        self.thread_state = threading.local()
+        self.phases: dict[str, list[float]] = { }
+        self.profile = None
+        self.tracemalloc = False
+
+        if 'cprofile' in options:
+            self.profile = cProfile.Profile()
+
+        if 'tracemalloc' in options:
+            self.tracemalloc = True
+            tracemalloc.start()
+
+        if self.profile is not None:
+            self.profile.enable()
+        self.start_time = time.perf_counter()
+
+    def phase(self, name: str):
+        @contextlib.contextmanager
+        def measure():
+            # Nested phases are named after their parents
+            stack = getattr(self.thread_state, 'stack', None)
+            if stack is None:
+                stack = self.thread_state.stack = []
+            stack.append(name)
+            full_name = ' / '.join(stack)
+            start_time = time.perf_counter()
+            try:
+                yield
+            finally:
+                duration = time.perf_counter() - start_time
+                stack.pop()
+                with self.lock:
+                    self.phases.setdefault(full_name, []).append(duration)
+        return measure()
+
+    def finish(self) -> None:
+        total_time = time.perf_counter() - self.start_time
+        if self.profile is not None:
+            self.profile.disable()
+
+        peak_memory = None
+        if self.tracemalloc:
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        phases = []
+        with self.lock:
+            for name, durations in self.phases.items():
+                phases.append({ 'name': name, 'calls': len(durations), 'total_seconds': sum(durations), 'max_seconds': max(durations) })
+        phases.sort(key=lambda phase: phase['total_seconds'], reverse=True)
+
+        hotspots = []
+        if self.profile is not None:
+            stats = pstats.Stats(self.profile).stats # type: ignore
+            for (file_name, line, function), (_, calls, total_time_in_function, cumulative_time, _) in stats.items():
+                hotspots.append({
+                    'function': f"{os.path.basename(file_name)}:{line}({function})",
+                    'calls': calls,
+                    'total_seconds': total_time_in_function,
+                    'cumulative_seconds': cumulative_time,
+                })
+            hotspots.sort(key=lambda hotspot: hotspot['total_seconds'], reverse=True)
+            hotspots = hotspots[:PROFILE_HOTSPOT_COUNT]
+
+        result = {
+            'script': self.script_name,
+            'arguments': self.arguments,
+            'total_seconds': total_time,
+            'peak_memory_bytes': peak_memory,
+            'phases': phases,
+            'hotspots': hotspots,
+        }
+
+        output_path = os.getenv('GHA_PY_PROFILE_PATH') or os.path.join('artifacts', 'profiles')
+        try:
+            os.makedirs(output_path, exist_ok=True)
+            # A process can run more than one script (see script_runner.py), so the process ID alone isn't unique
+            global profile_count
+            profile_count += 1
+            script_stem = os.path.splitext(self.script_name)[0]
+            with open(os.path.join(output_path, f"{script_stem}-{os.getpid()}-{profile_count}.json"), 'w') as f:
+                json.dump(result, f, indent=2)
+        except Exception as ex:
+            print_warning(f"Failed to save profile of '{self.script_name}': {ex}")
+
+        with JobSummary() as md:
+            md.write_line(f"### Profile of `{self.script_name}`")
+            md.write_line()
+            summary = f"Total time: {total_time:.3f} s"
+            if peak_memory is not None:
+                summary += f", peak Python memory: {peak_memory / 1024 / 1024:.1f} MB"
+            md.write_line(summary)
+            md.write_line()
+
+            if len(phases) > 0:
+                md.write_line("| Phase | Calls | Total | Max |")
+                md.write_line("|-------|------:|------:|----:|")
+                for phase in phases[:PROFILE_PHASE_COUNT]:
+                    md.write_line(f"| {phase['name']} | {phase['calls']} | {phase['total_seconds']:.3f} s | {phase['max_seconds']:.3f} s |")
+                if len(phases) > PROFILE_PHASE_COUNT:
+                    md.write_line(f"| *{len(phases) - PROFILE_PHASE_COUNT} more* | | | |")
+                md.write_line()
+
+            if len(hotspots) > 0:
+                md.write_line("| Hotspot | Calls | Own time | Cumulative |")
+                md.write_line("|---------|------:|---------:|-----------:|")
+                for hotspot in hotspots:
+                    md.write_line(f"| `{hotspot['function']}` | {hotspot['calls']} | {hotspot['total_seconds']:.3f} s | {hotspot['cumulative_seconds']:.3f} s |")
+                md.write_line()
+
+profiler: Profiler | None = None
+profile_count = 0
+# Unknown options are only reported once per process rather than once per script
+reported_profile_options: set[str] = set()
+
+# Returns the options from GHA_PY_PROFILE, or None if profiling is disabled
+def get_profile_options() -> set[str] | None:
+    profile_options = os.getenv('GHA_PY_PROFILE')
+    if profile_options is None or profile_options.lower() in ('', '0', 'false'):
+        return None
+
+    options = set()
+    for option in profile_options.split(','):
+        option = option.strip().lower()
+        if option in ('1', 'true'):
+            option = 'timings'
+        if option in PROFILE_OPTIONS:
+            options.add(option)
+        elif option not in reported_profile_options:
+            reported_profile_options.add(option)
+            print_warning(f"Unknown GHA_PY_PROFILE option '{option}', valid options are {', '.join(PROFILE_OPTIONS)}.")
+    return options
+
+# Profiles a script for the duration of the with block, does nothing when profiling is disabled
+# Scripts run while another one is being profiled (IE: by the profile command) are part of that script's profile
+def profile_script(script_name: str, arguments: list[str], options: set[str] | None = None):
+    @contextlib.contextmanager
+    def profile():
+        global profiler
+        if profiler is not None:
+            yield
+            return
+
+        profiler = Profiler(options, script_name, arguments)
+        try:
+            yield
+        finally:
+            finished_profiler = profiler
+            profiler = None
+            finished_profiler.finish()
+
+    if options is None:
+        options = get_profile_options()
+    if options is None:
+        return contextlib.nullcontext()
+    return profile()
+
+# Runs the main function of a script, profiling it when profiling is enabled
+# argv is the same as sys.argv (which is used by default)
+def run_script(main, argv: list[str] | None = None) -> None:
+    if argv is None:
+        argv = sys.argv
+    script_name = os.path.basename(argv[0]) if len(argv) > 0 and argv[0] != '' else 'python'
+    with profile_script(script_name, argv[1:]):
+        main(argv)
+
+# Measures a phase of the running script, does nothing when profiling is disabled
+def profile_phase(name: str):
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.phase(name)
+
+def main(argv: list[str]) -> None:
+    args = argv
 
     def pop_arg():
-        global args
+        nonlocal args
         if len(args) == 0:
             print_error("Bad command line, not enough arguments specified.")
             sys.exit(1)
         result = args[0]
         args = args[1:]
         return result
-    
+
     def done_parsing():
         if len(args) > 0:
             print_error("Bad command line, too many arguments specified.")
             sys.exit(1)
-    
+
     pop_arg() # Skip script name
     command = pop_arg()
     if command == "print_error":
@@ -127,8 +529,23 @@ if __name__ == "__main__":
         path = pop_arg()
         done_parsing()
         add_path(path)
+    elif command == "profile":
+        # Wraps any script with profiling, even one which doesn't import this module
+        script_path = pop_arg()
+        sys.argv = [script_path] + args
+        # If this command is already being profiled, the profile is attributed to the script instead
+        if profiler is not None:
+            profiler.script_name = os.path.basename(script_path)
+            profiler.arguments = args
+        with profile_script(os.path.basename(script_path), args, get_profile_options() or set(['timings'])), profile_phase('script'):
+            runpy.run_path(script_path, run_name='__main__')
     else:
         print_error(f"Unknown command '{command}'")
         sys.exit(1)
-    
+
     fail_if_errors()
+
+if __name__ == "__main__":
+    # Make sure scripts share this instance of the module rather than importing a second one with its own state
+    sys.modules['gha'] = sys.modules[__name__]
+    run_script(main)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# A minimal stand-in for a NuGet v3 feed for testing publish-packages.py locally, it is not used by the workflow
+# Only the resources used by publish-packages.py are implemented: the service index, package base address, and package publish
+# Packages are stored in (and served from) a plain directory, which may already contain packages
+import argparse
+import email.parser
+import email.policy
+import http.server
+import json
+import threading
+import urllib.parse
+
+from pathlib import Path
+
+import gha
+import nuget
+
+class Feed:
+    def __init__(self, packages_path: Path, api_key: str | None, transient_failure_count: int):
+        self.packages_path = packages_path
+        self.api_key = api_key
+        self.lock = threading.Lock()
+        # The first pushes fail with a 503 to exercise the retry logic of clients
+        self.transient_failures_remaining = transient_failure_count
+        # Package name (lowercase) to its normalized versions
+        self.versions: dict[str, set[str]] = { }
+        # The name and version of each package pushed, in the order they were pushed
+        self.pushed: list[tuple[str, str]] = []
+
+        index = nuget.PackageDirectoryIndex(packages_path)
+        for name in index.names():
+            for package in index.get_versions(name):
+                if package.nupkg_path is not None:
+                    self.versions.setdefault(package.name.lower(), set()).add(self.normalize_version(package.version))
+
+    @staticmethod
+    def normalize_version(version: str) -> str:
+        return version.partition('+')[0].lower()
+
+    def get_package_path(self, name: str, version: str) -> Path:
+        return self.packages_path / f"{name.lower()}.{version}.nupkg"
+
+    # Returns the HTTP status for the push
+    def push(self, api_key: str | None, content: bytes) -> int:
+        if self.api_key is not None and api_key != self.api_key:
+            return 403
+
+        with self.lock:
+            if self.transient_failures_remaining > 0:
+                self.transient_failures_remaining -= 1
+                return 503
+
+        temporary_path = self.packages_path / f".push-{threading.get_ident()}.tmp"
+        temporary_path.write_bytes(content)
+        try:
+            nuspec = nuget.read_nuspec(temporary_path)
+            name = nuspec.id
+            version = self.normalize_version(nuspec.version)
+            with self.lock:
+                versions = self.versions.setdefault(name.lower(), set())
+                if version in versions:
+                    return 409
+                temporary_path.replace(self.get_package_path(name, version))
+                versions.add(version)
+                self.pushed.append((name, version))
+        except Exception:
+            return 400
+        finally:
+            temporary_path.unlink(missing_ok=True)
+
+        print(f"Pushed {name} {version}", flush=True)
+        return 201
+
+class FeedServer(http.server.ThreadingHTTPServer):
+    # Port 0 picks a free port, see server_address for the one which was picked
+    def __init__(self, feed: Feed, port: int = 0):
+        super().__init__(('127.0.0.1', port), RequestHandler)
+        self.feed = feed
+
+    @property
+    def index_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v3/index.json"
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: FeedServer
+
+    @property
+    def feed(self) -> Feed:
+        return self.server.feed
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status: int, body: bytes = b'', content_type: str = 'application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, value):
+        self.send(200, json.dumps(value).encode('utf-8'))
+
+    def do_GET(self):
+        base_url = f"http://{self.headers.get('Host')}"
+        path = urllib.parse.urlsplit(self.path).path
+        parts = [part for part in path.split('/') if part != '']
+
+        if parts == ['v3', 'index.json']:
+            self.send_json({
+                'version': '3.0.0',
+                'resources': [
+                    { '@id': f"{base_url}/v3/flatcontainer/", '@type': 'PackageBaseAddress/3.0.0' },
+                    { '@id': f"{base_url}/api/v2/package", '@type': 'PackagePublish/2.0.0' },
+                    { '@id': f"{base_url}/api/v2/symbolpackage", '@type': 'SymbolPackagePublish/4.9.0' },
+                ],
+            })
+        elif len(parts) == 4 and parts[:2] == ['v3', 'flatcontainer'] and parts[3] == 'index.json':
+            with self.feed.lock:
+                versions = self.feed.versions.get(parts[2].lower())
+                versions = None if versions is None else sorted(versions)
+            if versions is None:
+                self.send(404)
+            else:
+                self.send_json({ 'versions': versions })
+        elif len(parts) == 5 and parts[:2] == ['v3', 'flatcontainer']:
+            package_path = self.feed.get_package_path(parts[2], parts[3])
+            if parts[4] != package_path.name or not package_path.exists():
+                self.send(404)
+            else:
+                self.send(200, package_path.read_bytes(), 'application/octet-stream')
+        else:
+            self.send(404)
+
+    def do_PUT(self):
+        path = urllib.parse.urlsplit(self.path).path.rstrip('/')
+        content = self.rfile.read(int(self.headers.get('Content-Length', '0')))
+
+        if path not in ('/api/v2/package', '/api/v2/symbolpackage'):
+            self.send(404)
+            return
+
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode('utf-8') + content)
+        payloads = [part.get_payload(decode=True) for part in message.iter_parts()] if message.is_multipart() else []
+        if len(payloads) != 1:
+            self.send(400)
+            return
+
+        # Symbol packages are accepted but not stored since nothing reads them back
+        if path == '/api/v2/symbolpackage':
+            self.send(201)
+            return
+
+        self.send(self.feed.push(self.headers.get('X-NuGet-ApiKey'), payloads[0]))
+
+def main(argv: list[str]) -> None:
+    parser = argparse.ArgumentParser(prog=Path(argv[0]).name, description='Serve a directory of packages as a minimal NuGet v3 feed.')
+    parser.add_argument('packages', type=Path, help='directory the packages are stored in')
+    parser.add_argument('--port', type=int, default=0, help='port to listen on, a free port is picked by default')
+    parser.add_argument('--api-key', default=None, help='API key required to push packages, any key is accepted by default')
+    parser.add_argument('--transient-failures', type=int, default=0, help='number of pushes which fail with HTTP 503 before pushes start succeeding')
+    args = parser.parse_args(argv[1:])
+
+    args.packages.mkdir(parents=True, exist_ok=True)
+    server = FeedServer(Feed(args.packages, args.api_key, args.transient_failures), args.port)
+    print(f"Serving '{args.packages}' at {server.index_url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    gha.run_script(main)
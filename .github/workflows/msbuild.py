@@ -0,0 +1,252 @@
+# MSBuild Project Graph
+# Just enough MSBuild evaluation to figure out which projects in a solution are affected by a set of changed files
+# Conditions are never evaluated, so anything which might be an input of a project is treated as one
+import json
+import re
+
+from pathlib import Path, PurePosixPath
+from typing import Callable
+from xml.etree import ElementTree
+
+# Files which don't affect the build no matter what changed in them
+non_build_file_names = set([
+    'LICENSE',
+    'NOTICE',
+    'CITATION.cff',
+    '.gitignore',
+    '.gitattributes',
+])
+non_build_file_extensions = set([
+    '.md',
+])
+
+solution_project_regex = re.compile(r'^Project\("\{(?P<type>[^}]+)\}"\) = "(?P<name>[^"]+)", "(?P<path>[^"]+\.csproj)"', re.MULTILINE)
+property_regex = re.compile(r'\$\((?P<name>[^)]+)\)')
+
+def local_name(element: ElementTree.Element) -> str:
+    return element.tag.rpartition('}')[2]
+
+# Paths are always relative to the repository root with forward slashes
+def normalize_path(path: str) -> str:
+    return str(PurePosixPath(*Path(path).parts)) if path != '' else ''
+
+class Project:
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self.directory = str(PurePosixPath(path).parent)
+        self.references: set['Project'] = set()
+        self.dependents: set['Project'] = set()
+        # Files outside of the project's directory which are used by it
+        self.inputs: set[str] = set()
+        self.package_id = name
+        self.is_packable = not self.is_test_project
+        # (ID, version) of each PackageReference, the version is None if it isn't specified by the project
+        self.package_references: list[tuple[str, str | None]] = []
+
+    @property
+    def is_test_project(self) -> bool:
+        return self.name.endswith('.Tests')
+
+    # Reads the properties which determine what the project packs as
+    def load_package_properties(self, document: ElementTree.Element) -> None:
+        for element in document.iter():
+            if local_name(element) == 'PackageId' and element.text is not None:
+                self.package_id = element.text.strip()
+            elif local_name(element) == 'IsPackable' and element.text is not None:
+                self.is_packable = element.text.strip().lower() == 'true'
+
+    def __repr__(self) -> str:
+        return f"Project({self.name!r})"
+
+class ProjectGraph:
+    def __init__(self, root: Path, solution_path: str):
+        self.root = root
+        self.solution_path = normalize_path(solution_path)
+        self.projects: dict[str, Project] = { }
+        # Files which affect every project
+        self.global_inputs: set[str] = set([self.solution_path, 'global.json', 'NuGet.config'])
+
+        solution = (root / solution_path).read_text(encoding='utf-8-sig')
+        for match in solution_project_regex.finditer(solution):
+            path = normalize_path(match.group('path').replace('\\', '/'))
+            self.projects[path] = Project(match.group('name'), path)
+
+        # Directory.Build.* files apply to every project, and so do the files they import
+        for file_name in root.iterdir():
+            if file_name.name.startswith('Directory.Build.'):
+                self.global_inputs.add(file_name.name)
+                if file_name.suffix in ('.props', '.targets'):
+                    self.global_inputs.update(self.get_imports(file_name.name, { 'MSBuildProjectExtension': '.csproj' }))
+
+        for project in self.projects.values():
+            self.load_project(project)
+
+        self.projects_by_package_id = { project.package_id: project for project in self.projects.values() if project.is_packable }
+
+    def resolve_path(self, relative_to: str, path: str, properties: dict[str, str]) -> str | None:
+        path = path.replace('\\', '/')
+        properties = dict(properties)
+        properties['MSBuildThisFileDirectory'] = str(PurePosixPath(relative_to).parent) + '/'
+        properties['MSBuildProjectDirectory'] = str(PurePosixPath(relative_to).parent)
+
+        # Paths with properties we don't know about can't be resolved
+        unresolved = False
+        def replace_property(match: re.Match) -> str:
+            nonlocal unresolved
+            if match.group('name') not in properties:
+                unresolved = True
+                return ''
+            return properties[match.group('name')]
+        path = property_regex.sub(replace_property, path)
+        if unresolved or '*' in path or path.strip() == '':
+            return None
+
+        if not PurePosixPath(path).is_absolute():
+            path = str(PurePosixPath(relative_to).parent / path)
+
+        try:
+            resolved = (self.root / path).resolve().relative_to(self.root.resolve())
+        except ValueError:
+            # Outside of the repository
+            return None
+        return normalize_path(str(resolved))
+
+    # Returns the files imported by an MSBuild file, recursively
+    def get_imports(self, file_path: str, properties: dict[str, str], seen: set[str] | None = None) -> set[str]:
+        seen = seen if seen is not None else set()
+        for element in ElementTree.parse(self.root / file_path).getroot().iter():
+            if local_name(element) != 'Import' or 'Project' not in element.attrib:
+                continue
+
+            imported_path = self.resolve_path(file_path, element.attrib['Project'], properties)
+            if imported_path is None or imported_path in seen or not (self.root / imported_path).is_file():
+                continue
+
+            seen.add(imported_path)
+            self.get_imports(imported_path, properties, seen)
+        return seen
+
+    def load_project(self, project: Project) -> None:
+        document = ElementTree.parse(self.root / project.path).getroot()
+        project.load_package_properties(document)
+        for element in document.iter():
+            if local_name(element) == 'PackageReference' and 'Include' in element.attrib:
+                version = element.attrib.get('Version')
+                for child in element:
+                    if local_name(child) == 'Version' and child.text is not None:
+                        version = child.text.strip()
+                project.package_references.append((element.attrib['Include'], version))
+
+            if local_name(element) == 'ProjectReference' and 'Include' in element.attrib:
+                reference_path = self.resolve_path(project.path, element.attrib['Include'], { })
+                reference = self.projects.get(reference_path) if reference_path is not None else None
+                if reference is not None:
+                    project.references.add(reference)
+                    reference.dependents.add(project)
+                continue
+
+            # Anything which looks like a path to a file outside of the project is considered an input of it
+            candidates = [element.attrib[attribute] for attribute in ('Include', 'Update', 'Project') if attribute in element.attrib]
+            if element.text is not None and ('/' in element.text or '\\' in element.text):
+                candidates.append(element.text.strip())
+
+            for candidate in candidates:
+                for path in candidate.split(';'):
+                    resolved_path = self.resolve_path(project.path, path.strip(), { })
+                    if resolved_path is not None and not self.is_in_directory(resolved_path, project.directory) and (self.root / resolved_path).is_file():
+                        project.inputs.add(resolved_path)
+
+    @staticmethod
+    def is_in_directory(path: str, directory: str) -> bool:
+        return directory == '.' or path.startswith(directory + '/')
+
+    def get_project_for_file(self, path: str) -> Project | None:
+        # Projects might be nested, so the deepest project directory wins
+        ret = None
+        for project in self.projects.values():
+            if self.is_in_directory(path, project.directory) and (ret is None or len(project.directory) > len(ret.directory)):
+                ret = project
+        return ret
+
+    # Returns None if every project is affected
+    def get_changed_projects(self, changed_files: list[str]) -> set[Project] | None:
+        ret = set()
+        for changed_file in changed_files:
+            changed_file = normalize_path(changed_file)
+            if changed_file in self.global_inputs:
+                return None
+
+            # Changes to the workflows and their scripts can affect any job
+            if changed_file.startswith('.github/'):
+                return None
+
+            project = self.get_project_for_file(changed_file)
+            if project is not None:
+                ret.add(project)
+                continue
+
+            users = [project for project in self.projects.values() if changed_file in project.inputs]
+            if len(users) > 0:
+                ret.update(users)
+                continue
+
+            # Files in the root of the repository might be picked up by MSBuild implicitly (IE: .editorconfig), so only known non-build files are ignored
+            # Files in other directories don't belong to any of the solution's projects (IE: the installer) so they don't affect any of them
+            path = PurePosixPath(changed_file)
+            if len(path.parts) == 1 and path.name not in non_build_file_names and path.suffix not in non_build_file_extensions:
+                return None
+        return ret
+
+    # Returns None if every project is affected
+    def get_affected_projects(self, changed_files: list[str]) -> set[Project] | None:
+        changed_projects = self.get_changed_projects(changed_files)
+        if changed_projects is None:
+            return None
+
+        ret = set()
+        pending = list(changed_projects)
+        while len(pending) > 0:
+            project = pending.pop()
+            if project in ret:
+                continue
+            ret.add(project)
+            pending.extend(project.dependents)
+        return ret
+
+    # Returns the given projects along with everything they reference, recursively
+    def get_referenced_projects(self, projects: set[Project]) -> set[Project]:
+        ret = set()
+        pending = list(projects)
+        while len(pending) > 0:
+            project = pending.pop()
+            if project in ret:
+                continue
+            ret.add(project)
+            pending.extend(project.references)
+        return ret
+
+# Returns the IDs of the packages packed by a solution, with its files read by read_file (IE: from a commit rather than the working tree)
+def get_solution_package_ids(solution_path: str, read_file: Callable[[str], str]) -> set[str]:
+    ret = set()
+    for match in solution_project_regex.finditer(read_file(normalize_path(solution_path))):
+        path = normalize_path(match.group('path').replace('\\', '/'))
+        project = Project(match.group('name'), path)
+        project.load_package_properties(ElementTree.fromstring(read_file(path)))
+        if project.is_packable:
+            ret.add(project.package_id)
+    return ret
+
+def create_solution_filter(solution_path: str, filter_path: str, project_paths: list[str]) -> str:
+    relative_solution_path = Path(solution_path)
+    filter_directory = PurePosixPath(normalize_path(filter_path)).parent
+    # The solution path in a filter is relative to the filter itself
+    for _ in filter_directory.parts:
+        relative_solution_path = Path('..') / relative_solution_path
+
+    return json.dumps({
+        'solution': {
+            'path': str(PurePosixPath(*relative_solution_path.parts)).replace('/', '\\'),
+            'projects': [path.replace('/', '\\') for path in sorted(project_paths)],
+        }
+    }, indent=2)
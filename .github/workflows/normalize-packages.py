@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# Rewrites the packages in a directory into their canonical form so that identical packages can be compared by their hash (see nupkg_normalizer.py)
+import concurrent.futures
+import os
+import sys
+
+from pathlib import Path
+
+import gha
+import nupkg_normalizer
+
+def main(argv: list[str]) -> None:
+    if len(argv) != 2:
+        gha.print_error('Usage: normalize-packages.py <packages-path>')
+        sys.exit(1)
+    else:
+        packages_path = Path(argv[1])
+
+    if not packages_path.exists():
+        gha.print_error(f"Packages path '{packages_path}' does not exist.")
+    gha.fail_if_errors()
+
+    file_names = sorted(file_name for file_name in os.listdir(packages_path) if Path(file_name).suffix.lower() in ('.nupkg', '.snupkg'))
+
+    def normalize(file_name: str) -> str | None:
+        try:
+            nupkg_normalizer.normalize(packages_path / file_name)
+            return None
+        except Exception as ex:
+            return str(ex)
+
+    # Compression releases the GIL, so packages are normalized in parallel
+    with gha.profile_phase('normalize packages'), concurrent.futures.ThreadPoolExecutor(os.cpu_count() or 1) as executor:
+        for file_name, error in zip(file_names, executor.map(normalize, file_names)):
+            if error is None:
+                print(f"Normalized '{file_name}'")
+            else:
+                gha.print_error(f"Failed to normalize '{file_name}': {error}")
+
+    gha.fail_if_errors()
+
+if __name__ == '__main__':
+    gha.run_script(main)
@@ -1,62 +1,422 @@
+import functools
+import os
 import re
 
+from pathlib import Path
+from typing import Iterable
+from xml.etree import ElementTree
+from zipfile import ZipFile, ZipInfo
+
 import gha
 
-package_version_regex = re.compile(r"(?P<major>0|[1-9]\d*)\.(?P<minor>0|[1-9]\d*)\.(?P<patch>0|[1-9]\d*)(?:-(?P<prerelease>(?:0|[1-9]\d*|\d*[a-zA-Z-][0-9a-zA-Z-]*)(?:\.(?:0|[1-9]\d*|\d*[a-zA-Z-][0-9a-zA-Z-]*))*))?(?:\+(?P<buildmetadata>[0-9a-zA-Z-]+(?:\.[0-9a-zA-Z-]+)*))?")
+# Alphanumeric prerelease identifiers are tried first since versions are matched as a prefix (see parse_version), otherwise `1.0.0-1a` would match as `1.0.0-1`
+package_version_regex = re.compile(r"(?P<major>0|[1-9]\d*)\.(?P<minor>0|[1-9]\d*)\.(?P<patch>0|[1-9]\d*)(?:-(?P<prerelease>(?:\d*[a-zA-Z-][0-9a-zA-Z-]*|0|[1-9]\d*)(?:\.(?:\d*[a-zA-Z-][0-9a-zA-Z-]*|0|[1-9]\d*))*))?(?:\+(?P<buildmetadata>[0-9a-zA-Z-]+(?:\.[0-9a-zA-Z-]+)*))?")
+
+#==================================================================================================
+# Package file names
+#==================================================================================================
+# Package file names are `<id>.<version>.nupkg` (or `.snupkg` for symbol packages), but both package IDs and versions can contain dots.
+# Matching them with a regex requires a lazy prefix followed by the full version pattern, which backtracks heavily on long dotted names.
+# Instead file names are split into their dot-separated tokens and every possible start of the version is checked in a single pass.
+# Each token is only ever examined a bounded number of times, so parsing is guaranteed to take linear time.
+prerelease_identifier_regex = re.compile(r"[0-9A-Za-z-]+")
+
+def is_numeric_identifier(token: str) -> bool:
+    return token.isascii() and token.isdigit() and (token == '0' or token[0] != '0')
+
+def is_prerelease_identifier(token: str) -> bool:
+    if prerelease_identifier_regex.fullmatch(token) is None:
+        return False
+    # Numeric identifiers must not have leading zeros
+    return not token.isdigit() or is_numeric_identifier(token)
+
+def is_build_metadata(build_metadata: str) -> bool:
+    return all(prerelease_identifier_regex.fullmatch(identifier) is not None for identifier in build_metadata.split('.'))
+
+# Returns the package name and version of a package file name, or None if it isn't a valid package file name
+# When a file name is ambiguous, the shortest package name wins (this matches the behavior of a lazy regex)
+# Extensions are case insensitive like they are on Windows
+def parse_package_file_name(file_name: str) -> tuple[str, str] | None:
+    lower_file_name = file_name.lower()
+    if lower_file_name.endswith('.nupkg'):
+        stem = file_name[:-len('.nupkg')]
+    elif lower_file_name.endswith('.snupkg'):
+        stem = file_name[:-len('.snupkg')]
+    else:
+        return None
+
+    # Neither package IDs nor any part of a version besides the build metadata can contain a plus, so the build metadata is anything after the last one
+    build_metadata_start = stem.rfind('+')
+    build_metadata = None
+    if build_metadata_start >= 0:
+        build_metadata = stem[build_metadata_start + 1:]
+        if not is_build_metadata(build_metadata):
+            return None
+        stem = stem[:build_metadata_start]
+
+    tokens = stem.split('.')
+    token_count = len(tokens)
+
+    # Every token from this index onwards is a valid prerelease identifier, it's only determined (once) if a prerelease is encountered
+    trailing_prerelease_start = None
+
+    # The version is at least three tokens and the package name is at least one
+    for i in range(1, token_count - 2):
+        if not is_numeric_identifier(tokens[i]) or not is_numeric_identifier(tokens[i + 1]):
+            continue
+
+        # The patch token also contains the first prerelease identifier when there is one
+        patch, separator, first_prerelease_identifier = tokens[i + 2].partition('-')
+        if not is_numeric_identifier(patch):
+            continue
+
+        if separator == '':
+            # Without a prerelease the version must end here
+            if i + 3 != token_count:
+                continue
+        else:
+            if not is_prerelease_identifier(first_prerelease_identifier):
+                continue
+
+            if trailing_prerelease_start is None:
+                trailing_prerelease_start = token_count
+                while trailing_prerelease_start > 0 and is_prerelease_identifier(tokens[trailing_prerelease_start - 1]):
+                    trailing_prerelease_start -= 1
+
+            if i + 3 < trailing_prerelease_start:
+                continue
+
+        package_name = '.'.join(tokens[:i])
+        if package_name == '':
+            continue
+
+        version = '.'.join(tokens[i:])
+        if build_metadata is not None:
+            version += f"+{build_metadata}"
+        return package_name, version
+
+    return None
 
-package_file_name_regex = re.compile(r"^(?P<package_name>.+?)\." + package_version_regex.pattern + r"\.s?nupkg$")
 def get_package_name(file_name: str) -> str:
-    match = package_file_name_regex.match(file_name)
-    if match is None:
+    parsed = parse_package_file_name(file_name)
+    if parsed is None:
         gha.print_warning(f"File name '{file_name}' does not match the expected format for a NuGet package.")
         return file_name
-    return match.group('package_name')
+    return parsed[0]
 
-def is_valid_version(version: str, forbid_build_metadata: bool = False) -> bool:
+#==================================================================================================
+# Versions
+#==================================================================================================
+# Versions are parsed through a cache since the same version strings tend to be checked over and over and the regex is expensive
+VERSION_CACHE_SIZE = 64 * 1024
+
+class SemanticVersion:
+    __slots__ = ('major', 'minor', 'patch', 'prerelease', 'build_metadata', 'precedence')
+
+    major: int
+    minor: int
+    patch: int
+    prerelease: str | None
+    build_metadata: str | None
+    precedence: tuple
+
+    def __init__(self, major: int, minor: int, patch: int, prerelease: str | None = None, build_metadata: str | None = None):
+        set_slot = object.__setattr__
+        set_slot(self, 'major', major)
+        set_slot(self, 'minor', minor)
+        set_slot(self, 'patch', patch)
+        set_slot(self, 'prerelease', prerelease)
+        set_slot(self, 'build_metadata', build_metadata)
+
+        # Precedence follows SemVer 2.0 https://semver.org/spec/v2.0.0.html#spec-item-11
+        # * Versions without a prerelease have higher precedence than those with one
+        # * Numeric prerelease identifiers are compared numerically and always have lower precedence than alphanumeric ones
+        # * A larger set of prerelease identifiers has higher precedence when all of the preceding ones are equal (which is how tuples compare)
+        # * Build metadata does not affect precedence
+        if prerelease is None:
+            prerelease_precedence = (1, )
+        else:
+            prerelease_precedence = (0, tuple((0, int(identifier), '') if identifier.isdigit() else (1, 0, identifier) for identifier in prerelease.split('.')))
+        set_slot(self, 'precedence', (major, minor, patch, prerelease_precedence))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def replace(self, **changes) -> 'SemanticVersion':
+        parts = { 'major': self.major, 'minor': self.minor, 'patch': self.patch, 'prerelease': self.prerelease, 'build_metadata': self.build_metadata }
+        parts.update(changes)
+        return SemanticVersion(**parts)
+
+    # Versions which only differ in their build metadata are considered equal
+    def __eq__(self, other):
+        if not isinstance(other, SemanticVersion):
+            return NotImplemented
+        return self.precedence == other.precedence
+
+    def __lt__(self, other):
+        if not isinstance(other, SemanticVersion):
+            return NotImplemented
+        return self.precedence < other.precedence
+
+    def __le__(self, other):
+        if not isinstance(other, SemanticVersion):
+            return NotImplemented
+        return self.precedence <= other.precedence
+
+    def __gt__(self, other):
+        if not isinstance(other, SemanticVersion):
+            return NotImplemented
+        return self.precedence > other.precedence
+
+    def __ge__(self, other):
+        if not isinstance(other, SemanticVersion):
+            return NotImplemented
+        return self.precedence >= other.precedence
+
+    def __hash__(self):
+        return hash(self.precedence)
+
+    def __str__(self):
+        ret = f"{self.major}.{self.minor}.{self.patch}"
+
+        if self.prerelease is not None:
+            ret += f"-{self.prerelease}"
+
+        if self.build_metadata is not None:
+            ret += f"+{self.build_metadata}"
+
+        return ret
+
+    def __repr__(self):
+        return f"SemanticVersion('{self}')"
+
+# Returns None for invalid versions
+# Only the start of the string has to be a version (IE: '1.2.3.4' is 1.2.3), this is how versions have always been validated here
+@functools.lru_cache(maxsize=VERSION_CACHE_SIZE)
+def parse_version(version: str) -> SemanticVersion | None:
     match = package_version_regex.match(version)
     if match is None:
+        return None
+
+    return SemanticVersion(
+        int(match.group('major')),
+        int(match.group('minor')),
+        int(match.group('patch')),
+        match.group('prerelease'),
+        match.group('buildmetadata'),
+    )
+
+# Parses many versions at once (IE: from a directory or feed listing), invalid versions are skipped
+def parse_versions(versions: Iterable[str]) -> list[SemanticVersion]:
+    ret = []
+    for version in versions:
+        parsed = parse_version(version)
+        if parsed is not None:
+            ret.append(parsed)
+    return ret
+
+# Returns the version with the highest precedence, or None if there are no (applicable) versions
+def get_latest_version(versions: Iterable[str | SemanticVersion], include_prerelease: bool = True) -> SemanticVersion | None:
+    ret = None
+    for version in versions:
+        if isinstance(version, str):
+            parsed = parse_version(version)
+            if parsed is None:
+                continue
+            version = parsed
+
+        if not include_prerelease and version.prerelease is not None:
+            continue
+
+        if ret is None or version > ret:
+            ret = version
+    return ret
+
+def is_valid_version(version: str, forbid_build_metadata: bool = False) -> bool:
+    parsed = parse_version(version)
+    if parsed is None:
         return False
     
-    if forbid_build_metadata and match.group('buildmetadata') is not None:
+    if forbid_build_metadata and parsed.build_metadata is not None:
         return False
     
     return True
 
 def is_preview_version(version: str) -> bool:
-    match = package_version_regex.match(version)
-    if match is None:
+    parsed = parse_version(version)
+    if parsed is None:
         gha.print_error(f"Version '{version}' is not a legal semver version string!")
         return True
     
-    return match.group('prerelease') is not None
+    return parsed.prerelease is not None
 
-class SemanticVersion:
-    major = 0
-    minor = 0
-    patch = 0
-    prerelease: str | None = None
-    build_metadata: str | None = None
+def get_version_parts(version: str) -> SemanticVersion:
+    parsed = parse_version(version)
+    if parsed is None:
+        raise Exception("The specified version was invalid")
+    return parsed
 
-    def __str__(self):
-        ret = f"{self.major}.{self.minor}.{self.patch}"
+#==================================================================================================
+# Nuspec metadata
+#==================================================================================================
+class NuspecDependency:
+    def __init__(self, id: str, version: str | None, target_framework: str | None):
+        self.id = id
+        # This is a version range, IE: `1.0.0` means `>= 1.0.0`
+        self.version = version
+        self.target_framework = target_framework
 
-        if self.prerelease is not None:
-            ret += f"-{self.prerelease}"
+class Nuspec:
+    def __init__(self, document: ElementTree.Element):
+        # Different versions of NuGet use different XML namespaces, so elements are matched by their local name
+        def local_name(element: ElementTree.Element) -> str:
+            return element.tag.rpartition('}')[2]
 
-        if self.build_metadata is not None:
-            ret += f"+{self.build_metadata}"
+        def find_child(parent: ElementTree.Element, name: str) -> ElementTree.Element | None:
+            for child in parent:
+                if local_name(child) == name:
+                    return child
+            return None
 
-        return ret
+        metadata = find_child(document, 'metadata')
+        if metadata is None:
+            raise ValueError("Nuspec is missing its metadata element.")
 
-def get_version_parts(version: str) -> SemanticVersion:
-    match = package_version_regex.match(version)
-    if match is None:
-        raise Exception("The specified version was invalid")
+        def get_text(name: str) -> str:
+            element = find_child(metadata, name)
+            if element is None or element.text is None:
+                raise ValueError(f"Nuspec is missing its {name} element.")
+            return element.text.strip()
 
-    ret = SemanticVersion()
-    ret.major = int(match.group('major'))
-    ret.minor = int(match.group('minor'))
-    ret.patch = int(match.group('patch'))
-    ret.prerelease = match.group('prerelease')
-    ret.build_metadata = match.group('buildmetadata')
-    return ret
+        self.document = document
+        self.id = get_text('id')
+        self.version = get_text('version')
+        self.dependencies: list[NuspecDependency] = []
+
+        dependencies = find_child(metadata, 'dependencies')
+        if dependencies is not None:
+            for child in dependencies:
+                if local_name(child) == 'dependency':
+                    self.dependencies.append(NuspecDependency(child.attrib['id'], child.attrib.get('version'), None))
+                elif local_name(child) == 'group':
+                    for dependency in child:
+                        if local_name(dependency) == 'dependency':
+                            self.dependencies.append(NuspecDependency(dependency.attrib['id'], dependency.attrib.get('version'), child.attrib.get('targetFramework')))
+
+def find_nuspec(package: ZipFile) -> ZipInfo | None:
+    for info in package.infolist():
+        if '/' not in info.filename and info.filename.endswith('.nuspec'):
+            return info
+    return None
+
+def read_nuspec(package_path: Path) -> Nuspec:
+    with ZipFile(package_path, 'r') as package:
+        info = find_nuspec(package)
+        if info is None:
+            raise ValueError(f"Package '{package_path}' does not contain a nuspec.")
+        with package.open(info) as nuspec:
+            return Nuspec(ElementTree.parse(nuspec).getroot())
+
+#==================================================================================================
+# Package directory index
+#==================================================================================================
+# Fingerprints of packages are written next to them, see package_comparison.py
+FINGERPRINT_SUFFIX = '.fingerprint.json'
+
+class IndexedPackage:
+    def __init__(self, name: str, version: str):
+        self.name = name
+        self.version = version
+        self.parsed_version = parse_version(version)
+        self.nupkg_path: Path | None = None
+        self.snupkg_path: Path | None = None
+        self.fingerprint_path: Path | None = None
+        self._nuspec: Nuspec | None = None
+
+    @property
+    def file_name(self) -> str:
+        return f"{self.name}.{self.version}.nupkg"
+
+    # The nuspec is only read the first time it's needed
+    @property
+    def nuspec(self) -> Nuspec:
+        if self._nuspec is None:
+            if self.nupkg_path is None:
+                raise FileNotFoundError(f"Package '{self.file_name}' is not available, its nuspec cannot be read.")
+            self._nuspec = read_nuspec(self.nupkg_path)
+        return self._nuspec
+
+    def get_paths(self) -> list[Path]:
+        return [path for path in (self.nupkg_path, self.snupkg_path, self.fingerprint_path) if path is not None]
+
+# Indexes the packages in a directory by name with a single scan of the directory
+# Packages which are only present as a fingerprint are included (their nupkg_path will be None)
+# A directory should only have one version of each package, the first version (by file name) is the one which is indexed by name, but every version is
+# available from get_versions so that none of them are overlooked by anything which removes packages
+class PackageDirectoryIndex:
+    def __init__(self, path: Path):
+        self.path = path
+        self.packages: dict[str, IndexedPackage] = { }
+        self.versions: dict[str, dict[str, IndexedPackage]] = { }
+        # Files which look like packages but have names we couldn't parse
+        self.unrecognized_files: list[Path] = []
+
+        with os.scandir(path) as entries:
+            file_names = sorted(entry.name for entry in entries if entry.is_file())
+
+        for file_name in file_names:
+            # Extensions are case insensitive like they are on Windows
+            lower_file_name = file_name.lower()
+            is_fingerprint = lower_file_name.endswith(FINGERPRINT_SUFFIX)
+            package_file_name = file_name[:-len(FINGERPRINT_SUFFIX)] if is_fingerprint else file_name
+            extension = Path(package_file_name).suffix.lower()
+            if extension != '.nupkg' and extension != '.snupkg':
+                continue
+
+            parsed = parse_package_file_name(package_file_name)
+            if parsed is None:
+                gha.print_warning(f"File name '{file_name}' does not match the expected format for a NuGet package.")
+                self.unrecognized_files.append(path / file_name)
+                continue
+
+            name, version = parsed
+            versions = self.versions.setdefault(name, { })
+            package = versions.get(version)
+            if package is None:
+                package = versions[version] = IndexedPackage(name, version)
+                if name not in self.packages:
+                    self.packages[name] = package
+                else:
+                    gha.print_warning(f"'{path}' contains multiple versions of '{name}', only '{self.packages[name].version}' will be considered.")
+
+            file_path = path / file_name
+            if is_fingerprint:
+                # Symbol package fingerprints are found via the path of their package
+                if extension == '.nupkg':
+                    package.fingerprint_path = file_path
+            elif extension == '.snupkg':
+                package.snupkg_path = file_path
+            else:
+                package.nupkg_path = file_path
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.packages
+
+    def __getitem__(self, name: str) -> IndexedPackage:
+        return self.packages[name]
+
+    def __iter__(self):
+        return iter(self.packages.values())
+
+    def __len__(self) -> int:
+        return len(self.packages)
+
+    def names(self) -> set[str]:
+        return set(self.packages)
+
+    # Returns every version of a package in the directory, including the ones which aren't indexed by name
+    def get_versions(self, name: str) -> list[IndexedPackage]:
+        return list(self.versions.get(name, { }).values())
@@ -0,0 +1,113 @@
+# NuGet Package Normalizer
+# Rewrites packages into a canonical form so that packages with the same contents are byte-for-byte identical, see package_comparison.py
+# NuGet pack isn't deterministic (https://github.com/NuGet/Home/issues/8601): entry timestamps are the time of packing and the relationships and
+# core properties parts have random IDs (and record the OS and runtime which packed them), so these are all replaced with stable equivalents
+# The result is still a valid package, but it's only meant for packages which are compared rather than published
+import hashlib
+import os
+import shutil
+
+from pathlib import Path
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
+from zipfile import ZIP_DEFLATED, ZipFile, ZipInfo
+
+import nuget
+
+# The earliest time zip supports, same as reproducible portable zips (see create-portable-zip.py)
+NORMALIZED_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+RELATIONSHIPS_PATH = '_rels/.rels'
+CORE_PROPERTIES_DIRECTORY = 'package/services/metadata/core-properties/'
+
+MANIFEST_RELATIONSHIP_TYPE = 'http://schemas.microsoft.com/packaging/2010/07/manifest'
+CORE_PROPERTIES_RELATIONSHIP_TYPE = 'http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties'
+
+def is_generated_part(name: str) -> bool:
+    return name == RELATIONSHIPS_PATH or (name.startswith(CORE_PROPERTIES_DIRECTORY) and name.endswith('.psmdcp'))
+
+# IDs are derived from what they identify rather than being random
+def get_stable_id(value: bytes, length: int) -> str:
+    return hashlib.sha256(value).hexdigest()[:length]
+
+def get_relationship(type: str, target: str) -> str:
+    relationship_id = 'R' + get_stable_id(target.encode('utf-8'), 16).upper()
+    return f'<Relationship Type={quoteattr(type)} Target={quoteattr(target)} Id={quoteattr(relationship_id)} />'
+
+# Mirrors the core properties NuGet writes, other than lastModifiedBy which is fixed
+def get_core_properties(nuspec: nuget.Nuspec) -> str:
+    def get_metadata(name: str) -> str | None:
+        for element in nuspec.document.iter():
+            if element.tag.rpartition('}')[2] == name and element.text is not None:
+                return element.text.strip()
+        return None
+
+    properties = [
+        ('dc:creator', get_metadata('authors')),
+        ('dc:description', get_metadata('description')),
+        ('dc:identifier', nuspec.id),
+        ('version', nuspec.version),
+        ('keywords', get_metadata('tags')),
+        ('lastModifiedBy', 'NuGet'),
+    ]
+
+    return ''.join([
+        '<?xml version="1.0" encoding="utf-8"?>',
+        '<coreProperties xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns="http://schemas.openxmlformats.org/package/2006/metadata/core-properties">',
+        *(f'<{name}>{escape(value)}</{name}>' for name, value in properties if value is not None),
+        '</coreProperties>',
+    ])
+
+def get_entry_info(name: str, file_size: int) -> ZipInfo:
+    info = ZipInfo(name, NORMALIZED_DATE_TIME)
+    # Entries are always compressed the same way, zlib's default level is used since these packages are never published
+    info.compress_type = ZIP_DEFLATED
+    info.create_system = 0
+    info.external_attr = 0
+    # The size lets zipfile decide up front whether the entry needs zip64 extensions
+    info.file_size = file_size
+    return info
+
+# Rewrites the package in place
+# Entries are sorted by name with fixed timestamps, attributes, and compression, explicit directory entries are dropped,
+# and the relationships and core properties are regenerated from the nuspec
+def normalize(package_path: Path) -> None:
+    normalized_path = package_path.with_name(package_path.name + '.normalized')
+    try:
+        with ZipFile(package_path, 'r') as package, ZipFile(normalized_path, 'w') as output:
+            nuspec_info = nuget.find_nuspec(package)
+            if nuspec_info is None:
+                raise ValueError(f"Package '{package_path}' does not contain a nuspec.")
+            nuspec_data = package.read(nuspec_info)
+            nuspec = nuget.Nuspec(ElementTree.fromstring(nuspec_data))
+
+            core_properties_path = f'{CORE_PROPERTIES_DIRECTORY}{get_stable_id(nuspec_data, 32)}.psmdcp'
+            relationships = ''.join([
+                '<?xml version="1.0" encoding="utf-8"?>',
+                '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">',
+                get_relationship(MANIFEST_RELATIONSHIP_TYPE, f'/{nuspec_info.filename}'),
+                get_relationship(CORE_PROPERTIES_RELATIONSHIP_TYPE, f'/{core_properties_path}'),
+                '</Relationships>',
+            ])
+
+            entries: dict[str, ZipInfo | bytes] = {
+                RELATIONSHIPS_PATH: relationships.encode('utf-8'),
+                core_properties_path: get_core_properties(nuspec).encode('utf-8'),
+            }
+            for info in package.infolist():
+                if not info.is_dir() and not is_generated_part(info.filename):
+                    assert info.filename not in entries
+                    entries[info.filename] = info
+
+            for name in sorted(entries):
+                entry = entries[name]
+                if isinstance(entry, bytes):
+                    output.writestr(get_entry_info(name, len(entry)), entry)
+                else:
+                    with package.open(entry, 'r') as source, output.open(get_entry_info(name, entry.file_size), 'w') as destination:
+                        shutil.copyfileobj(source, destination, 1024 * 1024)
+
+        os.replace(normalized_path, package_path)
+    finally:
+        if normalized_path.exists():
+            normalized_path.unlink()
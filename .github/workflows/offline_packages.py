@@ -0,0 +1,178 @@
+# Offline Packages
+# Collects the packages (and all of their dependencies) needed to install a set of packages without network access, see create-portable-zip.py
+# Packages come from the packages built by this run or from the NuGet global packages folder, which has every package restored while building
+# Dependencies are resolved the same way NuGet does by default, IE: to the lowest version which satisfies the dependency
+import os
+import re
+
+from pathlib import Path
+
+import nuget
+
+# The portable zip only ever runs the .NET Framework build of Bonsai
+DEFAULT_FRAMEWORK = (4, 8)
+
+target_framework_regex = re.compile(r'^(?:\.NETFramework|net)(?P<version>[0-9.]+)$', re.IGNORECASE)
+standard_framework_regex = re.compile(r'^(?:\.NETStandard|netstandard)(?P<version>[0-9.]+)$', re.IGNORECASE)
+
+# Returns the version of a .NET Framework or .NET Standard target framework, or None if it isn't one
+# IE: `net48`, `net462`, `.NETFramework4.8`, `netstandard2.0`
+def parse_framework(target_framework: str, regex: re.Pattern) -> tuple[int, ...] | None:
+    match = regex.match(target_framework)
+    if match is None:
+        return None
+
+    version = match.group('version')
+    if '.' in version:
+        # `net5.0` and later are .NET rather than .NET Framework
+        if regex is target_framework_regex and not target_framework.startswith('.'):
+            return None
+        return tuple(int(part) for part in version.split('.') if part != '')
+    return tuple(int(digit) for digit in version)
+
+# Returns the dependencies which apply to the given .NET Framework version
+# NuGet uses the dependency group of the nearest compatible framework: the highest .NET Framework version, then the highest .NET Standard version, then the group without a framework
+def get_framework_dependencies(nuspec: nuget.Nuspec, framework: tuple[int, ...] = DEFAULT_FRAMEWORK) -> list[nuget.NuspecDependency]:
+    groups: dict[str | None, list[nuget.NuspecDependency]] = { }
+    for dependency in nuspec.dependencies:
+        groups.setdefault(dependency.target_framework, []).append(dependency)
+
+    # Frameworks without any dependencies are represented by empty groups, which still need to be considered
+    for element in nuspec.document.iter():
+        if element.tag.rpartition('}')[2] == 'dependencies':
+            for group in element:
+                if group.tag.rpartition('}')[2] == 'group':
+                    groups.setdefault(group.attrib.get('targetFramework'), [])
+
+    candidates = []
+    for target_framework in groups:
+        if target_framework is None:
+            candidates.append(((0,), (), target_framework))
+            continue
+
+        framework_version = parse_framework(target_framework, target_framework_regex)
+        if framework_version is not None and framework_version <= framework:
+            candidates.append(((2,), framework_version, target_framework))
+            continue
+
+        # .NET Framework 4.6.1 and later support .NET Standard 2.0
+        standard_version = parse_framework(target_framework, standard_framework_regex)
+        if standard_version is not None and standard_version <= (2, 0):
+            candidates.append(((1,), standard_version, target_framework))
+
+    if len(candidates) == 0:
+        return []
+    return groups[max(candidates)[2]]
+
+# Returns the lowest version allowed by a version range, IE: `1.0` or `[1.0, 2.0)` are both `1.0`
+def get_minimum_version(version_range: str | None) -> str | None:
+    if version_range is None:
+        return None
+    minimum = version_range.strip().lstrip('[(').rstrip('])').split(',')[0].strip()
+    return minimum if minimum != '' else None
+
+# Returns a key which sorts versions the way NuGet does, versions can have between one and four numeric parts
+def get_version_key(version: str) -> tuple:
+    version = version.partition('+')[0]
+    release, _, prerelease = version.partition('-')
+    parts = [int(part) if part.isdigit() else 0 for part in release.split('.')]
+    parts += [0] * (4 - len(parts))
+    # Prereleases sort before their release
+    return (tuple(parts), prerelease == '', prerelease.lower())
+
+class OfflinePackage:
+    def __init__(self, id: str, version: str, path: Path, is_built: bool):
+        self.id = id
+        self.version = version
+        self.path = path
+        # Whether the package was built by this run rather than restored from a feed
+        self.is_built = is_built
+
+    @property
+    def file_name(self) -> str:
+        return f"{self.id}.{self.version}.nupkg"
+
+class GlobalPackagesFolder:
+    def __init__(self, path: Path):
+        self.path = path
+
+    @staticmethod
+    def get_default_path() -> Path:
+        path = os.getenv('NUGET_PACKAGES')
+        return Path(path) if path else Path.home() / '.nuget' / 'packages'
+
+    # Returns the lowest available version of a package which is at least the minimum version
+    # The global packages folder uses lowercase IDs and normalized versions, IE: `~/.nuget/packages/system.memory/4.5.5/system.memory.4.5.5.nupkg`
+    def find(self, id: str, minimum_version: str | None) -> OfflinePackage | None:
+        package_path = self.path / id.lower()
+        if not package_path.is_dir():
+            return None
+
+        minimum_key = get_version_key(minimum_version) if minimum_version is not None else None
+        candidates = []
+        for version_path in package_path.iterdir():
+            nupkg_path = version_path / f"{id.lower()}.{version_path.name}.nupkg"
+            if not nupkg_path.exists():
+                continue
+            key = get_version_key(version_path.name)
+            if minimum_key is None or key >= minimum_key:
+                candidates.append((key, version_path.name, nupkg_path))
+
+        if len(candidates) == 0:
+            return None
+        _, version, nupkg_path = min(candidates)
+        return OfflinePackage(id, version, nupkg_path, False)
+
+# Returns the packages needed to install the root packages along with the dependencies which could not be found as (dependent, dependency ID, version range)
+# Built packages are always preferred over restored ones since they're what the release actually contains
+# Each package is included once at the highest minimum version any of its dependents ask for, so a dependency which is reached again with a higher
+# minimum than the version already picked for it causes everything to be resolved again (minimums only go up, so this always finishes)
+def resolve(
+    root_ids: list[str],
+    built_packages: nuget.PackageDirectoryIndex,
+    global_packages: GlobalPackagesFolder,
+    framework: tuple[int, ...] = DEFAULT_FRAMEWORK,
+) -> tuple[list[OfflinePackage], list[tuple[str, str, str | None]]]:
+    # Package IDs are case insensitive, so everything is keyed by lowercase ID
+    minimum_versions: dict[str, str] = { }
+
+    def find(id: str, minimum_version: str | None) -> OfflinePackage | None:
+        for package in built_packages:
+            if package.name.lower() == id.lower() and package.nupkg_path is not None:
+                # The release only contains the built version, so a dependent needing a newer one can't be satisfied
+                if minimum_version is not None and get_version_key(package.version) < get_version_key(minimum_version):
+                    return None
+                return OfflinePackage(package.name, package.version, package.nupkg_path, True)
+        return global_packages.find(id, minimum_version)
+
+    while True:
+        resolved: dict[str, OfflinePackage] = { }
+        missing: list[tuple[str, str, str | None]] = []
+        is_resolved = True
+
+        pending: list[tuple[str, str, str | None]] = [('', id, None) for id in reversed(root_ids)]
+        while len(pending) > 0:
+            dependent, id, version_range = pending.pop()
+            key = id.lower()
+
+            minimum_version = get_minimum_version(version_range)
+            if minimum_version is not None and (key not in minimum_versions or get_version_key(minimum_version) > get_version_key(minimum_versions[key])):
+                minimum_versions[key] = minimum_version
+                if key in resolved and get_version_key(resolved[key].version) < get_version_key(minimum_version):
+                    is_resolved = False
+                    break
+
+            if key in resolved:
+                continue
+
+            package = find(id, minimum_versions.get(key))
+            if package is None:
+                missing.append((dependent, id, version_range))
+                continue
+
+            resolved[key] = package
+            for dependency in reversed(get_framework_dependencies(nuget.read_nuspec(package.path), framework)):
+                pending.append((package.id, dependency.id, dependency.version))
+
+        if is_resolved:
+            return sorted(resolved.values(), key=lambda package: package.id.lower()), missing
@@ -0,0 +1,513 @@
+# NuGet Package Comparison
+# NuGet package packing is unfortunately not fully deterministic so we cannot compare the packages directly
+# https://github.com/NuGet/Home/issues/8601
+# Instead packages are compared entry by entry through a series of increasingly expensive tiers.
+# (Packages which were normalized by nupkg_normalizer.py are deterministic, so identical files are recognized by their hash before any tier runs.)
+# Either side of a comparison can be a package or a fingerprint of one, see create-package-fingerprints.py
+import abc
+import concurrent.futures
+import enum
+import hashlib
+import json
+import mmap
+import struct
+import threading
+import time
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable
+from zipfile import ZIP_STORED, ZipFile, ZipInfo
+
+import gha
+import pdb_normalizer
+
+from nuget import FINGERPRINT_SUFFIX
+
+class ComparisonMode(enum.Enum):
+    # Stop at the first difference, used when all we need is a yes/no answer
+    DECIDE = 'decide'
+    # Check everything and log every difference for debugging purposes
+    DIAGNOSE = 'diagnose'
+
+def should_ignore(file: ZipInfo) -> bool:
+    # Ignore metadata files which change on every pack
+    if file.filename == '_rels/.rels':
+        return True
+    if file.filename.startswith('package/services/metadata/core-properties/') and file.filename.endswith('.psmdcp'):
+        return True
+
+    # Don't care about explicit directories
+    if file.is_dir():
+        return True
+
+    return False
+
+#==================================================================================================
+# Package fingerprints
+#==================================================================================================
+# A fingerprint lists the entries of a package which are relevant for comparison along with their CRC, size, and SHA256 hash
+# They're written next to the package they describe so that packages can be compared without decompressing them again (or at all)
+FINGERPRINT_FORMAT_VERSION = 1
+
+def get_fingerprint_path(package_path: Path) -> Path:
+    return package_path.with_name(package_path.name + FINGERPRINT_SUFFIX)
+
+def package_exists(package_path: Path) -> bool:
+    return package_path.exists() or get_fingerprint_path(package_path).exists()
+
+# Assemblies and PDBs can also be hashed without the fields which change with their dependencies (see pdb_normalizer.py)
+# This reads every one of them in full, so it's only done when symbol packages will be compared
+def create_fingerprint(package_path: Path, normalize_debug_information: bool = False) -> dict:
+    entries = []
+    with ZipFile(package_path, 'r') as package:
+        for info in package.infolist():
+            if should_ignore(info):
+                continue
+            entry = {
+                'name': info.filename,
+                'crc': info.CRC,
+                'size': info.file_size,
+                'sha256': hashlib.file_digest(package.open(info), 'sha256').hexdigest(), # type: ignore
+            }
+            if normalize_debug_information and pdb_normalizer.is_normalized(info.filename):
+                with package.open(info) as f:
+                    entry['normalized_sha256'] = pdb_normalizer.get_normalized_digest(info.filename, f).hex() # type: ignore
+            entries.append(entry)
+
+    entries.sort(key=lambda entry: entry['name'])
+    with open(package_path, 'rb') as f:
+        file_sha256 = hashlib.file_digest(f, 'sha256').hexdigest()
+    return {
+        'format': FINGERPRINT_FORMAT_VERSION,
+        'package': package_path.name,
+        # The hash of the whole file lets identical packages be recognized without looking at their entries (older fingerprints might not have it)
+        'sha256': file_sha256,
+        'entries': entries,
+    }
+
+def write_fingerprint(package_path: Path, normalize_debug_information: bool = False) -> Path:
+    fingerprint_path = get_fingerprint_path(package_path)
+    with open(fingerprint_path, 'w', encoding='utf-8') as f:
+        json.dump(create_fingerprint(package_path, normalize_debug_information), f, indent=2)
+        f.write('\n')
+    return fingerprint_path
+
+# Mirrors the parts of ZipInfo which are used for comparison
+class FingerprintEntry:
+    __slots__ = ('filename', 'CRC', 'file_size', 'sha256', 'normalized_sha256')
+
+    def __init__(self, filename: str, crc: int, file_size: int, sha256: bytes, normalized_sha256: bytes | None = None):
+        self.filename = filename
+        self.CRC = crc
+        self.file_size = file_size
+        self.sha256 = sha256
+        self.normalized_sha256 = normalized_sha256
+
+# Returns the hash of the whole package as recorded by its fingerprint, if it has one
+def get_recorded_file_digest(package_path: Path) -> bytes | None:
+    fingerprint_path = get_fingerprint_path(package_path)
+    if not fingerprint_path.exists():
+        return None
+    with open(fingerprint_path, 'r', encoding='utf-8') as f:
+        file_sha256 = json.load(f).get('sha256')
+    return bytes.fromhex(file_sha256) if file_sha256 is not None else None
+
+#==================================================================================================
+# Package sources
+#==================================================================================================
+class PackageSource(abc.ABC):
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries: dict[str, ZipInfo | FingerprintEntry] = { }
+
+    @abc.abstractmethod
+    def digest(self, entry) -> bytes:
+        ...
+
+    @abc.abstractmethod
+    def normalized_digest(self, entry) -> bytes:
+        ...
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+class ZipPackageSource(PackageSource):
+    def __init__(self, path: Path):
+        super().__init__(path)
+        self.zip = ZipFile(path, 'r')
+        self.mmap: mmap.mmap | None = None
+        self.mmap_lock = threading.Lock()
+        for info in self.zip.infolist():
+            if not should_ignore(info):
+                assert info.filename not in self.entries
+                self.entries[info.filename] = info
+
+    def digest(self, entry: ZipInfo) -> bytes:
+        return hashlib.file_digest(self.zip.open(entry), 'sha256').digest() # type: ignore
+
+    def normalized_digest(self, entry: ZipInfo) -> bytes:
+        with self.zip.open(entry) as f:
+            return pdb_normalizer.get_normalized_digest(entry.filename, f) # type: ignore
+
+    # Returns the memory-mapped archive along with the offset of the still-compressed data of the specified entry
+    def get_raw_data_offset(self, entry: ZipInfo) -> tuple[mmap.mmap, int]:
+        with self.mmap_lock:
+            if self.mmap is None:
+                self.mmap = mmap.mmap(self.zip.fp.fileno(), 0, access=mmap.ACCESS_READ) # type: ignore
+
+        # The length of the name and extra field in the local file header can differ from the central directory so they must be read from the local header
+        # https://pkware.cachefly.net/webdocs/casestudies/APPNOTE.TXT (Section 4.3.7)
+        signature, name_length, extra_length = struct.unpack_from('<4s22xHH', self.mmap, entry.header_offset)
+        if signature != b'PK\x03\x04':
+            raise ValueError(f"Bad local file header for '{entry.filename}' in '{self.path}'")
+        return self.mmap, entry.header_offset + 30 + name_length + extra_length
+
+    # Returns the hash of the still-compressed data of the specified entry, the mapped archive is hashed in place so nothing is copied
+    def raw_digest(self, entry: ZipInfo) -> bytes:
+        mapped, offset = self.get_raw_data_offset(entry)
+        with memoryview(mapped) as view, view[offset:offset + entry.compress_size] as raw_data:
+            return hashlib.sha256(raw_data).digest()
+
+    def close(self) -> None:
+        if self.mmap is not None:
+            self.mmap.close()
+        self.zip.close()
+
+class FingerprintPackageSource(PackageSource):
+    def __init__(self, path: Path):
+        super().__init__(path)
+        with open(get_fingerprint_path(path), 'r', encoding='utf-8') as f:
+            fingerprint = json.load(f)
+
+        if fingerprint.get('format') != FINGERPRINT_FORMAT_VERSION:
+            raise ValueError(f"Fingerprint of '{path}' has unsupported format '{fingerprint.get('format')}'")
+
+        for entry in fingerprint['entries']:
+            assert entry['name'] not in self.entries
+            normalized_sha256 = bytes.fromhex(entry['normalized_sha256']) if 'normalized_sha256' in entry else None
+            self.entries[entry['name']] = FingerprintEntry(entry['name'], entry['crc'], entry['size'], bytes.fromhex(entry['sha256']), normalized_sha256)
+
+    def digest(self, entry: FingerprintEntry) -> bytes:
+        return entry.sha256
+
+    # Fingerprints created without normalized digests (see create_fingerprint) can only offer the plain digest, which at worst makes the entry look different
+    def normalized_digest(self, entry: FingerprintEntry) -> bytes:
+        return entry.normalized_sha256 if entry.normalized_sha256 is not None else entry.sha256
+
+# Fingerprints are preferred since they never need to be decompressed
+def open_package_source(path: Path) -> PackageSource:
+    if get_fingerprint_path(path).exists():
+        return FingerprintPackageSource(path)
+    return ZipPackageSource(path)
+
+#==================================================================================================
+# Digest cache
+#==================================================================================================
+# Remembers the digests of inflated entries so that each unique blob is only inflated and hashed once per run
+# Entries are keyed by the hash of their compressed bytes, which is much cheaper to calculate than inflating and hashing them
+# Identical compressed bytes always inflate to identical contents, so unlike matching CRCs a hit never needs to be confirmed
+# This catches the same file shipped by several packages as well as entries which are unchanged between both sides of a comparison
+# Stored entries and entries smaller than min_entry_size aren't worth remembering, and the least recently used digests are evicted past max_entries
+class DigestCache:
+    def __init__(self, max_entries: int = 4096, min_entry_size: int = 64 * 1024):
+        self.max_entries = max_entries
+        self.min_entry_size = min_entry_size
+        self.digests: OrderedDict[tuple, bytes] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Inflated bytes which didn't need to be hashed again, and compressed bytes which were hashed to find them
+        self.hit_bytes = 0
+        self.key_bytes = 0
+
+    # Normalized digests depend on the kind of file (see pdb_normalizer.py) so they're kept apart from plain digests by the kind
+    def digest(self, source: ZipPackageSource, entry: ZipInfo, kind: str, calculate: Callable[[], bytes]) -> bytes:
+        if entry.compress_type == ZIP_STORED or entry.file_size < self.min_entry_size:
+            return calculate()
+
+        key = (kind, entry.compress_type, entry.file_size, source.raw_digest(entry))
+        with self.lock:
+            self.key_bytes += entry.compress_size
+            ret = self.digests.get(key)
+            if ret is not None:
+                self.digests.move_to_end(key)
+                self.hits += 1
+                self.hit_bytes += entry.file_size
+                return ret
+
+        # Hashing happens outside of the lock so that entries are still hashed concurrently
+        # Two threads might both miss on the same blob, this is harmless since they'll both calculate the same digest
+        ret = calculate()
+        with self.lock:
+            self.misses += 1
+            self.digests[key] = ret
+            self.digests.move_to_end(key)
+            while len(self.digests) > self.max_entries:
+                self.digests.popitem(last=False)
+                self.evictions += 1
+        return ret
+
+#==================================================================================================
+# Comparison
+#==================================================================================================
+class PackageComparison:
+    def __init__(self, comparer: 'PackageComparer', a: PackageSource, b: PackageSource):
+        self.comparer = comparer
+        self.a = a
+        self.b = b
+        self.a_path = a.path
+        self.b_path = b.path
+        self.a_infos = a.entries
+        self.b_infos = b.entries
+        self.is_equivalent = True
+
+        # The entries which exist in both packages, each tier removes the pairs it found to be different so later tiers don't check them again
+        self.pairs = [(a_info, self.b_infos[name]) for name, a_info in self.a_infos.items() if name in self.b_infos]
+
+    # Records a difference between the packages, returns whether the comparison should keep going
+    def difference(self, message: str) -> bool:
+        self.comparer.log(f"Not equivalent: {message}")
+        self.is_equivalent = False
+        return self.comparer.mode == ComparisonMode.DIAGNOSE
+
+class ComparisonTier(abc.ABC):
+    name = ''
+
+    @abc.abstractmethod
+    def compare(self, comparison: PackageComparison) -> None:
+        ...
+
+class EntryNamesTier(ComparisonTier):
+    name = 'names'
+
+    def compare(self, comparison: PackageComparison) -> None:
+        for name in comparison.a_infos:
+            if name not in comparison.b_infos:
+                if not comparison.difference(f"'{name}' exists in '{comparison.a_path}' but not in '{comparison.b_path}'"):
+                    return
+
+        for name in comparison.b_infos:
+            if name not in comparison.a_infos:
+                if not comparison.difference(f"'{name}' exists in '{comparison.b_path}' but not in '{comparison.a_path}'"):
+                    return
+
+class CrcAndSizeTier(ComparisonTier):
+    name = 'crc-and-size'
+
+    def compare(self, comparison: PackageComparison) -> None:
+        remaining_pairs = []
+        for a_info, b_info in comparison.pairs:
+            # Normalized entries can differ in the fields which are masked out, so their CRCs are meaningless
+            if a_info.CRC != b_info.CRC and not comparison.comparer.is_normalized(a_info.filename):
+                if not comparison.difference(f"CRCs of '{a_info.filename}' do not match between '{comparison.a_path}' and '{comparison.b_path}'"):
+                    return
+                continue
+
+            if a_info.file_size != b_info.file_size:
+                if not comparison.difference(f"File sizes of '{a_info.filename}' do not match between '{comparison.a_path}' and '{comparison.b_path}'"):
+                    return
+                continue
+
+            remaining_pairs.append((a_info, b_info))
+        comparison.pairs = remaining_pairs
+
+# Compares the still-compressed bytes of two entries without inflating them
+# Only a difference in the compressed bytes is inconclusive, the same data can be compressed differently
+# The mapped archives are compared through memoryviews so nothing is copied, memoryviews are compared element by element so the bulk is compared as 8 byte words
+def raw_streams_are_equal(a: ZipPackageSource, a_info: ZipInfo, b: ZipPackageSource, b_info: ZipInfo) -> bool:
+    if a_info.compress_type != b_info.compress_type or a_info.compress_size != b_info.compress_size:
+        return False
+
+    a_map, a_offset = a.get_raw_data_offset(a_info)
+    b_map, b_offset = b.get_raw_data_offset(b_info)
+    length = a_info.compress_size
+    word_length = length - length % 8
+    with memoryview(a_map) as a_view, memoryview(b_map) as b_view:
+        with a_view[a_offset:a_offset + word_length] as a_bytes, b_view[b_offset:b_offset + word_length] as b_bytes, \
+            a_bytes.cast('Q') as a_words, b_bytes.cast('Q') as b_words:
+            if a_words != b_words:
+                return False
+        with a_view[a_offset + word_length:a_offset + length] as a_tail, b_view[b_offset + word_length:b_offset + length] as b_tail:
+            return a_tail == b_tail
+
+class DeepHashTier(ComparisonTier):
+    name = 'deep-hash'
+
+    def entries_have_same_hash(self, comparison: PackageComparison, a_info, b_info) -> bool:
+        if comparison.comparer.compare_raw_streams and isinstance(comparison.a, ZipPackageSource) and isinstance(comparison.b, ZipPackageSource):
+            if raw_streams_are_equal(comparison.a, a_info, comparison.b, b_info):
+                return True
+
+        comparer = comparison.comparer
+        if comparer.is_normalized(a_info.filename):
+            return comparer.normalized_digest(comparison.a, a_info) == comparer.normalized_digest(comparison.b, b_info)
+        return comparer.digest(comparison.a, a_info) == comparer.digest(comparison.b, b_info)
+
+    def compare(self, comparison: PackageComparison) -> None:
+        comparer = comparison.comparer
+        executor = comparer.entry_executor
+
+        # Large entries are hashed concurrently on the entry executor when there is one
+        # (The results are still checked in entry order so that the log is the same regardless of how they were hashed.)
+        pending_hashes: list[tuple[ZipInfo, ZipInfo, concurrent.futures.Future[bool] | None]] = []
+        for a_info, b_info in comparison.pairs:
+            future = None
+            needs_hashing = isinstance(a_info, ZipInfo) or isinstance(b_info, ZipInfo)
+            if executor is not None and needs_hashing and a_info.file_size >= comparer.parallel_entry_size_threshold:
+                future = executor.submit(self.entries_have_same_hash, comparison, a_info, b_info)
+            pending_hashes.append((a_info, b_info, future))
+
+        try:
+            remaining_pairs = []
+            for a_info, b_info, future in pending_hashes:
+                same_hash = future.result() if future is not None else self.entries_have_same_hash(comparison, a_info, b_info)
+                if not same_hash:
+                    if not comparison.difference(f"SHA256 hashes of '{a_info.filename}' do not match between '{comparison.a_path}' and '{comparison.b_path}'"):
+                        return
+                    continue
+                remaining_pairs.append((a_info, b_info))
+            comparison.pairs = remaining_pairs
+        finally:
+            # Don't waste time hashing entries which no longer matter when we stopped early
+            for _, _, future in pending_hashes:
+                if future is not None:
+                    future.cancel()
+
+def get_tiers(deep_hash: bool = True) -> list[ComparisonTier]:
+    tiers = [EntryNamesTier(), CrcAndSizeTier()]
+    if deep_hash:
+        tiers.append(DeepHashTier())
+    return tiers
+
+class PackageComparer:
+    def __init__(
+        self,
+        mode: ComparisonMode = ComparisonMode.DIAGNOSE,
+        tiers: list[ComparisonTier] | None = None,
+        check_symbol_packages: bool = False,
+        log: Callable[[str], None] = gha.print_debug,
+        entry_executor: concurrent.futures.Executor | None = None,
+        parallel_entry_size_threshold: int = 1024 * 1024,
+        compare_raw_streams: bool = False,
+        digest_cache: DigestCache | None = None,
+        normalize_debug_information: bool = False,
+    ):
+        self.mode = mode
+        self.tiers = tiers if tiers is not None else get_tiers()
+        self.check_symbol_packages = check_symbol_packages
+        self.log = log
+        self.entry_executor = entry_executor
+        self.parallel_entry_size_threshold = parallel_entry_size_threshold
+        # When enabled, entries whose compressed bytes are identical are considered equal without inflating and hashing them
+        self.compare_raw_streams = compare_raw_streams
+        # Shared between every comparison made by the comparer when provided
+        self.digest_cache = digest_cache
+        # Number of packages found to be equivalent by the hash of the whole file
+        self.identical_files = 0
+        self.identical_files_lock = threading.Lock()
+        # When enabled, assemblies and PDBs are compared without the fields which change with their dependencies (see pdb_normalizer.py)
+        # This is required for comparing symbol packages, since building PDBs changes the assemblies too
+        self.normalize_debug_information = normalize_debug_information
+        # Time spent on work which only happens because of symbol packages and normalization, for reporting their cost
+        self.statistics_lock = threading.Lock()
+        self.symbol_package_comparisons = 0
+        self.symbol_package_seconds = 0.0
+        self.normalization_seconds = 0.0
+
+    def is_normalized(self, file_name: str) -> bool:
+        return self.normalize_debug_information and pdb_normalizer.is_normalized(file_name)
+
+    def digest(self, source: PackageSource, entry) -> bytes:
+        if self.digest_cache is not None and isinstance(source, ZipPackageSource):
+            return self.digest_cache.digest(source, entry, 'sha256', lambda: source.digest(entry))
+        return source.digest(entry)
+
+    def normalized_digest(self, source: PackageSource, entry) -> bytes:
+        def calculate() -> bytes:
+            start = time.perf_counter()
+            try:
+                return source.normalized_digest(entry)
+            finally:
+                with self.statistics_lock:
+                    self.normalization_seconds += time.perf_counter() - start
+
+        if self.digest_cache is not None and isinstance(source, ZipPackageSource):
+            return self.digest_cache.digest(source, entry, f"normalized{Path(entry.filename).suffix.lower()}", calculate)
+        return calculate()
+
+    # Identical files are always equivalent, and normalized packages (see nupkg_normalizer.py) are identical whenever their contents are
+    # The hashes come from fingerprints when possible so neither package needs to be read, a package is only hashed when the other side's hash is already known
+    def files_are_identical(self, a_path: Path, b_path: Path) -> bool:
+        a_digest = get_recorded_file_digest(a_path)
+        b_digest = get_recorded_file_digest(b_path)
+        if a_digest is None and b_digest is None:
+            return False
+
+        def hash_file(path: Path) -> bytes | None:
+            if not path.exists():
+                return None
+            with open(path, 'rb') as f:
+                return hashlib.file_digest(f, 'sha256').digest()
+
+        a_digest = a_digest if a_digest is not None else hash_file(a_path)
+        b_digest = b_digest if b_digest is not None else hash_file(b_path)
+        return a_digest is not None and a_digest == b_digest
+
+    def packages_are_equivalent(self, a_path: Path, b_path: Path, is_snupkg: bool = False) -> bool:
+        self.log(f"Comparing '{a_path}' and '{b_path}'")
+
+        # One package exists and the other does not
+        a_exists = package_exists(a_path)
+        if a_exists != package_exists(b_path):
+            self.log(f"Not equivalent: Only one package actually exists")
+            return False
+
+        # The package doesn't exist at all, assume mistake unless we're checking the optional symbol packages
+        if not a_exists:
+            if is_snupkg:
+                self.log("Equivalent: Neither package exists")
+                return True
+            raise FileNotFoundError(f"Neither package exists: '{a_path}' or '{b_path}'")
+
+        is_equivalent = True
+
+        # Check if corresponding symbol packages are equivalent
+        if self.check_symbol_packages and not is_snupkg:
+            start = time.perf_counter()
+            symbol_packages_are_equivalent = self.packages_are_equivalent(a_path.with_suffix(".snupkg"), b_path.with_suffix(".snupkg"), True)
+            with self.statistics_lock:
+                self.symbol_package_comparisons += 1
+                self.symbol_package_seconds += time.perf_counter() - start
+
+            if not symbol_packages_are_equivalent:
+                self.log("Not equivalent: Symbol packages are not equivalent")
+                if self.mode == ComparisonMode.DECIDE:
+                    return False
+                is_equivalent = False
+            else:
+                self.log("Symbol packages are equivalent")
+
+        if self.files_are_identical(a_path, b_path):
+            self.log("Equivalent: The packages are identical")
+            with self.identical_files_lock:
+                self.identical_files += 1
+            return is_equivalent
+
+        # Compare the contents of the packages, cheapest tiers first
+        with open_package_source(a_path) as a, open_package_source(b_path) as b:
+            comparison = PackageComparison(self, a, b)
+            for tier in self.tiers:
+                tier.compare(comparison)
+                if not comparison.is_equivalent and self.mode == ComparisonMode.DECIDE:
+                    self.log(f"Stopped comparing after the '{tier.name}' tier found a difference")
+                    break
+
+        return is_equivalent and comparison.is_equivalent
@@ -0,0 +1,91 @@
+# Parallel Deflate
+# Large zip entries are compressed in independent chunks across multiple threads and stitched back together into a single standard deflate stream
+# This is the same approach used by pigz https://zlib.net/pigz/
+#
+# Each chunk is primed with the 32 KiB of data before it (the size of the deflate window) so that matches can still reach into the previous chunk,
+# which keeps the output within a fraction of a percent of compressing everything serially. Every chunk except the last ends with a sync flush,
+# which ends it on a byte boundary without marking it as the final block, so the chunks can simply be concatenated.
+# (zlib releases the GIL while compressing, so threads are enough to use every core.)
+import concurrent.futures
+import io
+import zlib
+
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP64_LIMIT
+
+DEFLATE_WINDOW_SIZE = 32 * 1024
+DEFAULT_CHUNK_SIZE = 256 * 1024
+
+# write_compressed relies on private parts of ZipFile, these were checked against CPython 3.11 (3.11.7)
+# They're checked for up front so that if a different version of Python doesn't have them we fall back to letting zipfile compress everything
+# (The attributes other than _writecheck are only assigned by the constructor, so they can only be checked on an instance.)
+ZIPFILE_INTERNALS = ('_lock', '_writing', '_seekable', '_writecheck', '_didModify', 'start_dir', 'fp', 'filelist', 'NameToInfo')
+
+def _has_zipfile_internals() -> bool:
+    if not hasattr(ZipInfo, 'FileHeader'):
+        return False
+    with ZipFile(io.BytesIO(), 'w') as zip_file:
+        return all(hasattr(zip_file, name) for name in ZIPFILE_INTERNALS)
+
+CAN_WRITE_COMPRESSED = _has_zipfile_internals()
+
+def compress_chunk(data: memoryview, start: int, end: int, level: int) -> bytes:
+    is_last = end == len(data)
+    if start > 0:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=data[max(0, start - DEFLATE_WINDOW_SIZE):start])
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    return compressor.compress(data[start:end]) + compressor.flush(zlib.Z_FINISH if is_last else zlib.Z_SYNC_FLUSH)
+
+# Returns the raw deflate stream for the data and its CRC32
+def compress(data: bytes, level: int, executor: concurrent.futures.Executor, chunk_size: int = DEFAULT_CHUNK_SIZE) -> tuple[bytes, int]:
+    view = memoryview(data)
+    chunk_starts = range(0, max(len(data), 1), chunk_size)
+    futures = [executor.submit(compress_chunk, view, start, min(start + chunk_size, len(data)), level) for start in chunk_starts]
+
+    # The CRC is calculated while the chunks are compressed
+    crc = zlib.crc32(view)
+    return b''.join(future.result() for future in futures), crc
+
+# Writes an entry whose data has already been deflated
+# zipfile doesn't provide a way to do this, so this mirrors what ZipFile.mkdir does to write an entry in one go
+# This is only available when CAN_WRITE_COMPRESSED is true
+def write_compressed(output: ZipFile, info: ZipInfo, compressed_data: bytes, crc: int, file_size: int) -> None:
+    if not CAN_WRITE_COMPRESSED:
+        raise NotImplementedError("This version of zipfile does not have the internals needed to write pre-compressed entries.")
+
+    info.compress_type = ZIP_DEFLATED
+    info.CRC = crc
+    info.file_size = file_size
+    info.compress_size = len(compressed_data)
+    zip64 = file_size > ZIP64_LIMIT or info.compress_size > ZIP64_LIMIT
+
+    with output._lock:
+        if output._writing:
+            raise ValueError("Can't write to the zip file while there is an open writing handle on it.")
+        if output._seekable:
+            output.fp.seek(output.start_dir)
+        info.header_offset = output.fp.tell()
+        output._writecheck(info)
+        output._didModify = True
+
+        output.fp.write(info.FileHeader(zip64))
+        output.fp.write(compressed_data)
+        output.start_dir = output.fp.tell()
+
+        output.filelist.append(info)
+        output.NameToInfo[info.filename] = info
+
+# Adds a file to the zip, compressing it in parallel if it's large enough to benefit from it (and zipfile allows it, see CAN_WRITE_COMPRESSED)
+# The entry's details are taken from the file unless a ZipInfo is given
+def write(output: ZipFile, file_path: str, archive_name: str | ZipInfo, level: int, executor: concurrent.futures.Executor | None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+    info = archive_name if isinstance(archive_name, ZipInfo) else ZipInfo.from_file(file_path, archive_name)
+    with open(file_path, 'rb') as f:
+        data = f.read()
+
+    if executor is None or not CAN_WRITE_COMPRESSED or len(data) < chunk_size * 2:
+        output.writestr(info, data, ZIP_DEFLATED, level)
+        return
+
+    compressed_data, crc = compress(data, level, executor, chunk_size)
+    write_compressed(output, info, compressed_data, crc, len(data))
@@ -0,0 +1,344 @@
+# PDB Normalizer
+# Hashes portable PDBs and the assemblies which point at them with the fields which depend on anything besides their own contents masked out
+# Deterministic builds derive the ID of a PDB from a hash of its contents, which include the MVIDs of the assemblies it was compiled against,
+# and the assembly then records that ID (see tooling/Versioning.props) so both change whenever a dependency does even when nothing about them did
+# The fields are located by parsing the headers through a few cached pages of the file, then the file is streamed through the hash around the masked ranges
+# Nothing is written anywhere and memory use doesn't depend on the size of the file
+# Anything which can't be parsed is hashed as-is (with a warning), which at worst makes it look different
+# https://github.com/dotnet/runtime/blob/main/docs/design/specs/PortablePdb-Metadata.md
+# https://learn.microsoft.com/en-us/windows/win32/debug/pe-format
+import hashlib
+import struct
+import uuid
+
+from collections import OrderedDict
+from typing import BinaryIO
+
+import gha
+
+NORMALIZED_EXTENSIONS = ('.pdb', '.dll', '.exe')
+
+# Custom debug information which describes the build environment rather than the code
+# The references list the timestamp, image size, and MVID of every assembly the code was compiled against
+COMPILATION_METADATA_REFERENCES_KIND = uuid.UUID('7E4D4708-096E-4C5C-AEDA-CB10BA6A740D').bytes_le
+# Source Link maps documents to the commit they were built from
+SOURCE_LINK_KIND = uuid.UUID('CC110556-A091-4D38-9FEC-25AB9A351A6A').bytes_le
+
+def is_normalized(file_name: str) -> bool:
+    return file_name.lower().endswith(NORMALIZED_EXTENSIONS)
+
+#==================================================================================================
+# Reading
+#==================================================================================================
+# Gives random access to a seekable stream through a bounded number of cached pages
+# The fields being parsed are spread throughout the file, but they're few and mostly close together so only a few pages are ever read
+# Reads past the end of the file are short like they are for bytes, so the parsers below can index and slice this like they would bytes
+class PagedReader:
+    PAGE_SIZE = 64 * 1024
+    MAX_PAGES = 16
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.pages: OrderedDict[int, bytes] = OrderedDict()
+
+    def get_page(self, index: int) -> bytes:
+        page = self.pages.get(index)
+        if page is not None:
+            self.pages.move_to_end(index)
+            return page
+
+        self.stream.seek(index * self.PAGE_SIZE)
+        page = self.stream.read(self.PAGE_SIZE)
+        self.pages[index] = page
+        if len(self.pages) > self.MAX_PAGES:
+            self.pages.popitem(last=False)
+        return page
+
+    def read(self, offset: int, size: int) -> bytes:
+        if offset < 0:
+            raise ValueError(f"Negative offset {offset}")
+
+        chunks = []
+        while size > 0:
+            index, page_offset = divmod(offset, self.PAGE_SIZE)
+            chunk = self.get_page(index)[page_offset:page_offset + size]
+            if len(chunk) == 0:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def __getitem__(self, key: int | slice):
+        if isinstance(key, slice):
+            assert key.step is None
+            start = key.start or 0
+            return self.read(start, max(key.stop - start, 0))
+
+        value = self.read(key, 1)
+        if len(value) == 0:
+            raise IndexError(f"Offset {key} is past the end of the file")
+        return value[0]
+
+    def unpack_from(self, format: str, offset: int) -> tuple:
+        return struct.unpack(format, self.read(offset, struct.calcsize(format)))
+
+    def index(self, value: bytes, start: int) -> int:
+        assert len(value) == 1
+        position = start
+        while True:
+            index, page_offset = divmod(position, self.PAGE_SIZE)
+            page = self.get_page(index)
+            if page_offset >= len(page):
+                raise ValueError(f"{value!r} not found after offset {start}")
+            found = page.find(value, page_offset)
+            if found >= 0:
+                return index * self.PAGE_SIZE + found
+            position = (index + 1) * self.PAGE_SIZE
+
+#==================================================================================================
+# Metadata
+#==================================================================================================
+# Returns the offset and size of each stream of the metadata which starts at the given offset
+def read_metadata_streams(data: PagedReader, offset: int) -> dict[str, tuple[int, int]]:
+    if data[offset:offset + 4] != b'BSJB':
+        raise ValueError("Bad metadata signature")
+    version_length, = data.unpack_from('<I', offset + 12)
+    position = offset + 16 + version_length
+    stream_count, = data.unpack_from('<2xH', position)
+    position += 4
+
+    streams = { }
+    for _ in range(stream_count):
+        stream_offset, stream_size = data.unpack_from('<II', position)
+        name_end = data.index(b'\0', position + 8)
+        streams[data[position + 8:name_end].decode('ascii')] = (offset + stream_offset, stream_size)
+        # Names are padded to a multiple of four bytes including their terminator
+        position += 8 + ((name_end - (position + 8)) // 4 + 1) * 4
+    return streams
+
+# Returns the length of a blob along with the offset of its contents, blobs are prefixed by their compressed length
+def read_blob_header(data: PagedReader, offset: int) -> tuple[int, int]:
+    first = data[offset]
+    if first & 0x80 == 0:
+        return first, offset + 1
+    if first & 0xC0 == 0x80:
+        return ((first & 0x3F) << 8) | data[offset + 1], offset + 2
+    if first & 0xE0 == 0xC0:
+        return ((first & 0x1F) << 24) | (data[offset + 1] << 16) | (data[offset + 2] << 8) | data[offset + 3], offset + 4
+    raise ValueError("Bad blob length")
+
+# Tables referenced by the HasCustomDebugInformation coded index, in tag order
+HAS_CUSTOM_DEBUG_INFORMATION_TABLES = [
+    0x06, 0x04, 0x01, 0x02, 0x08, 0x09, 0x0A, 0x00, 0x0E, 0x17, 0x14, 0x11, 0x1A, 0x1B,
+    0x20, 0x23, 0x26, 0x27, 0x28, 0x2A, 0x2C, 0x2B, 0x30, 0x32, 0x33, 0x34, 0x35,
+]
+METHOD_DEF_TABLE = 0x06
+DOCUMENT_TABLE = 0x30
+LOCAL_SCOPE_TABLE = 0x32
+LOCAL_VARIABLE_TABLE = 0x33
+LOCAL_CONSTANT_TABLE = 0x34
+IMPORT_SCOPE_TABLE = 0x35
+CUSTOM_DEBUG_INFORMATION_TABLE = 0x37
+
+#==================================================================================================
+# Portable PDBs
+#==================================================================================================
+def get_pdb_masks(data: PagedReader) -> list[tuple[int, int]]:
+    streams = read_metadata_streams(data, 0)
+    pdb_offset, _ = streams['#Pdb']
+    tables_offset, _ = streams['#~']
+    guid_offset, _ = streams['#GUID']
+    blob_offset, _ = streams['#Blob']
+
+    # The PDB ID is the first 20 bytes of the #Pdb stream
+    masks = [(pdb_offset, 20)]
+
+    # The #Pdb stream also has the row counts of the assembly's tables, which are needed to know the size of indices into them
+    row_counts: dict[int, int] = { }
+    referenced_tables, = data.unpack_from('<Q', pdb_offset + 24)
+    position = pdb_offset + 32
+    for table in range(64):
+        if referenced_tables & (1 << table):
+            row_counts[table], = data.unpack_from('<I', position)
+            position += 4
+
+    heap_sizes = data[tables_offset + 6]
+    present_tables, = data.unpack_from('<Q', tables_offset + 8)
+    position = tables_offset + 24
+    for table in range(64):
+        if present_tables & (1 << table):
+            row_counts[table], = data.unpack_from('<I', position)
+            position += 4
+    tables_start = position
+
+    string_size = 4 if heap_sizes & 0x01 else 2
+    guid_size = 4 if heap_sizes & 0x02 else 2
+    blob_size = 4 if heap_sizes & 0x04 else 2
+
+    def index_size(table: int) -> int:
+        return 2 if row_counts.get(table, 0) < 0x10000 else 4
+
+    has_custom_debug_information_size = 2 if max(row_counts.get(table, 0) for table in HAS_CUSTOM_DEBUG_INFORMATION_TABLES) < (1 << 11) else 4
+
+    # Only the PDB tables preceding the custom debug information need to be skipped
+    row_sizes = {
+        DOCUMENT_TABLE: blob_size + guid_size + blob_size + guid_size,
+        0x31: index_size(DOCUMENT_TABLE) + blob_size,
+        LOCAL_SCOPE_TABLE: index_size(METHOD_DEF_TABLE) + index_size(IMPORT_SCOPE_TABLE) + index_size(LOCAL_VARIABLE_TABLE) + index_size(LOCAL_CONSTANT_TABLE) + 8,
+        LOCAL_VARIABLE_TABLE: 4 + string_size,
+        LOCAL_CONSTANT_TABLE: string_size + blob_size,
+        IMPORT_SCOPE_TABLE: index_size(IMPORT_SCOPE_TABLE) + blob_size,
+        0x36: index_size(METHOD_DEF_TABLE) * 2,
+    }
+
+    # A portable PDB only contains PDB tables
+    position = tables_start
+    for table in range(0x30, CUSTOM_DEBUG_INFORMATION_TABLE):
+        position += row_sizes[table] * row_counts.get(table, 0)
+
+    def read_index(offset: int, size: int) -> int:
+        return data.unpack_from('<I' if size == 4 else '<H', offset)[0]
+
+    row_size = has_custom_debug_information_size + guid_size + blob_size
+    for row in range(row_counts.get(CUSTOM_DEBUG_INFORMATION_TABLE, 0)):
+        row_offset = position + row * row_size
+        kind_index = read_index(row_offset + has_custom_debug_information_size, guid_size)
+        if kind_index == 0:
+            continue
+        kind = data[guid_offset + (kind_index - 1) * 16:guid_offset + kind_index * 16]
+        if kind != COMPILATION_METADATA_REFERENCES_KIND and kind != SOURCE_LINK_KIND:
+            continue
+
+        value_index = read_index(row_offset + has_custom_debug_information_size + guid_size, blob_size)
+        value_length, value_offset = read_blob_header(data, blob_offset + value_index)
+        if kind == SOURCE_LINK_KIND:
+            masks.append((value_offset, value_length))
+            continue
+
+        # Each reference is its file name and aliases (both null-terminated) then its kind, timestamp, image size, and MVID
+        reference_offset = value_offset
+        value_end = value_offset + value_length
+        while reference_offset < value_end:
+            reference_offset = data.index(b'\0', reference_offset) + 1
+            reference_offset = data.index(b'\0', reference_offset) + 1
+            masks.append((reference_offset + 1, 24))
+            reference_offset += 25
+    return masks
+
+#==================================================================================================
+# Assemblies
+#==================================================================================================
+CODE_VIEW_DEBUG_TYPE = 2
+PDB_CHECKSUM_DEBUG_TYPE = 19
+
+def get_pe_masks(data: PagedReader) -> list[tuple[int, int]]:
+    pe_offset, = data.unpack_from('<I', 0x3C)
+    if data[pe_offset:pe_offset + 4] != b'PE\0\0':
+        raise ValueError("Bad PE signature")
+
+    coff_offset = pe_offset + 4
+    section_count, = data.unpack_from('<H', coff_offset + 2)
+    optional_header_size, = data.unpack_from('<H', coff_offset + 16)
+    optional_header_offset = coff_offset + 20
+    magic, = data.unpack_from('<H', optional_header_offset)
+    data_directories_offset = optional_header_offset + (112 if magic == 0x20B else 96)
+
+    # Deterministic builds derive the timestamp and checksum from the contents
+    masks = [(coff_offset + 4, 4), (optional_header_offset + 64, 4)]
+
+    sections = []
+    for section in range(section_count):
+        section_offset = optional_header_offset + optional_header_size + section * 40
+        virtual_size, virtual_address, raw_size, raw_offset = data.unpack_from('<IIII', section_offset + 8)
+        sections.append((virtual_address, max(virtual_size, raw_size), raw_offset))
+
+    def rva_to_offset(rva: int) -> int:
+        for virtual_address, size, raw_offset in sections:
+            if virtual_address <= rva < virtual_address + size:
+                return rva - virtual_address + raw_offset
+        raise ValueError(f"RVA {rva:#x} is not in any section")
+
+    def get_data_directory(index: int) -> tuple[int, int]:
+        return data.unpack_from('<II', data_directories_offset + index * 8)
+
+    debug_rva, debug_size = get_data_directory(6)
+    if debug_rva != 0:
+        debug_offset = rva_to_offset(debug_rva)
+        for entry_offset in range(debug_offset, debug_offset + debug_size, 28):
+            data_type, data_size, _, data_offset = data.unpack_from('<IIII', entry_offset + 12)
+            masks.append((entry_offset + 4, 4))
+            if data_type == CODE_VIEW_DEBUG_TYPE and data[data_offset:data_offset + 4] == b'RSDS':
+                # The PDB ID and age
+                masks.append((data_offset + 4, 20))
+            elif data_type == PDB_CHECKSUM_DEBUG_TYPE:
+                # The hash of the PDB follows the name of the algorithm used to calculate it
+                checksum_offset = data.index(b'\0', data_offset) + 1
+                masks.append((checksum_offset, data_offset + data_size - checksum_offset))
+
+    # Native images have nothing more to mask
+    cli_rva, _ = get_data_directory(14)
+    if cli_rva == 0:
+        return masks
+
+    cli_offset = rva_to_offset(cli_rva)
+    metadata_rva, _ = data.unpack_from('<II', cli_offset + 8)
+    strong_name_rva, strong_name_size = data.unpack_from('<II', cli_offset + 32)
+    if strong_name_rva != 0:
+        masks.append((rva_to_offset(strong_name_rva), strong_name_size))
+
+    # The #GUID heap only holds the MVID (which is derived from the contents too) and the unused Edit and Continue IDs
+    streams = read_metadata_streams(data, rva_to_offset(metadata_rva))
+    if '#GUID' in streams:
+        masks.append(streams['#GUID'])
+    return masks
+
+#==================================================================================================
+# Hashing
+#==================================================================================================
+# The masked ranges are returned as (offset, length) pairs
+def get_masks(file_name: str, stream: BinaryIO) -> list[tuple[int, int]]:
+    data = PagedReader(stream)
+    try:
+        if file_name.lower().endswith('.pdb'):
+            # Windows PDBs don't have any of this metadata
+            return get_pdb_masks(data) if data[:4] == b'BSJB' else []
+        return get_pe_masks(data) if data[:2] == b'MZ' else []
+    except (ValueError, KeyError, IndexError, struct.error) as ex:
+        gha.print_warning(f"Could not parse '{file_name}', it will be hashed without masking anything out: {ex}")
+        return []
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Returns the SHA256 of the file with the masked ranges replaced by zeros
+# The stream must be seekable, zip entries are (although seeking backwards means inflating them again from the start)
+def get_normalized_digest(file_name: str, stream: BinaryIO) -> bytes:
+    masks = sorted(get_masks(file_name, stream))
+    stream.seek(0)
+    hash = hashlib.sha256()
+
+    # Hashes up to the next length bytes of the stream (or zeros in their place), returns how many there were
+    def update(length: int, masked: bool = False) -> int:
+        remaining = length
+        while remaining > 0:
+            chunk = stream.read(min(remaining, HASH_CHUNK_SIZE))
+            if len(chunk) == 0:
+                break
+            hash.update(bytes(len(chunk)) if masked else chunk)
+            remaining -= len(chunk)
+        return length - remaining
+
+    position = 0
+    for offset, length in masks:
+        offset = max(offset, position)
+        end = offset + length
+        if end <= offset:
+            continue
+        position += update(offset - position)
+        position += update(end - offset, masked=True)
+        if position < end:
+            break
+
+    while update(HASH_CHUNK_SIZE) > 0:
+        pass
+    return hash.digest()
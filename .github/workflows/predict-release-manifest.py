@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# Predicts the reference dummy packages for the previous and next versions of each package using their source fingerprints (see source_fingerprints.py)
+# When every package can be predicted the reference dummy builds can be skipped and compare-nuget-packages.py runs on the predicted packages instead
+# Only the fingerprints of packages are cached, so nothing is predicted when symbol packages will be compared since they have to be built
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+from pathlib import Path
+from xml.etree import ElementTree
+
+import gha
+import msbuild
+import source_fingerprints
+
+from package_comparison import FINGERPRINT_FORMAT_VERSION, ComparisonMode, PackageComparer, get_fingerprint_path, get_tiers
+
+def write_placeholder(package_path: Path, package_id: str):
+    # Packages built from identical sources are identical, so an empty fingerprint is enough when nothing is cached for them
+    with open(get_fingerprint_path(package_path), 'w', encoding='utf-8') as f:
+        json.dump({ 'format': FINGERPRINT_FORMAT_VERSION, 'package': package_path.name, 'entries': [] }, f)
+
+def main(argv: list[str]) -> None:
+    if len(argv) != 5:
+        gha.print_error('Usage: predict-release-manifest.py <cache-path> <previous-ref> <next-ref> <output-path>')
+        sys.exit(1)
+    else:
+        cache_path = Path(argv[1])
+        previous_ref = argv[2]
+        next_ref = argv[3]
+        output_path = Path(argv[4])
+
+    previous_output_path = output_path / 'Packages-dummy-prev'
+    next_output_path = output_path / 'Packages-dummy-next'
+    if output_path.exists() and any(output_path.iterdir()):
+        gha.print_error(f"Output path '{output_path}' is not empty.")
+    gha.fail_if_errors()
+
+    if (os.getenv('COMPARE_SYMBOL_PACKAGES') or 'false').lower() == 'true':
+        print("Symbol packages will be compared, the reference dummy builds are required to build them.")
+        gha.set_output('all-predicted', False)
+        sys.exit(0)
+
+    graph = msbuild.ProjectGraph(Path('.'), 'Bonsai.sln')
+    try:
+        previous_tree = source_fingerprints.get_tree(previous_ref)
+        next_tree = source_fingerprints.get_tree(next_ref)
+    except subprocess.CalledProcessError as ex:
+        gha.print_warning(f"Failed to read the source trees, the reference dummy builds will be required: {ex.stderr.decode('utf-8', 'replace').strip()}")
+        gha.set_output('all-predicted', False)
+        sys.exit(0)
+
+    # The project graph only knows about the packages packed now, so the packages packed by the previous commit are listed from its own solution
+    # Packages which were removed since then have to be predicted too, otherwise they'd be missing from the predicted previous packages and wouldn't be reported as removed
+    try:
+        previous_package_ids = msbuild.get_solution_package_ids('Bonsai.sln', lambda path: source_fingerprints.read_file(previous_tree, path))
+    except (OSError, ValueError, subprocess.CalledProcessError, ElementTree.ParseError) as ex:
+        gha.print_warning(f"Failed to list the packages of '{previous_ref}', the reference dummy builds will be required: {ex}")
+        gha.set_output('all-predicted', False)
+        sys.exit(0)
+
+    previous_fingerprints = source_fingerprints.get_fingerprints(graph, previous_tree)
+    next_fingerprints = source_fingerprints.get_fingerprints(graph, next_tree)
+    # Symbol packages are never compared against predicted packages, so the dummy builds never need to have included them
+    cache = source_fingerprints.PackageCache(cache_path, dummy_build_symbols=False)
+    # Normalizing only masks fields which are derived from the rest of an assembly or PDB (or its dependencies), so it's always safe and keeps dummy builds with symbols predictable
+    comparer = PackageComparer(ComparisonMode.DECIDE, get_tiers(), check_symbol_packages=False, log=gha.print_debug, normalize_debug_information=True)
+
+    previous_output_path.mkdir(parents=True, exist_ok=True)
+    next_output_path.mkdir(parents=True, exist_ok=True)
+
+    predictions: dict[str, str] = { }
+    unpredicted_packages = []
+    for package_id in sorted(next_fingerprints):
+        previous_fingerprint = previous_fingerprints.get(package_id)
+        next_fingerprint = next_fingerprints[package_id]
+        file_name = f"{package_id}.99.99.99.nupkg"
+        previous_path = previous_output_path / file_name
+        next_path = next_output_path / file_name
+
+        previous_entry = cache.get(package_id, previous_fingerprint)
+        next_entry = cache.get(package_id, next_fingerprint)
+        is_new = package_id not in previous_package_ids
+
+        if next_fingerprint is None:
+            predictions[package_id] = "❔ Cannot be fingerprinted"
+            unpredicted_packages.append(package_id)
+        elif is_new:
+            # There's nothing to compare new packages against, so their contents don't matter
+            if next_entry is not None:
+                shutil.copyfile(next_entry, get_fingerprint_path(next_path))
+            else:
+                write_placeholder(next_path, package_id)
+            predictions[package_id] = "🆕 New package"
+        elif previous_fingerprint == next_fingerprint:
+            entry = previous_entry or next_entry
+            for path in (previous_path, next_path):
+                if entry is not None:
+                    shutil.copyfile(entry, get_fingerprint_path(path))
+                else:
+                    write_placeholder(path, package_id)
+            predictions[package_id] = "⬜ Sources unchanged"
+        elif previous_entry is not None and next_entry is not None:
+            shutil.copyfile(previous_entry, get_fingerprint_path(previous_path))
+            shutil.copyfile(next_entry, get_fingerprint_path(next_path))
+            is_equivalent = comparer.packages_are_equivalent(next_path, previous_path)
+            predictions[package_id] = "⬜ Sources changed, cached packages are equivalent" if is_equivalent else "🟧 Sources changed, cached packages differ"
+        else:
+            predictions[package_id] = "❔ Sources changed, packages are not cached"
+            unpredicted_packages.append(package_id)
+
+    # Only the names of removed packages matter for comparison, so they're always predicted
+    for package_id in sorted(previous_package_ids - set(next_fingerprints)):
+        write_placeholder(previous_output_path / f"{package_id}.99.99.99.nupkg", package_id)
+        predictions[package_id] = "🗑️ Removed package"
+
+    all_predicted = len(unpredicted_packages) == 0
+    for package_id, prediction in predictions.items():
+        print(f"{package_id}: {prediction}")
+    print()
+    if all_predicted:
+        print("Every package was predicted, the reference dummy builds are not needed.")
+    else:
+        print(f"{len(unpredicted_packages)} packages could not be predicted, the reference dummy builds are needed.")
+        # Partial predictions aren't useful since the dummy builds always build everything
+        shutil.rmtree(previous_output_path)
+        shutil.rmtree(next_output_path)
+
+    gha.set_output('all-predicted', all_predicted)
+    gha.set_output('unpredicted-packages', json.dumps(unpredicted_packages))
+
+    with gha.JobSummary() as md:
+        md.write_line("# Predicted packages")
+        md.write_line()
+        if all_predicted:
+            md.write_line("Every package was predicted from its source fingerprint, the reference dummy builds were skipped.")
+        else:
+            md.write_line(f"{len(unpredicted_packages)} packages could not be predicted from their source fingerprints, the reference dummy builds are needed.")
+        md.write_line()
+        md.write_line("| Package | Prediction |")
+        md.write_line("|---------|------------|")
+        for package_id, prediction in predictions.items():
+            md.write_line(f"| {package_id} | {prediction} |")
+
+    gha.fail_if_errors()
+
+if __name__ == '__main__':
+    gha.run_script(main)
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+# Publishes the packages listed in the release manifest to a NuGet v3 feed
+# Packages are uploaded concurrently in dependency order
+# Versions which already exist on the feed are an error unless PUBLISH_SKIP_DUPLICATES is enabled, in which case they're skipped without uploading them
+# https://learn.microsoft.com/en-us/nuget/api/overview
+import base64
+import concurrent.futures
+import http.client
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+
+from pathlib import Path
+
+import gha
+import nuget
+
+def get_environment_variable(name: str, default: str) -> str:
+    ret = os.getenv(name)
+    if ret is None or ret == '':
+        return default
+    return ret
+
+#==================================================================================================
+# Feed client
+#==================================================================================================
+class FeedError(Exception):
+    def __init__(self, message: str, status: int | None = None):
+        super().__init__(message)
+        self.status = status
+
+class Response:
+    def __init__(self, status: int, headers: dict[str, str], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+# Each worker thread keeps its own keep-alive connection per host so that requests don't pay for a new TLS handshake every time
+class ConnectionPool:
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def get(self, url: urllib.parse.SplitResult) -> http.client.HTTPConnection:
+        connections = self.local.__dict__.setdefault('connections', { })
+        key = (url.scheme, url.netloc)
+        connection = connections.get(key)
+        if connection is None:
+            if url.scheme == 'https':
+                connection = http.client.HTTPSConnection(url.netloc, timeout=self.timeout)
+            elif url.scheme == 'http':
+                connection = http.client.HTTPConnection(url.netloc, timeout=self.timeout)
+            else:
+                raise FeedError(f"Unsupported URL scheme '{url.scheme}'.")
+            connections[key] = connection
+        return connection
+
+    def discard(self, url: urllib.parse.SplitResult) -> None:
+        connections = self.local.__dict__.get('connections', { })
+        connection = connections.pop((url.scheme, url.netloc), None)
+        if connection is not None:
+            connection.close()
+
+class FeedClient:
+    # Transient responses which are worth another attempt
+    RETRY_STATUSES = { 408, 429, 500, 502, 503, 504 }
+    MAXIMUM_REDIRECTS = 5
+
+    def __init__(self, api_key: str | None, username: str | None, attempt_count: int, retry_delay: float, timeout: float, skip_duplicates: bool):
+        self.api_key = api_key
+        self.skip_duplicates = skip_duplicates
+        self.attempt_count = attempt_count
+        self.retry_delay = retry_delay
+        self.pool = ConnectionPool(timeout)
+        self.authorization = None
+        if username is not None and api_key is not None:
+            self.authorization = 'Basic ' + base64.b64encode(f"{username}:{api_key}".encode('utf-8')).decode('ascii')
+
+    def send_once(self, method: str, url: str, body: bytes | None, headers: dict[str, str]) -> Response:
+        parsed_url = urllib.parse.urlsplit(url)
+        path = parsed_url.path or '/'
+        if parsed_url.query != '':
+            path += f"?{parsed_url.query}"
+
+        headers = dict(headers)
+        headers['User-Agent'] = 'Bonsai-Publish'
+        if self.authorization is not None:
+            headers['Authorization'] = self.authorization
+
+        connection = self.pool.get(parsed_url)
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            ret = Response(response.status, { key.lower(): value for key, value in response.getheaders() }, response.read())
+        except (OSError, http.client.HTTPException):
+            # The connection is in an unknown state, so a fresh one is used for the next attempt
+            self.pool.discard(parsed_url)
+            raise
+
+        if ret.headers.get('connection', '').lower() == 'close':
+            self.pool.discard(parsed_url)
+        return ret
+
+    def send(self, method: str, url: str, body: bytes | None = None, headers: dict[str, str] = { }) -> Response:
+        redirect_count = 0
+        attempt = 1
+        while True:
+            try:
+                response = self.send_once(method, url, body, headers)
+            except (OSError, http.client.HTTPException) as ex:
+                if attempt >= self.attempt_count:
+                    raise FeedError(f"{method} {url} failed after {attempt} attempts: {ex}")
+                error = str(ex)
+            else:
+                if response.status in (301, 302, 303, 307, 308) and 'location' in response.headers:
+                    redirect_count += 1
+                    if redirect_count > self.MAXIMUM_REDIRECTS:
+                        raise FeedError(f"{method} {url} was redirected too many times.", response.status)
+                    url = urllib.parse.urljoin(url, response.headers['location'])
+                    continue
+
+                if response.status not in self.RETRY_STATUSES or attempt >= self.attempt_count:
+                    return response
+                error = f"HTTP {response.status}"
+
+            # Exponential backoff with jitter so that the workers don't all retry at once
+            delay = min(30.0, self.retry_delay * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+            gha.print_debug(f"{method} {url} failed ({error}), retrying in {delay:.1f} s")
+            time.sleep(delay)
+            attempt += 1
+
+    def get_json(self, url: str) -> dict | None:
+        response = self.send('GET', url)
+        if response.status == 404:
+            return None
+        if response.status != 200:
+            raise FeedError(f"GET {url} failed with HTTP {response.status}.", response.status)
+        return json.loads(response.body)
+
+    # Returns True if the package was uploaded and False if the feed already had it (only when skipping duplicates)
+    def push(self, url: str, package_path: Path) -> bool:
+        # The push protocol is a multipart form upload of the package
+        # https://learn.microsoft.com/en-us/nuget/api/package-publish-resource#push-a-package
+        boundary = uuid.uuid4().hex
+        body = b''.join([
+            f'--{boundary}\r\n'.encode('ascii'),
+            b'Content-Disposition: form-data; name="package"; filename="package.nupkg"\r\n',
+            b'Content-Type: application/octet-stream\r\n\r\n',
+            package_path.read_bytes(),
+            f'\r\n--{boundary}--\r\n'.encode('ascii'),
+        ])
+        headers = {
+            'Content-Type': f'multipart/form-data; boundary={boundary}',
+            'X-NuGet-ApiKey': self.api_key or '',
+        }
+
+        response = self.send('PUT', url, body, headers)
+        if response.status in (200, 201, 202):
+            return True
+        # The feed already has this version, this can happen if another run raced us to it
+        if response.status == 409 and self.skip_duplicates:
+            return False
+        raise FeedError(f"Pushing '{package_path.name}' failed with HTTP {response.status}: {response.body.decode('utf-8', 'replace').strip()}", response.status)
+
+class Feed:
+    def __init__(self, client: FeedClient, index_url: str):
+        self.client = client
+        index = client.get_json(index_url)
+        if index is None:
+            raise FeedError(f"Feed index '{index_url}' does not exist.")
+
+        resources = { }
+        for resource in index.get('resources', []):
+            types = resource.get('@type', [])
+            for type in types if isinstance(types, list) else [types]:
+                resources.setdefault(type, resource['@id'])
+
+        def get_resource(*types: str) -> str | None:
+            for type in types:
+                if type in resources:
+                    return resources[type]
+            return None
+
+        self.package_base_address = get_resource('PackageBaseAddress/3.0.0')
+        self.publish_url = get_resource('PackagePublish/2.0.0')
+        self.symbol_publish_url = get_resource('SymbolPackagePublish/4.9.0')
+        if self.package_base_address is None or self.publish_url is None:
+            raise FeedError(f"Feed '{index_url}' does not provide the package base address and publish resources.")
+
+    # Versions are normalized the same way as the feed, which lowercases them and drops build metadata
+    @staticmethod
+    def normalize_version(version: str) -> str:
+        return version.partition('+')[0].lower()
+
+    def get_versions(self, package_name: str) -> set[str]:
+        # https://learn.microsoft.com/en-us/nuget/api/package-base-address-resource#enumerate-package-versions
+        assert self.package_base_address is not None
+        index = self.client.get_json(f"{self.package_base_address.rstrip('/')}/{package_name.lower()}/index.json")
+        if index is None:
+            return set()
+        return set(self.normalize_version(version) for version in index.get('versions', []))
+
+def main(argv: list[str]) -> None:
+    if len(argv) != 4:
+        gha.print_error('Usage: publish-packages.py <release-manifest-path> <packages-path> <feed-index-url>')
+        sys.exit(1)
+    else:
+        release_manifest_path = Path(argv[1])
+        packages_path = Path(argv[2])
+        feed_index_url = argv[3]
+
+    if not release_manifest_path.exists():
+        gha.print_error(f"Release manifest '{release_manifest_path}' does not exist.")
+    if not packages_path.exists():
+        gha.print_error(f"Packages path '{packages_path}' does not exist.")
+
+    api_key = os.getenv('NUGET_API_KEY') or None
+    # Some feeds (such as GitHub Packages) require authentication for reading too, the API key is used as the password in that case
+    feed_username = os.getenv('NUGET_USERNAME') or None
+    push_symbols = get_environment_variable('PUBLISH_SYMBOLS', 'false').lower() == 'true'
+    # Equivalent to `dotnet nuget push --skip-duplicate`, this is configured per feed since a duplicate is expected on some feeds but indicates a problem on others
+    skip_duplicates = get_environment_variable('PUBLISH_SKIP_DUPLICATES', 'false').lower() == 'true'
+
+    try:
+        worker_count = int(get_environment_variable('PUBLISH_WORKERS', '4'))
+        # Attempts made for each request before giving up, only transient failures are retried
+        attempt_count = int(get_environment_variable('PUBLISH_ATTEMPTS', '4'))
+        timeout = float(get_environment_variable('PUBLISH_TIMEOUT', '300'))
+        # The delay before the first retry, it doubles with each attempt
+        retry_delay = float(get_environment_variable('PUBLISH_RETRY_DELAY', '1'))
+        if worker_count < 1 or attempt_count < 1:
+            raise ValueError("PUBLISH_WORKERS and PUBLISH_ATTEMPTS must be positive.")
+    except ValueError as ex:
+        gha.print_error(f"Invalid configuration: {ex}")
+
+    if api_key is None:
+        gha.print_error("NUGET_API_KEY must be set to publish packages.")
+    gha.fail_if_errors()
+
+    #==============================================================================================
+    # Determine what needs to be published
+    #==============================================================================================
+    release_packages = set()
+    with open(release_manifest_path, 'r') as release_manifest:
+        for line in release_manifest.readlines():
+            line = line.strip()
+            if line != '':
+                release_packages.add(line)
+
+    index = nuget.PackageDirectoryIndex(packages_path)
+    for package_name in sorted(release_packages):
+        if package_name not in index or index[package_name].nupkg_path is None:
+            gha.print_error(f"Package '{package_name}' is listed in the release manifest but is missing from '{packages_path}'.")
+    gha.fail_if_errors()
+
+    packages = [index[package_name] for package_name in sorted(release_packages)]
+
+    client = FeedClient(api_key, feed_username, attempt_count, retry_delay, timeout, skip_duplicates)
+    try:
+        feed = Feed(client, feed_index_url)
+    except FeedError as ex:
+        gha.print_error(str(ex))
+        sys.exit(1)
+
+    if push_symbols and feed.symbol_publish_url is None:
+        gha.print_warning(f"Feed '{feed_index_url}' does not accept symbol packages, they will not be published.")
+        push_symbols = False
+
+    # The feed is queried once per package up front, packages which already exist are never uploaded
+    with gha.profile_phase('query feed'), concurrent.futures.ThreadPoolExecutor(worker_count) as executor:
+        try:
+            existing_versions = dict(zip(packages, executor.map(lambda package: feed.get_versions(package.name), packages)))
+        except FeedError as ex:
+            gha.print_error(f"Failed to query the feed for existing packages: {ex}")
+            sys.exit(1)
+
+    already_published = [package for package in packages if Feed.normalize_version(package.version) in existing_versions[package]]
+    to_publish = [package for package in packages if package not in already_published]
+
+    # Nothing is uploaded if any of the packages are already on a feed which doesn't skip duplicates, otherwise we'd end up with a partial release
+    if not skip_duplicates:
+        for package in already_published:
+            gha.print_error(f"'{package.name}' {package.version} already exists on the feed.")
+        gha.fail_if_errors()
+
+    #==============================================================================================
+    # Determine the dependency order
+    #==============================================================================================
+    # Packages are only pushed after the packages they depend on so that a package is never visible on the feed before its dependencies are
+    # Only dependencies which are being published in this run matter, everything else is either already on the feed or external
+    publishing = { package.name.lower(): package for package in to_publish }
+    dependencies: dict[nuget.IndexedPackage, set[nuget.IndexedPackage]] = { }
+    for package in to_publish:
+        try:
+            dependencies[package] = set(publishing[dependency.id.lower()] for dependency in package.nuspec.dependencies if dependency.id.lower() in publishing and dependency.id.lower() != package.name.lower())
+        except Exception as ex:
+            gha.print_error(f"Failed to read the dependencies of '{package.file_name}': {ex}")
+    gha.fail_if_errors()
+
+    #==============================================================================================
+    # Publish
+    #==============================================================================================
+    def publish(package: nuget.IndexedPackage) -> str:
+        assert package.nupkg_path is not None
+        with gha.profile_phase(f"push {package.name}"):
+            was_pushed = client.push(feed.publish_url, package.nupkg_path)
+            if push_symbols and package.snupkg_path is not None:
+                assert feed.symbol_publish_url is not None
+                client.push(feed.symbol_publish_url, package.snupkg_path)
+        return 'published' if was_pushed else 'raced'
+
+    results: dict[nuget.IndexedPackage, str] = { package: 'exists' for package in already_published }
+    for package in already_published:
+        print(f"⬜ '{package.name}' {package.version} already exists on the feed")
+
+    start = time.perf_counter()
+    with gha.profile_phase('publish'), concurrent.futures.ThreadPoolExecutor(worker_count) as executor:
+        remaining = dict((package, set(package_dependencies)) for package, package_dependencies in dependencies.items())
+        running: dict[concurrent.futures.Future, nuget.IndexedPackage] = { }
+
+        def finish(package: nuget.IndexedPackage, result: str):
+            results[package] = result
+            if result in ('published', 'raced'):
+                for dependent_dependencies in remaining.values():
+                    dependent_dependencies.discard(package)
+
+        while len(remaining) > 0 or len(running) > 0:
+            # Anything which depends on a package that failed to publish can't be published either (including indirectly)
+            while True:
+                skipped = [package for package, package_dependencies in remaining.items() if any(results.get(dependency) in ('failed', 'skipped') for dependency in package_dependencies)]
+                if len(skipped) == 0:
+                    break
+                for package in skipped:
+                    gha.print_error(f"'{package.name}' was not published because one of its dependencies failed to publish.")
+                    del remaining[package]
+                    results[package] = 'skipped'
+
+            for package in [package for package, package_dependencies in remaining.items() if len(package_dependencies) == 0]:
+                del remaining[package]
+                running[executor.submit(publish, package)] = package
+
+            if len(running) == 0:
+                if len(remaining) > 0:
+                    gha.print_error(f"Packages have circular dependencies and cannot be published: {', '.join(sorted(package.name for package in remaining))}")
+                    for package in remaining:
+                        results[package] = 'skipped'
+                    remaining.clear()
+                continue
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                package = running.pop(future)
+                try:
+                    result = future.result()
+                except FeedError as ex:
+                    gha.print_error(str(ex))
+                    result = 'failed'
+                # Anything else going wrong only fails this package so that the rest are still published and reported
+                except Exception as ex:
+                    gha.print_error(f"Publishing '{package.name}' {package.version} failed: {ex!r}")
+                    result = 'failed'
+
+                if result == 'published':
+                    print(f"✅ '{package.name}' {package.version} was published")
+                elif result == 'raced':
+                    print(f"⬜ '{package.name}' {package.version} was published by someone else in the meantime")
+                finish(package, result)
+
+    elapsed = time.perf_counter() - start
+
+    published_count = sum(1 for result in results.values() if result == 'published')
+    print()
+    print(f"Published {published_count} of {len(packages)} packages in {elapsed:.1f} s ({len(already_published)} already existed on the feed).")
+
+    with gha.JobSummary() as md:
+        md.write_line("# Published packages")
+        md.write_line()
+        md.write_line(f"Published {published_count} of {len(packages)} packages to `{feed_index_url}` in {elapsed:.1f} s.")
+        md.write_line()
+        md.write_line("| Package | Version | Result |")
+        md.write_line("|---------|---------|--------|")
+        descriptions = {
+            'published': '✅ Published',
+            'exists': '⬜ Already on the feed',
+            'raced': '⬜ Published concurrently',
+            'failed': '❌ Failed',
+            'skipped': '❌ Dependency failed',
+        }
+        for package in packages:
+            md.write_line(f"| {package.name} | {package.version} | {descriptions[results[package]]} |")
+
+    gha.fail_if_errors()
+
+if __name__ == '__main__':
+    gha.run_script(main)
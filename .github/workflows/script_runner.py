@@ -0,0 +1,50 @@
+# Script Runner
+# Runs the workflow scripts as functions so that several of them can share a single process (see __main__.py)
+# Every file in this directory with a shebang is a script, and its command name is its file name without the extension
+# Scripts are imported as modules and run by calling their `main(argv)` function, where argv is the same as sys.argv would be if the script was run directly
+# Scripts are only imported when they're run, so nothing a script imports is loaded unless that script is used
+import importlib
+import sys
+
+from pathlib import Path
+
+import gha
+
+SCRIPTS_PATH = Path(__file__).resolve().parent
+
+def get_commands() -> list[str]:
+    ret = []
+    for path in sorted(SCRIPTS_PATH.glob('*.py')):
+        with open(path, 'rb') as f:
+            if f.read(2) == b'#!':
+                ret.append(path.stem)
+    return ret
+
+def get_script_path(command: str) -> Path:
+    path = SCRIPTS_PATH / f"{command}.py"
+    if '/' in command or '\\' in command or command not in get_commands():
+        raise ValueError(f"Unknown command '{command}'")
+    return path
+
+# Runs a script and returns its exit code
+# Exceptions raised by the script propagate to the caller
+def run(command: str, args: list[str]) -> int:
+    path = get_script_path(command)
+    try:
+        # Scripts share the modules they import (gha in particular) with each other and with the caller
+        # run_script profiles each script the same as if it was run directly
+        script = importlib.import_module(command)
+        gha.run_script(script.main, [str(path)] + list(args))
+        return 0
+    except SystemExit as ex:
+        if ex.code is None:
+            return 0
+        if isinstance(ex.code, int):
+            return ex.code
+        print(ex.code, file=sys.stderr)
+        return 1
+    finally:
+        sys.stdout.flush()
+
+        # Errors are tracked for the whole process, but each script only fails because of its own
+        gha.errors_were_printed = False
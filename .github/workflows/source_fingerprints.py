@@ -0,0 +1,131 @@
+# Source Fingerprints
+# A project's source fingerprint is a hash of everything which goes into building its reference dummy package:
+# the files in its directory, the files outside of it which it uses, the shared MSBuild files which apply to every project,
+# the package versions it references, and the source fingerprints of the projects it references.
+# If the fingerprint of a project didn't change then neither did its dummy package, which lets us skip building it.
+#
+# Files are hashed using their Git blob IDs, so fingerprints can be calculated for any commit without checking it out.
+# The project graph is always loaded from the working tree. This is safe for other commits since any change to the graph
+# (or to anything else the graph was evaluated from) is a change to a file which is hashed.
+import hashlib
+import json
+import os
+import subprocess
+
+from pathlib import Path
+
+import msbuild
+
+from nuget import FINGERPRINT_SUFFIX
+
+FORMAT_VERSION = 1
+
+# Global inputs which don't affect dummy packages
+excluded_global_inputs = set([
+    # This only sets the version number, which reference dummy builds always override
+    'tooling/CurrentVersion.props',
+])
+
+# Returns the blob ID of every file in the given commit
+def get_tree(ref: str) -> dict[str, str]:
+    output = subprocess.run(['git', 'ls-tree', '-r', '-z', '--full-tree', ref], capture_output=True, check=True).stdout
+    ret = { }
+    for line in output.split(b'\0'):
+        if line == b'':
+            continue
+        info, _, path = line.partition(b'\t')
+        _, type, blob_id = info.split(b' ')
+        if type == b'blob':
+            ret[path.decode('utf-8')] = blob_id.decode('ascii')
+    return ret
+
+# Returns the contents of a file in a tree from get_tree
+def read_file(tree: dict[str, str], path: str) -> str:
+    if path not in tree:
+        raise FileNotFoundError(f"'{path}' does not exist in the tree.")
+    return subprocess.run(['git', 'cat-file', 'blob', tree[path]], capture_output=True, check=True).stdout.decode('utf-8-sig')
+
+# Package versions which don't pin a specific version could resolve to something else at any time
+def has_floating_package_references(project: msbuild.Project) -> bool:
+    for _, version in project.package_references:
+        if version is not None and ('*' in version or version.startswith('(') or version.startswith('[')):
+            return True
+    return False
+
+# Returns the source fingerprint of each packable project by package ID
+# The fingerprint is None if the project doesn't exist in the tree or its package can't be predicted
+def get_fingerprints(graph: msbuild.ProjectGraph, tree: dict[str, str]) -> dict[str, str | None]:
+    files_by_directory: dict[str, list[str]] = { }
+    for path in sorted(tree):
+        directory = path.partition('/')[0] if '/' in path else ''
+        files_by_directory.setdefault(directory, []).append(path)
+
+    def hash_files(hash, paths):
+        for path in paths:
+            hash.update(f"{path}\0{tree.get(path, 'missing')}\0".encode('utf-8'))
+
+    global_hash = hashlib.sha256(f"{FORMAT_VERSION}\0".encode('utf-8'))
+    hash_files(global_hash, sorted(graph.global_inputs - excluded_global_inputs))
+    global_fingerprint = global_hash.hexdigest()
+
+    fingerprints: dict[msbuild.Project, str | None] = { }
+    def get_fingerprint(project: msbuild.Project) -> str | None:
+        if project in fingerprints:
+            return fingerprints[project]
+
+        # Guards against cyclic references, which MSBuild doesn't allow anyway
+        fingerprints[project] = None
+        if project.path not in tree or has_floating_package_references(project):
+            return None
+
+        hash = hashlib.sha256(f"{global_fingerprint}\0{project.path}\0".encode('utf-8'))
+        top_level_directory = project.directory.partition('/')[0]
+        hash_files(hash, [path for path in files_by_directory.get(top_level_directory, []) if msbuild.ProjectGraph.is_in_directory(path, project.directory)])
+        hash_files(hash, sorted(project.inputs))
+
+        for reference in sorted(project.references, key=lambda reference: reference.path):
+            reference_fingerprint = get_fingerprint(reference)
+            if reference_fingerprint is None:
+                return None
+            hash.update(f"{reference.path}\0{reference_fingerprint}\0".encode('utf-8'))
+
+        ret = fingerprints[project] = hash.hexdigest()
+        return ret
+
+    return { project.package_id: get_fingerprint(project) for project in graph.projects.values() if project.is_packable }
+
+#==================================================================================================
+# Package cache
+#==================================================================================================
+# Maps source fingerprints to the package fingerprint (see package_comparison.py) of the dummy package built from those sources
+# Dummy builds which include symbols produce different packages (with differently fingerprinted assemblies) from the same sources, so they're cached separately
+class PackageCache:
+    def __init__(self, path: Path, dummy_build_symbols: bool):
+        self.path = path
+        self.variant = 'symbols' if dummy_build_symbols else 'no-symbols'
+
+    def get_entry_path(self, package_id: str, fingerprint: str) -> Path:
+        return self.path / fingerprint[:2] / f"{fingerprint}-{self.variant}" / f"{package_id}.99.99.99.nupkg{FINGERPRINT_SUFFIX}"
+
+    def get(self, package_id: str, fingerprint: str | None) -> Path | None:
+        if fingerprint is None:
+            return None
+        ret = self.get_entry_path(package_id, fingerprint)
+        return ret if ret.exists() else None
+
+    def put(self, package_id: str, fingerprint: str, package_fingerprint: dict) -> None:
+        entry_path = self.get_entry_path(package_id, fingerprint)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(entry_path, 'w', encoding='utf-8') as f:
+            json.dump(package_fingerprint, f)
+
+    # Drops the least recently written entries so that the cache doesn't grow forever
+    def prune(self, entry_limit: int) -> int:
+        entries = sorted(self.path.glob(f'*/*/*{FINGERPRINT_SUFFIX}'), key=lambda path: path.stat().st_mtime, reverse=True)
+        for entry_path in entries[entry_limit:]:
+            entry_path.unlink()
+            try:
+                os.rmdir(entry_path.parent)
+            except OSError:
+                pass
+        return max(0, len(entries) - entry_limit)
@@ -0,0 +1,63 @@
+# Test Timings
+# Historical test durations are used to split the tests of each platform into shards which take about as long as each other
+# The timings file maps each runtime identifier to the average number of seconds each test project (across all of its target frameworks) takes to run on it:
+# { "format": 1, "durations": { "win-x64": { "Bonsai.Core.Tests/Bonsai.Core.Tests.csproj": 12.5, ... }, ... } }
+import datetime
+import json
+
+from pathlib import Path
+from xml.etree import ElementTree
+
+FORMAT_VERSION = 1
+TRX_NAMESPACE = '{http://microsoft.com/schemas/VisualStudio/TeamTest/2010}'
+
+# Projects without any history are assumed to take this long, unless other projects have history in which case they're assumed to be average
+DEFAULT_DURATION = 60.0
+
+def load(path: Path | None) -> dict[str, dict[str, float]]:
+    if path is None or not path.exists():
+        return { }
+
+    with open(path, 'r', encoding='utf-8') as f:
+        timings = json.load(f)
+
+    # An unknown format is treated like having no history, it'll be replaced the next time timings are collected
+    if timings.get('format') != FORMAT_VERSION:
+        return { }
+    return timings['durations']
+
+def save(path: Path, durations: dict[str, dict[str, float]]) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({ 'format': FORMAT_VERSION, 'durations': durations }, f, indent=2, sort_keys=True)
+
+def parse_trx_time(value: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(value)
+
+# Returns the name of the test assembly, its target framework, and its configuration along with how long the test run took
+# The wall clock time of the whole run is used rather than the sum of the tests since it includes the overhead of starting the test host
+def read_trx(path: Path) -> tuple[str, str, str, float] | None:
+    root = ElementTree.parse(path).getroot()
+    times = root.find(f'{TRX_NAMESPACE}Times')
+    test_method = root.find(f'{TRX_NAMESPACE}TestDefinitions/{TRX_NAMESPACE}UnitTest/{TRX_NAMESPACE}TestMethod')
+    if times is None or test_method is None or 'start' not in times.attrib or 'finish' not in times.attrib:
+        return None
+
+    # The code base is the path of the test assembly, which is built to bin/<configuration>/<framework>/
+    code_base = Path(test_method.attrib['codeBase'].replace('\\', '/'))
+    duration = (parse_trx_time(times.attrib['finish']) - parse_trx_time(times.attrib['start'])).total_seconds()
+    return code_base.stem, code_base.parent.name, code_base.parent.parent.name, max(duration, 0.0)
+
+# Splits test projects into shards using the longest processing time first heuristic
+# Each project goes to whichever shard currently has the least work, starting with the longest projects
+def create_shards(project_paths: list[str], durations: dict[str, float], shard_count: int) -> list[tuple[list[str], float]]:
+    known_durations = [durations[path] for path in project_paths if path in durations]
+    default_duration = sum(known_durations) / len(known_durations) if len(known_durations) > 0 else DEFAULT_DURATION
+
+    shards: list[tuple[list[str], float]] = [([], 0.0) for _ in range(min(shard_count, len(project_paths)))]
+    # Ties are broken by path so that the shards are stable between runs with the same history
+    for path in sorted(project_paths, key=lambda path: (-durations.get(path, default_duration), path)):
+        index = min(range(len(shards)), key=lambda index: (shards[index][1], index))
+        shard_paths, shard_duration = shards[index]
+        shards[index] = (shard_paths + [path], shard_duration + durations.get(path, default_duration))
+
+    return [(sorted(paths), duration) for paths, duration in shards]
@@ -0,0 +1,62 @@
+import importlib
+import io
+import sys
+import tempfile
+import unittest
+
+from contextlib import redirect_stdout
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import gha
+import script_runner
+
+filter_release_packages = importlib.import_module('filter-release-packages')
+
+class FilterReleasePackagesTests(unittest.TestCase):
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.path = Path(temporary_directory.name)
+        self.packages_path = self.path / 'Packages'
+        self.packages_path.mkdir()
+        self.manifest_path = self.path / 'ReleaseManifest'
+        self.addCleanup(setattr, gha, 'errors_were_printed', False)
+
+    def add_files(self, *file_names: str):
+        for file_name in file_names:
+            (self.packages_path / file_name).write_bytes(b'')
+
+    def get_files(self) -> list[str]:
+        return sorted(path.name for path in self.packages_path.iterdir())
+
+    def test_unreleased_packages_are_removed(self):
+        self.add_files(
+            'Bonsai.Core.2.8.0.nupkg', 'Bonsai.Core.2.8.0.snupkg',
+            'Bonsai.Design.2.8.0.nupkg', 'Bonsai.Design.2.8.0.nupkg.fingerprint.json', 'Bonsai.Design.2.9.0.NUPKG',
+            'NotAPackage.nupkg', 'readme.txt',
+        )
+        self.manifest_path.write_text('Bonsai.Core\n')
+
+        with redirect_stdout(io.StringIO()):
+            filter_release_packages.main(['filter-release-packages.py', str(self.manifest_path), str(self.packages_path)])
+        self.assertEqual(self.get_files(), ['Bonsai.Core.2.8.0.nupkg', 'Bonsai.Core.2.8.0.snupkg', 'readme.txt'])
+
+    def test_bad_command_line_fails(self):
+        with redirect_stdout(io.StringIO()), self.assertRaises(SystemExit) as context:
+            filter_release_packages.main(['filter-release-packages.py'])
+        self.assertEqual(context.exception.code, 1)
+
+    def test_script_runner_returns_exit_code(self):
+        self.add_files('Bonsai.Core.2.8.0.nupkg')
+        self.manifest_path.write_text('Bonsai.Core\n')
+
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(script_runner.run('filter-release-packages', [str(self.manifest_path), str(self.packages_path)]), 0)
+            self.assertEqual(script_runner.run('filter-release-packages', []), 1)
+        self.assertFalse(gha.errors_were_printed)
+        self.assertEqual(self.get_files(), ['Bonsai.Core.2.8.0.nupkg'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+from contextlib import redirect_stdout
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import gha
+
+class CommandSessionTests(unittest.TestCase):
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.output_path = Path(temporary_directory.name) / 'output'
+        self.output_path.write_text('')
+        environment = mock.patch.dict(os.environ, { 'GITHUB_OUTPUT': str(self.output_path) })
+        environment.start()
+        self.addCleanup(environment.stop)
+        os.environ.pop('GITHUB_ENV', None)
+
+    def test_commands_are_written_when_the_session_ends(self):
+        with gha.CommandSession():
+            gha.set_output('a', True)
+            gha.set_output('b', 'value')
+            self.assertEqual(self.output_path.read_text(), '')
+        self.assertEqual(self.output_path.read_text(), 'a<<GHA_PY_EOF\ntrue\nGHA_PY_EOF\nb<<GHA_PY_EOF\nvalue\nGHA_PY_EOF\n')
+
+    def test_command_files_are_only_resolved_when_the_session_starts(self):
+        with gha.CommandSession():
+            with mock.patch.object(os, 'getenv', side_effect=AssertionError('getenv')), mock.patch.object(os.path, 'exists', side_effect=AssertionError('exists')):
+                gha.set_output('a', 'value')
+        self.assertEqual(self.output_path.read_text(), 'a<<GHA_PY_EOF\nvalue\nGHA_PY_EOF\n')
+
+    def test_missing_command_file_fails_when_used(self):
+        with mock.patch.object(gha, 'errors_were_printed', False):
+            with self.assertRaises(SystemExit), gha.CommandSession():
+                gha.set_environment_variable('NAME', 'value')
+
+class ProfilingTests(unittest.TestCase):
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.profiles_path = Path(temporary_directory.name) / 'profiles'
+        self.summary_path = Path(temporary_directory.name) / 'summary.md'
+        self.summary_path.write_text('')
+        environment = mock.patch.dict(os.environ, { 'GHA_PY_PROFILE_PATH': str(self.profiles_path), 'GITHUB_STEP_SUMMARY': str(self.summary_path) })
+        environment.start()
+        self.addCleanup(environment.stop)
+        self.addCleanup(gha.reported_profile_options.clear)
+
+    def get_profile_options(self, value: str) -> tuple[set[str] | None, str]:
+        output = io.StringIO()
+        with mock.patch.dict(os.environ, { 'GHA_PY_PROFILE': value }), redirect_stdout(output):
+            return gha.get_profile_options(), output.getvalue()
+
+    def test_profile_options(self):
+        self.assertEqual(self.get_profile_options('false'), (None, ''))
+        self.assertEqual(self.get_profile_options('1'), ({ 'timings' }, ''))
+        self.assertEqual(self.get_profile_options('cprofile, TraceMalloc'), ({ 'cprofile', 'tracemalloc' }, ''))
+
+    def test_unknown_profile_options_are_reported_once(self):
+        options, output = self.get_profile_options('phases,timings')
+        self.assertEqual(options, { 'timings' })
+        self.assertIn("::warning::Unknown GHA_PY_PROFILE option 'phases'", output)
+        self.assertEqual(self.get_profile_options('phases'), (set(), ''))
+
+    def test_every_script_run_gets_its_own_profile(self):
+        def main(argv: list[str]):
+            with gha.profile_phase('work'):
+                pass
+
+        with mock.patch.dict(os.environ, { 'GHA_PY_PROFILE': 'timings' }):
+            gha.run_script(main, ['first.py', 'a'])
+            gha.run_script(main, ['second.py'])
+        self.assertIsNone(gha.profiler)
+
+        profiles = sorted(path.name.split('-')[0] for path in self.profiles_path.iterdir())
+        self.assertEqual(profiles, ['first', 'second'])
+        self.assertEqual(self.summary_path.read_text().count('### Profile of'), 2)
+
+    def test_nothing_is_profiled_by_default(self):
+        with mock.patch.dict(os.environ, { 'GHA_PY_PROFILE': '' }):
+            gha.run_script(lambda argv: None, ['script.py'])
+        self.assertFalse(self.profiles_path.exists())
+
+if __name__ == '__main__':
+    unittest.main()
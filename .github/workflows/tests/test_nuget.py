@@ -0,0 +1,105 @@
+import sys
+import tempfile
+import unittest
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import nuget
+
+class PackageDirectoryIndexTests(unittest.TestCase):
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.path = Path(temporary_directory.name)
+
+    def add_files(self, *file_names: str):
+        for file_name in file_names:
+            (self.path / file_name).write_bytes(b'')
+
+    def test_extensions_are_case_insensitive(self):
+        self.add_files('Bonsai.Core.2.8.0.NUPKG', 'Bonsai.Core.2.8.0.SNupkg', 'Bonsai.Core.2.8.0.nupkg.Fingerprint.JSON', 'readme.txt')
+        index = nuget.PackageDirectoryIndex(self.path)
+        package = index['Bonsai.Core']
+        self.assertEqual(package.version, '2.8.0')
+        self.assertEqual(package.nupkg_path, self.path / 'Bonsai.Core.2.8.0.NUPKG')
+        self.assertEqual(package.snupkg_path, self.path / 'Bonsai.Core.2.8.0.SNupkg')
+        self.assertEqual(package.fingerprint_path, self.path / 'Bonsai.Core.2.8.0.nupkg.Fingerprint.JSON')
+        self.assertEqual(index.unrecognized_files, [])
+
+    def test_every_version_is_indexed(self):
+        self.add_files('Bonsai.Core.2.8.0.nupkg', 'Bonsai.Core.2.8.0.snupkg', 'Bonsai.Core.2.9.0.nupkg')
+        index = nuget.PackageDirectoryIndex(self.path)
+        self.assertEqual(index['Bonsai.Core'].version, '2.8.0')
+        versions = { package.version: package.get_paths() for package in index.get_versions('Bonsai.Core') }
+        self.assertEqual(versions, {
+            '2.8.0': [self.path / 'Bonsai.Core.2.8.0.nupkg', self.path / 'Bonsai.Core.2.8.0.snupkg'],
+            '2.9.0': [self.path / 'Bonsai.Core.2.9.0.nupkg'],
+        })
+
+class SemanticVersionTests(unittest.TestCase):
+    def assert_ascending(self, *versions: str):
+        parsed = [nuget.parse_version(version) for version in versions]
+        for lower, higher in zip(parsed, parsed[1:]):
+            with self.subTest(lower=str(lower), higher=str(higher)):
+                self.assertLess(lower, higher)
+                self.assertGreater(higher, lower)
+                self.assertNotEqual(lower, higher)
+
+    def test_release_versions_are_ordered_numerically(self):
+        self.assert_ascending('1.9.9', '1.10.0', '2.0.0', '2.0.10', '10.0.0')
+
+    def test_prereleases_sort_before_their_release(self):
+        self.assert_ascending('1.0.0-alpha', '1.0.0', '1.0.1-0')
+
+    def test_prerelease_precedence(self):
+        # The example from https://semver.org/spec/v2.0.0.html#spec-item-11
+        self.assert_ascending('1.0.0-alpha', '1.0.0-alpha.1', '1.0.0-alpha.beta', '1.0.0-beta', '1.0.0-beta.2', '1.0.0-beta.11', '1.0.0-rc.1', '1.0.0')
+
+    def test_numeric_identifiers_sort_before_alphanumeric_ones(self):
+        self.assert_ascending('1.0.0-2', '1.0.0-10', '1.0.0-1a', '1.0.0-a')
+        self.assert_ascending('1.0.0-beta.99', '1.0.0-beta.a')
+
+    def test_shorter_prerelease_sorts_first(self):
+        self.assert_ascending('1.0.0-beta', '1.0.0-beta.0', '1.0.0-beta.0.0')
+
+    def test_build_metadata_is_ignored(self):
+        a = nuget.parse_version('1.2.3-beta+abc')
+        b = nuget.parse_version('1.2.3-beta+def')
+        c = nuget.parse_version('1.2.3-beta')
+        self.assertEqual(a, b)
+        self.assertEqual(a, c)
+        self.assertEqual(hash(a), hash(b))
+        self.assertEqual(hash(a), hash(c))
+        self.assertEqual(len({ a, b, c }), 1)
+        self.assertFalse(a < b or a > b)
+        self.assertEqual(str(a), '1.2.3-beta+abc')
+
+    def test_versions_are_immutable(self):
+        version = nuget.parse_version('1.2.3')
+        with self.assertRaises(AttributeError):
+            version.major = 2 # type: ignore
+        self.assertEqual(version.replace(patch=4, prerelease='rc'), nuget.parse_version('1.2.4-rc'))
+
+    def test_get_latest_version(self):
+        versions = ['1.0.0', '2.0.0-beta', 'invalid', '1.5.0+build']
+        self.assertEqual(str(nuget.get_latest_version(versions)), '2.0.0-beta')
+        self.assertEqual(str(nuget.get_latest_version(versions, include_prerelease=False)), '1.5.0+build')
+        self.assertIsNone(nuget.get_latest_version(['invalid']))
+
+    def test_only_the_start_must_be_a_version(self):
+        # Versions are matched as a prefix
+        self.assertTrue(nuget.is_valid_version('1.2.3'))
+        self.assertTrue(nuget.is_valid_version('1.2.3.4'))
+        self.assertTrue(nuget.is_valid_version('1.2.3-beta!'))
+        self.assertFalse(nuget.is_valid_version('v1.2.3'))
+        self.assertFalse(nuget.is_valid_version('1.2'))
+        self.assertFalse(nuget.is_valid_version('1.2.3+build', forbid_build_metadata=True))
+        self.assertEqual(str(nuget.get_version_parts('1.2.3.4')), '1.2.3')
+        self.assertEqual(nuget.get_version_parts('1.0.0-1a.2b').prerelease, '1a.2b')
+        self.assertFalse(nuget.is_preview_version('1.2.3.4'))
+        self.assertTrue(nuget.is_preview_version('1.2.3-beta!'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import random
+import sys
+import tempfile
+import unittest
+import uuid
+import zipfile
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import nupkg_normalizer
+
+NUSPEC = '''<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://schemas.microsoft.com/packaging/2013/05/nuspec.xsd">
+  <metadata><id>Bonsai.Core</id><version>2.9.0</version><authors>Bonsai Foundation</authors><description>Bonsai Core Library</description><tags>Bonsai Rx</tags></metadata>
+</package>'''
+
+CONTENT_TYPES = '<?xml version="1.0" encoding="utf-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types"><Default Extension="dll" ContentType="application/octet" /></Types>'
+
+class NormalizeTests(unittest.TestCase):
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.path = Path(temporary_directory.name)
+
+    # Packs the same contents the way NuGet does, which differs between packs in everything the normalizer is meant to replace
+    def pack(self, file_name: str, date_time: tuple[int, int, int, int, int, int], nuspec: str = NUSPEC) -> Path:
+        core_properties_path = f'package/services/metadata/core-properties/{uuid.uuid4().hex}.psmdcp'
+        relationships = ''.join([
+            '<?xml version="1.0" encoding="utf-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">',
+            f'<Relationship Type="{nupkg_normalizer.MANIFEST_RELATIONSHIP_TYPE}" Target="/Bonsai.Core.nuspec" Id="R{uuid.uuid4().hex[:16]}" />',
+            f'<Relationship Type="{nupkg_normalizer.CORE_PROPERTIES_RELATIONSHIP_TYPE}" Target="/{core_properties_path}" Id="R{uuid.uuid4().hex[:16]}" />',
+            '</Relationships>',
+        ])
+        core_properties = f'<?xml version="1.0" encoding="utf-8"?><coreProperties><lastModifiedBy>NuGet, Version=6.{random.randrange(100)}.0; .NET</lastModifiedBy></coreProperties>'
+        entries = [
+            ('_rels/.rels', relationships),
+            ('Bonsai.Core.nuspec', nuspec),
+            ('lib/', None),
+            ('lib/net8.0/Bonsai.Core.dll', bytes(range(256)) * 64),
+            ('lib/net8.0/Bonsai.Core.xml', '<doc />'),
+            (core_properties_path, core_properties),
+            ('[Content_Types].xml', CONTENT_TYPES),
+        ]
+        # Entry order and compression aren't guaranteed to be stable either
+        random.shuffle(entries)
+        package_path = self.path / file_name
+        with zipfile.ZipFile(package_path, 'w') as package:
+            for name, data in entries:
+                info = zipfile.ZipInfo(name, date_time)
+                info.compress_type = random.choice((zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED))
+                package.writestr(info, data or '')
+        return package_path
+
+    def test_packs_of_the_same_contents_are_identical(self):
+        first_path = self.pack('first.nupkg', (2024, 5, 1, 12, 30, 0))
+        second_path = self.pack('second.nupkg', (2024, 5, 2, 8, 15, 42))
+        self.assertNotEqual(first_path.read_bytes(), second_path.read_bytes())
+
+        nupkg_normalizer.normalize(first_path)
+        nupkg_normalizer.normalize(second_path)
+        self.assertEqual(first_path.read_bytes(), second_path.read_bytes())
+
+    def test_normalizing_is_idempotent(self):
+        package_path = self.pack('package.nupkg', (2024, 5, 1, 12, 30, 0))
+        nupkg_normalizer.normalize(package_path)
+        normalized = package_path.read_bytes()
+        nupkg_normalizer.normalize(package_path)
+        self.assertEqual(package_path.read_bytes(), normalized)
+        self.assertEqual(list(self.path.iterdir()), [package_path])
+
+    def test_contents_are_preserved(self):
+        package_path = self.pack('package.nupkg', (2024, 5, 1, 12, 30, 0))
+        with zipfile.ZipFile(package_path, 'r') as package:
+            original = { info.filename: package.read(info) for info in package.infolist() if not info.is_dir() and not nupkg_normalizer.is_generated_part(info.filename) }
+
+        nupkg_normalizer.normalize(package_path)
+        with zipfile.ZipFile(package_path, 'r') as package:
+            self.assertIsNone(package.testzip())
+            infos = package.infolist()
+            names = [info.filename for info in infos]
+            self.assertEqual(names, sorted(names))
+            self.assertTrue(all(info.date_time == nupkg_normalizer.NORMALIZED_DATE_TIME for info in infos))
+            self.assertEqual({ name: package.read(name) for name in names if not nupkg_normalizer.is_generated_part(name) }, original)
+
+            # The relationships point at the regenerated core properties
+            core_properties_paths = [name for name in names if name.startswith(nupkg_normalizer.CORE_PROPERTIES_DIRECTORY)]
+            self.assertEqual(len(core_properties_paths), 1)
+            relationships = package.read(nupkg_normalizer.RELATIONSHIPS_PATH).decode('utf-8')
+            self.assertIn(f'Target="/{core_properties_paths[0]}"', relationships)
+            self.assertIn('Target="/Bonsai.Core.nuspec"', relationships)
+            core_properties = package.read(core_properties_paths[0]).decode('utf-8')
+            self.assertIn('<dc:identifier>Bonsai.Core</dc:identifier><version>2.9.0</version><keywords>Bonsai Rx</keywords><lastModifiedBy>NuGet</lastModifiedBy>', core_properties)
+
+    def test_different_contents_are_different(self):
+        first_path = self.pack('first.nupkg', (2024, 5, 1, 12, 30, 0))
+        second_path = self.pack('second.nupkg', (2024, 5, 1, 12, 30, 0), NUSPEC.replace('2.9.0', '2.9.1'))
+        nupkg_normalizer.normalize(first_path)
+        nupkg_normalizer.normalize(second_path)
+        self.assertNotEqual(first_path.read_bytes(), second_path.read_bytes())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import sys
+import tempfile
+import unittest
+
+from pathlib import Path
+from zipfile import ZipFile
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import nuget
+import offline_packages
+
+class ResolveTests(unittest.TestCase):
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.path = Path(temporary_directory.name)
+        self.built_path = self.path / 'built'
+        self.built_path.mkdir()
+        self.global_packages = offline_packages.GlobalPackagesFolder(self.path / 'global')
+
+    # Adds a package to the global packages folder the same way NuGet lays it out
+    def add_package(self, id: str, version: str, dependencies: list[tuple[str, str]] = []):
+        version_path = self.global_packages.path / id.lower() / version
+        version_path.mkdir(parents=True)
+        dependency_elements = ''.join(f'<dependency id="{dependency_id}" version="{dependency_version}" />' for dependency_id, dependency_version in dependencies)
+        nuspec = ''.join([
+            '<?xml version="1.0" encoding="utf-8"?>',
+            '<package xmlns="http://schemas.microsoft.com/packaging/2013/05/nuspec.xsd"><metadata>',
+            f'<id>{id}</id><version>{version}</version>',
+            f'<dependencies><group targetFramework=".NETFramework4.7.2">{dependency_elements}</group></dependencies>',
+            '</metadata></package>',
+        ])
+        with ZipFile(version_path / f"{id.lower()}.{version}.nupkg", 'w') as package:
+            package.writestr(f"{id}.nuspec", nuspec)
+
+    def resolve(self, root_ids: list[str]) -> tuple[dict[str, str], list[tuple[str, str, str | None]]]:
+        packages, missing = offline_packages.resolve(root_ids, nuget.PackageDirectoryIndex(self.built_path), self.global_packages)
+        return { package.id: package.version for package in packages }, missing
+
+    def test_highest_minimum_version_wins_regardless_of_order(self):
+        self.add_package('X', '1.0.0')
+        self.add_package('X', '2.0.0', [('Y', '1.0.0')])
+        self.add_package('Y', '1.0.0')
+        self.add_package('A', '1.0.0', [('X', '1.0.0')])
+        self.add_package('B', '1.0.0', [('X', '2.0.0')])
+        self.add_package('AFirst', '1.0.0', [('A', '1.0.0'), ('B', '1.0.0')])
+        self.add_package('BFirst', '1.0.0', [('B', '1.0.0'), ('A', '1.0.0')])
+
+        for root_id in ('AFirst', 'BFirst'):
+            with self.subTest(root_id=root_id):
+                packages, missing = self.resolve([root_id])
+                self.assertEqual(packages, { root_id: '1.0.0', 'A': '1.0.0', 'B': '1.0.0', 'X': '2.0.0', 'Y': '1.0.0' })
+                self.assertEqual(missing, [])
+
+    def test_dependencies_of_replaced_versions_are_dropped(self):
+        self.add_package('X', '1.0.0', [('Old', '1.0.0')])
+        self.add_package('X', '2.0.0')
+        self.add_package('Old', '1.0.0')
+        self.add_package('A', '1.0.0', [('X', '1.0.0')])
+        self.add_package('B', '1.0.0', [('X', '2.0.0')])
+
+        packages, missing = self.resolve(['A', 'B'])
+        self.assertEqual(packages, { 'A': '1.0.0', 'B': '1.0.0', 'X': '2.0.0' })
+        self.assertEqual(missing, [])
+
+    def test_unsatisfiable_minimum_version_is_missing(self):
+        self.add_package('X', '1.0.0')
+        self.add_package('A', '1.0.0', [('X', '1.0.0')])
+        self.add_package('B', '1.0.0', [('X', '2.0.0')])
+
+        packages, missing = self.resolve(['A', 'B'])
+        self.assertNotIn('X', packages)
+        self.assertIn(('B', 'X', '2.0.0'), missing)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,261 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import package_comparison
+
+from package_comparison import ComparisonMode, DigestCache, PackageComparer, ZipPackageSource
+
+class PackageTestCase(unittest.TestCase):
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.path = Path(temporary_directory.name)
+
+    # Entries are (name, data) or (name, data, compress_type, compresslevel)
+    def write_package(self, file_name: str, entries: list[tuple]) -> Path:
+        path = self.path / file_name
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as package:
+            package.writestr('_rels/.rels', os.urandom(16))
+            for entry in entries:
+                name, data, compress_type, compress_level = entry if len(entry) == 4 else (*entry, zipfile.ZIP_DEFLATED, None)
+                package.writestr(name, data, compress_type, compress_level)
+        return path
+
+class RawStreamTests(PackageTestCase):
+    def raw_streams_are_equal(self, a_entry: tuple, b_entry: tuple) -> bool:
+        with ZipPackageSource(self.write_package('a.nupkg', [a_entry])) as a, ZipPackageSource(self.write_package('b.nupkg', [b_entry])) as b:
+            return package_comparison.raw_streams_are_equal(a, a.entries[a_entry[0]], b, b.entries[b_entry[0]])
+
+    def test_equal_raw_streams(self):
+        data = os.urandom(1000) * 100
+        self.assertTrue(self.raw_streams_are_equal(('lib/a.dll', data), ('lib/a.dll', data)))
+
+    def test_unequal_raw_streams(self):
+        # Stored entries have the same compressed size whatever their contents, the last bytes are outside of the 8 byte words
+        data = os.urandom(1003)
+        for index in (0, 500, 1002):
+            changed = bytearray(data)
+            changed[index] ^= 0xFF
+            with self.subTest(index=index):
+                self.assertFalse(self.raw_streams_are_equal(('a.bin', data, zipfile.ZIP_STORED, None), ('a.bin', bytes(changed), zipfile.ZIP_STORED, None)))
+
+    def test_different_compression_is_not_equal(self):
+        data = os.urandom(1000) * 100
+        self.assertFalse(self.raw_streams_are_equal(('a.bin', data, zipfile.ZIP_DEFLATED, 1), ('a.bin', data, zipfile.ZIP_DEFLATED, 9)))
+        self.assertFalse(self.raw_streams_are_equal(('a.bin', data, zipfile.ZIP_STORED, None), ('a.bin', data, zipfile.ZIP_DEFLATED, None)))
+
+    def compare(self, a_entry: tuple, b_entry: tuple) -> tuple[bool, int]:
+        a_path = self.write_package('a.nupkg', [a_entry])
+        b_path = self.write_package('b.nupkg', [b_entry])
+        comparer = PackageComparer(ComparisonMode.DECIDE, log=lambda message: None, compare_raw_streams=True)
+        with mock.patch.object(ZipPackageSource, 'digest', autospec=True, side_effect=ZipPackageSource.digest) as digest:
+            return comparer.packages_are_equivalent(a_path, b_path), digest.call_count
+
+    def test_equal_raw_streams_are_not_hashed(self):
+        data = os.urandom(1000) * 100
+        self.assertEqual(self.compare(('a.bin', data), ('a.bin', data)), (True, 0))
+
+    def test_unequal_raw_streams_fall_back_to_hashing(self):
+        data = os.urandom(1000) * 100
+        self.assertEqual(self.compare(('a.bin', data, zipfile.ZIP_DEFLATED, 1), ('a.bin', data, zipfile.ZIP_DEFLATED, 9)), (True, 2))
+
+class DigestCacheTests(PackageTestCase):
+    def compare(self, digest_cache: DigestCache, a_path: Path, b_path: Path) -> tuple[bool, int]:
+        comparer = PackageComparer(ComparisonMode.DIAGNOSE, log=lambda message: None, digest_cache=digest_cache)
+        with mock.patch.object(ZipPackageSource, 'digest', autospec=True, side_effect=ZipPackageSource.digest) as digest:
+            return comparer.packages_are_equivalent(a_path, b_path), digest.call_count
+
+    def test_unchanged_entries_are_hashed_once(self):
+        data = os.urandom(1000) * 100
+        digest_cache = DigestCache()
+        a_path = self.write_package('a.nupkg', [('lib/a.dll', data), ('lib/b.dll', data + b'a')])
+        b_path = self.write_package('b.nupkg', [('lib/a.dll', data), ('lib/b.dll', data + b'b')])
+        # The differing entry is already caught by its CRC
+        self.assertEqual(self.compare(digest_cache, a_path, b_path), (False, 1))
+        self.assertEqual((digest_cache.hits, digest_cache.misses), (1, 1))
+        self.assertEqual(digest_cache.hit_bytes, len(data))
+
+    def test_blobs_are_shared_between_packages(self):
+        data = os.urandom(1000) * 100
+        digest_cache = DigestCache()
+        for name in ('A', 'B'):
+            a_path = self.write_package(f'{name}.1.nupkg', [(f'lib/{name}.dll', data), ('runtimes/native/shared.dll', data)])
+            b_path = self.write_package(f'{name}.2.nupkg', [(f'lib/{name}.dll', data), ('runtimes/native/shared.dll', data)])
+            self.assertEqual(self.compare(digest_cache, a_path, b_path), (True, 1 if name == 'A' else 0))
+        self.assertEqual((digest_cache.hits, digest_cache.misses), (7, 1))
+
+    def test_small_and_stored_entries_are_not_cached(self):
+        digest_cache = DigestCache()
+        entries = [('small.txt', b'small'), ('stored.bin', os.urandom(100 * 1000), zipfile.ZIP_STORED, None)]
+        a_path = self.write_package('a.nupkg', entries)
+        b_path = self.write_package('b.nupkg', entries)
+        self.assertEqual(self.compare(digest_cache, a_path, b_path), (True, 4))
+        self.assertEqual((digest_cache.hits, digest_cache.misses), (0, 0))
+
+    def test_least_recently_used_digests_are_evicted(self):
+        digest_cache = DigestCache(max_entries=2)
+        entries = [(f'{index}.bin', os.urandom(1000) * 100) for index in range(3)]
+        a_path = self.write_package('a.nupkg', entries)
+        b_path = self.write_package('b.nupkg', entries)
+        self.assertEqual(self.compare(digest_cache, a_path, b_path), (True, 3))
+        self.assertEqual((digest_cache.hits, digest_cache.misses, digest_cache.evictions), (3, 3, 1))
+        self.assertEqual(len(digest_cache.digests), 2)
+
+class TierTests(PackageTestCase):
+    def compare(self, mode: ComparisonMode, a_entries: list[tuple], b_entries: list[tuple], deep_hash: bool = True) -> tuple[bool, list[str], int]:
+        a_path = self.write_package('a.nupkg', a_entries)
+        b_path = self.write_package('b.nupkg', b_entries)
+        log = []
+        comparer = PackageComparer(mode, package_comparison.get_tiers(deep_hash), log=log.append)
+        with mock.patch.object(ZipPackageSource, 'digest', autospec=True, side_effect=ZipPackageSource.digest) as digest:
+            is_equivalent = comparer.packages_are_equivalent(a_path, b_path)
+        return is_equivalent, [message for message in log if not message.startswith('Comparing ')], digest.call_count
+
+    def test_tiers_run_cheapest_first(self):
+        self.assertEqual([tier.name for tier in package_comparison.get_tiers()], ['names', 'crc-and-size', 'deep-hash'])
+        self.assertEqual([tier.name for tier in package_comparison.get_tiers(deep_hash=False)], ['names', 'crc-and-size'])
+
+    def test_equivalent_packages_are_hashed(self):
+        entries = [('lib/a.dll', b'a' * 1000), ('lib/b.dll', b'b' * 1000)]
+        self.assertEqual(self.compare(ComparisonMode.DECIDE, entries, entries), (True, [], 4))
+        self.assertEqual(self.compare(ComparisonMode.DECIDE, entries, entries, deep_hash=False), (True, [], 0))
+
+    def test_ignored_entries_are_not_compared(self):
+        a_entries = [('lib/a.dll', b'a'), ('package/services/metadata/core-properties/a.psmdcp', b'a'), ('lib/', b'')]
+        b_entries = [('lib/a.dll', b'a'), ('package/services/metadata/core-properties/b.psmdcp', b'b')]
+        self.assertEqual(self.compare(ComparisonMode.DIAGNOSE, a_entries, b_entries), (True, [], 2))
+
+    def test_decide_mode_stops_at_the_first_difference(self):
+        a_entries = [('lib/a.dll', b'a'), ('lib/b.dll', b'b'), ('lib/c.dll', b'c')]
+        b_entries = [('lib/a.dll', b'a'), ('lib/b.dll', b'B'), ('lib/d.dll', b'd')]
+        self.assertEqual(self.compare(ComparisonMode.DECIDE, a_entries, b_entries), (False, [
+            "Not equivalent: 'lib/c.dll' exists in '" + str(self.path / 'a.nupkg') + "' but not in '" + str(self.path / 'b.nupkg') + "'",
+            "Stopped comparing after the 'names' tier found a difference",
+        ], 0))
+
+    def test_decide_mode_skips_hashing_after_a_crc_difference(self):
+        a_entries = [('lib/a.dll', b'a' * 1000), ('lib/b.dll', b'b')]
+        b_entries = [('lib/a.dll', b'a' * 1000), ('lib/b.dll', b'B')]
+        is_equivalent, log, digest_count = self.compare(ComparisonMode.DECIDE, a_entries, b_entries)
+        self.assertFalse(is_equivalent)
+        self.assertTrue(log[0].startswith("Not equivalent: CRCs of 'lib/b.dll' do not match"))
+        self.assertEqual(log[1:], ["Stopped comparing after the 'crc-and-size' tier found a difference"])
+        self.assertEqual(digest_count, 0)
+
+    def test_diagnose_mode_logs_every_difference(self):
+        a_entries = [('lib/a.dll', b'a' * 1000), ('lib/b.dll', b'b'), ('lib/c.dll', b'c')]
+        b_entries = [('lib/a.dll', b'a' * 1000), ('lib/b.dll', b'B'), ('lib/d.dll', b'd')]
+        is_equivalent, log, digest_count = self.compare(ComparisonMode.DIAGNOSE, a_entries, b_entries)
+        self.assertFalse(is_equivalent)
+        self.assertEqual(len(log), 3)
+        self.assertTrue(log[0].startswith("Not equivalent: 'lib/c.dll' exists in"))
+        self.assertTrue(log[1].startswith("Not equivalent: 'lib/d.dll' exists in"))
+        self.assertTrue(log[2].startswith("Not equivalent: CRCs of 'lib/b.dll' do not match"))
+        # Only the entry which is the same so far still needs to be hashed
+        self.assertEqual(digest_count, 2)
+
+class FingerprintTests(PackageTestCase):
+    entries = [('lib/a.dll', b'a' * 1000), ('lib/b.dll', b'b' * 1000), ('package/services/metadata/core-properties/a.psmdcp', b'a')]
+
+    # Replaces the package with its fingerprint
+    def write_fingerprint(self, package_path: Path) -> Path:
+        fingerprint_path = package_comparison.write_fingerprint(package_path)
+        package_path.unlink()
+        return fingerprint_path
+
+    def edit_fingerprint(self, fingerprint_path: Path, edit):
+        fingerprint = json.loads(fingerprint_path.read_text())
+        edit(fingerprint)
+        fingerprint_path.write_text(json.dumps(fingerprint))
+
+    def compare(self, a_path: Path, b_path: Path, mode: ComparisonMode = ComparisonMode.DECIDE) -> tuple[bool, list[str], PackageComparer]:
+        log = []
+        comparer = PackageComparer(mode, log=log.append)
+        return comparer.packages_are_equivalent(a_path, b_path), [message for message in log if not message.startswith('Comparing ')], comparer
+
+    def test_fingerprints_list_compared_entries(self):
+        package_path = self.write_package('a.nupkg', self.entries)
+        fingerprint = json.loads(self.write_fingerprint(package_path).read_text())
+        self.assertEqual(fingerprint['format'], package_comparison.FINGERPRINT_FORMAT_VERSION)
+        self.assertEqual(fingerprint['package'], 'a.nupkg')
+        self.assertEqual([entry['name'] for entry in fingerprint['entries']], ['lib/a.dll', 'lib/b.dll'])
+        self.assertEqual(fingerprint['entries'][0]['sha256'], hashlib.sha256(b'a' * 1000).hexdigest())
+        self.assertEqual(fingerprint['entries'][0]['size'], 1000)
+
+    def test_fingerprints_are_preferred(self):
+        package_path = self.write_package('a.nupkg', self.entries)
+        package_comparison.write_fingerprint(package_path)
+        with package_comparison.open_package_source(package_path) as source:
+            self.assertIsInstance(source, package_comparison.FingerprintPackageSource)
+        with package_comparison.open_package_source(self.write_package('b.nupkg', self.entries)) as source:
+            self.assertIsInstance(source, ZipPackageSource)
+
+    def test_fingerprint_against_package(self):
+        a_path = self.write_package('a.nupkg', self.entries)
+        self.write_fingerprint(a_path)
+        self.assertTrue(self.compare(a_path, self.write_package('b.nupkg', self.entries))[0])
+        self.assertFalse(self.compare(a_path, self.write_package('c.nupkg', [('lib/a.dll', b'a' * 1000), ('lib/b.dll', b'B' * 1000)]))[0])
+        self.assertFalse(self.compare(a_path, self.write_package('d.nupkg', [('lib/a.dll', b'a' * 1000)]))[0])
+
+    def test_fingerprint_against_fingerprint(self):
+        a_path = self.write_package('a.nupkg', self.entries)
+        b_path = self.write_package('b.nupkg', self.entries)
+        c_path = self.write_package('c.nupkg', [('lib/a.dll', b'a' * 1000), ('lib/b.dll', b'B' * 1000)])
+        for path in (a_path, b_path, c_path):
+            self.write_fingerprint(path)
+        with mock.patch.object(package_comparison, 'ZipPackageSource', side_effect=AssertionError('ZipPackageSource')):
+            self.assertTrue(self.compare(a_path, b_path)[0])
+            self.assertFalse(self.compare(a_path, c_path)[0])
+
+    def test_deep_hash_difference_is_detected(self):
+        # The CRCs and sizes match, only the hashes can tell the entries apart
+        a_path = self.write_package('a.nupkg', self.entries)
+        self.edit_fingerprint(self.write_fingerprint(a_path), lambda fingerprint: fingerprint['entries'][1].update(sha256=hashlib.sha256(b'other').hexdigest()))
+        is_equivalent, log, _ = self.compare(a_path, self.write_package('b.nupkg', self.entries))
+        self.assertFalse(is_equivalent)
+        self.assertTrue(log[0].startswith("Not equivalent: SHA256 hashes of 'lib/b.dll' do not match"))
+        self.assertEqual(log[1:], ["Stopped comparing after the 'deep-hash' tier found a difference"])
+
+    def test_unsupported_fingerprint_format(self):
+        a_path = self.write_package('a.nupkg', self.entries)
+        self.edit_fingerprint(self.write_fingerprint(a_path), lambda fingerprint: fingerprint.update(format=0))
+        with self.assertRaises(ValueError):
+            self.compare(a_path, self.write_package('b.nupkg', self.entries))
+
+    def test_identical_files_are_not_compared_entry_by_entry(self):
+        a_path = self.write_package('a.nupkg', self.entries)
+        b_path = self.path / 'b.nupkg'
+        shutil.copyfile(a_path, b_path)
+        self.write_fingerprint(a_path)
+        with mock.patch.object(package_comparison, 'open_package_source', side_effect=AssertionError('open_package_source')):
+            is_equivalent, log, comparer = self.compare(a_path, b_path)
+        self.assertEqual((is_equivalent, log, comparer.identical_files), (True, ["Equivalent: The packages are identical"], 1))
+
+    def test_identical_files_need_a_recorded_hash(self):
+        # Neither side has a fingerprint with the hash of the whole file (older fingerprints don't), so the packages are compared entry by entry
+        a_path = self.write_package('a.nupkg', self.entries)
+        b_path = self.path / 'b.nupkg'
+        shutil.copyfile(a_path, b_path)
+        self.assertEqual(self.compare(a_path, b_path)[2].identical_files, 0)
+        self.edit_fingerprint(self.write_fingerprint(a_path), lambda fingerprint: fingerprint.pop('sha256'))
+        self.assertEqual(self.compare(a_path, b_path)[2].identical_files, 0)
+
+    def test_different_files_with_equivalent_contents(self):
+        a_path = self.write_package('a.nupkg', self.entries)
+        self.write_fingerprint(a_path)
+        is_equivalent, _, comparer = self.compare(a_path, self.write_package('b.nupkg', self.entries))
+        self.assertEqual((is_equivalent, comparer.identical_files), (True, 0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import concurrent.futures
+import io
+import os
+import sys
+import tempfile
+import unittest
+import zipfile
+
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import parallel_deflate
+
+class WriteTests(unittest.TestCase):
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.file_path = Path(temporary_directory.name) / 'data.bin'
+        # Compressible but not trivially so, and large enough to be split into chunks
+        self.data = b''.join(os.urandom(64) * 64 for _ in range(64))
+        self.file_path.write_bytes(self.data)
+
+    def write_zip(self) -> bytes:
+        output_stream = io.BytesIO()
+        with zipfile.ZipFile(output_stream, 'w') as output, concurrent.futures.ThreadPoolExecutor(2) as executor:
+            parallel_deflate.write(output, str(self.file_path), 'data.bin', 9, executor, chunk_size=16 * 1024)
+            output.writestr('after.txt', b'after')
+        return output_stream.getvalue()
+
+    def assert_valid_zip(self, zip_bytes: bytes):
+        with zipfile.ZipFile(io.BytesIO(zip_bytes), 'r') as zip_file:
+            self.assertIsNone(zip_file.testzip())
+            self.assertEqual(zip_file.read('data.bin'), self.data)
+            self.assertEqual(zip_file.read('after.txt'), b'after')
+
+    def test_parallel_compression(self):
+        self.assert_valid_zip(self.write_zip())
+
+    def test_fallback_without_zipfile_internals(self):
+        with mock.patch.object(parallel_deflate, 'CAN_WRITE_COMPRESSED', False):
+            self.assert_valid_zip(self.write_zip())
+            with self.assertRaises(NotImplementedError):
+                parallel_deflate.write_compressed(zipfile.ZipFile(io.BytesIO(), 'w'), zipfile.ZipInfo('x'), b'', 0, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import hashlib
+import io
+import sys
+import unittest
+import zipfile
+
+from contextlib import redirect_stdout
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pdb_normalizer
+
+# B.dll and B.pdb are a deterministic net8.0 build of a library which calls into another library (A) of the same solution:
+#   original:           namespace B; public static class Baz { public static int Qux() => A.Foo.Bar() + 1; }
+#   dependency-changed: the same, but A gained a method so its MVID changed
+#   code-changed:       the same as original except Qux returns A.Foo.Bar() + 2
+FIXTURES_PATH = Path(__file__).resolve().parent / 'fixtures' / 'pdb_normalizer'
+
+def read_fixture(build: str, file_name: str) -> bytes:
+    return (FIXTURES_PATH / build / file_name).read_bytes()
+
+def get_masks(file_name: str, data: bytes) -> list[tuple[int, int]]:
+    return pdb_normalizer.get_masks(file_name, io.BytesIO(data))
+
+def get_normalized_digest(file_name: str, data: bytes) -> bytes:
+    return pdb_normalizer.get_normalized_digest(file_name, io.BytesIO(data))
+
+def is_masked(masks: list[tuple[int, int]], position: int) -> bool:
+    return any(offset <= position < offset + length for offset, length in masks)
+
+class MaskTests(unittest.TestCase):
+    def test_assembly_masks(self):
+        masks = get_masks('B.dll', read_fixture('original', 'B.dll'))
+        self.assertEqual(sorted(masks), [
+            (136, 4), # COFF timestamp
+            (216, 4), # Checksum
+            (1596, 16), # #GUID heap (the MVID)
+            (1816, 4), # CodeView debug directory entry timestamp
+            (1844, 4), # PDB checksum debug directory entry timestamp
+            (1872, 4), # Reproducible debug directory entry timestamp
+            (1900, 20), # PDB ID and age
+            (1962, 32), # SHA256 of the PDB
+        ])
+
+    def test_pdb_masks(self):
+        masks = get_masks('B.pdb', read_fixture('original', 'B.pdb'))
+        # The PDB ID then the timestamp, image size, and MVID of each compilation reference
+        self.assertEqual(masks[0], (124, 20))
+        self.assertGreater(len(masks), 1)
+        self.assertTrue(all(length == 24 for _, length in masks[1:]))
+
+    def test_pdb_id_matches_assembly(self):
+        assembly = read_fixture('original', 'B.dll')
+        pdb = read_fixture('original', 'B.pdb')
+        self.assertEqual(assembly[1900:1916], pdb[124:140])
+
+    def test_dependency_changes_are_masked(self):
+        for file_name in ('B.dll', 'B.pdb'):
+            with self.subTest(file_name=file_name):
+                original = read_fixture('original', file_name)
+                changed = read_fixture('dependency-changed', file_name)
+                self.assertEqual(len(original), len(changed))
+                masks = get_masks(file_name, original)
+                differences = [position for position in range(len(original)) if original[position] != changed[position]]
+                self.assertNotEqual(differences, [])
+                self.assertEqual([position for position in differences if not is_masked(masks, position)], [])
+
+class DigestTests(unittest.TestCase):
+    def test_dependency_changes_are_ignored(self):
+        for file_name in ('B.dll', 'B.pdb'):
+            with self.subTest(file_name=file_name):
+                original = read_fixture('original', file_name)
+                changed = read_fixture('dependency-changed', file_name)
+                self.assertNotEqual(hashlib.sha256(original).digest(), hashlib.sha256(changed).digest())
+                self.assertEqual(get_normalized_digest(file_name, original), get_normalized_digest(file_name, changed))
+
+    def test_code_changes_are_detected(self):
+        for file_name in ('B.dll', 'B.pdb'):
+            with self.subTest(file_name=file_name):
+                self.assertNotEqual(get_normalized_digest(file_name, read_fixture('original', file_name)), get_normalized_digest(file_name, read_fixture('code-changed', file_name)))
+
+    def test_masked_bytes_are_hashed_as_zeros(self):
+        data = bytearray(read_fixture('original', 'B.dll'))
+        for offset, length in get_masks('B.dll', bytes(data)):
+            data[offset:offset + length] = bytes(length)
+        self.assertEqual(get_normalized_digest('B.dll', read_fixture('original', 'B.dll')), hashlib.sha256(data).digest())
+
+    def test_zip_entries_are_streamed(self):
+        output_stream = io.BytesIO()
+        with zipfile.ZipFile(output_stream, 'w', zipfile.ZIP_DEFLATED) as package:
+            for file_name in ('B.dll', 'B.pdb'):
+                package.writestr(f'lib/net8.0/{file_name}', read_fixture('original', file_name))
+
+        # Tiny pages and chunks make the files span many of them, reads are never bigger than either
+        read_sizes = []
+        with zipfile.ZipFile(output_stream, 'r') as package, \
+            mock.patch.object(pdb_normalizer.PagedReader, 'PAGE_SIZE', 512), mock.patch.object(pdb_normalizer.PagedReader, 'MAX_PAGES', 2), \
+            mock.patch.object(pdb_normalizer, 'HASH_CHUNK_SIZE', 1000):
+            for file_name in ('B.dll', 'B.pdb'):
+                with package.open(f'lib/net8.0/{file_name}') as stream:
+                    read = stream.read
+                    stream.read = lambda size=-1: read_sizes.append(size) or read(size)
+                    with self.subTest(file_name=file_name):
+                        self.assertEqual(pdb_normalizer.get_normalized_digest(file_name, stream), get_normalized_digest(file_name, read_fixture('original', file_name)))
+        self.assertTrue(all(0 <= size <= 1000 for size in read_sizes))
+
+    def test_unparseable_files_are_hashed_as_is(self):
+        data = read_fixture('original', 'B.dll')[:300]
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.assertEqual(get_normalized_digest('B.dll', data), hashlib.sha256(data).digest())
+        self.assertIn("::warning::Could not parse 'B.dll'", output.getvalue())
+
+    def test_windows_pdbs_are_hashed_as_is(self):
+        data = b'Microsoft C/C++ MSF 7.00\r\n\x1aDS\0\0\0' + bytes(100)
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.assertEqual(get_normalized_digest('B.pdb', data), hashlib.sha256(data).digest())
+        self.assertEqual(output.getvalue(), '')
+
+if __name__ == '__main__':
+    unittest.main()
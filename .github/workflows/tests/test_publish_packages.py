@@ -0,0 +1,170 @@
+import importlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import unittest
+import zipfile
+
+from contextlib import redirect_stdout
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import gha
+
+local_nuget_feed = importlib.import_module('local-nuget-feed')
+publish_packages = importlib.import_module('publish-packages')
+
+class PublishPackagesTests(unittest.TestCase):
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.path = Path(temporary_directory.name)
+        self.packages_path = self.path / 'Packages'
+        self.packages_path.mkdir()
+        self.feed_path = self.path / 'Feed'
+        self.feed_path.mkdir()
+        self.manifest_path = self.path / 'ReleaseManifest'
+        self.summary_path = self.path / 'summary.md'
+        self.summary_path.write_text('')
+        self.addCleanup(setattr, gha, 'errors_were_printed', False)
+
+        environment = mock.patch.dict(os.environ, {
+            'NUGET_API_KEY': 'key',
+            'PUBLISH_WORKERS': '4',
+            'PUBLISH_RETRY_DELAY': '0',
+            'PUBLISH_TIMEOUT': '10',
+            'GITHUB_STEP_SUMMARY': str(self.summary_path),
+        })
+        environment.start()
+        self.addCleanup(environment.stop)
+        for name in ('NUGET_USERNAME', 'PUBLISH_SYMBOLS', 'PUBLISH_SKIP_DUPLICATES', 'PUBLISH_ATTEMPTS'):
+            os.environ.pop(name, None)
+
+    def write_package(self, path: Path, name: str, version: str, dependencies: list[str] = []):
+        dependency_elements = ''.join(f'<dependency id="{dependency}" version="{version}" />' for dependency in dependencies)
+        with zipfile.ZipFile(path / f'{name}.{version}.nupkg', 'w') as package:
+            package.writestr(f'{name}.nuspec', f'''<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://schemas.microsoft.com/packaging/2013/05/nuspec.xsd">
+  <metadata><id>{name}</id><version>{version}</version><dependencies><group targetFramework="net8.0">{dependency_elements}</group></dependencies></metadata>
+</package>''')
+
+    def start_feed(self, transient_failure_count: int = 0):
+        self.feed = local_nuget_feed.Feed(self.feed_path, 'key', transient_failure_count)
+        server = local_nuget_feed.FeedServer(self.feed)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+        return server.index_url
+
+    def publish(self, index_url: str, *package_names: str) -> tuple[int | str | None, str]:
+        self.manifest_path.write_text(''.join(f'{name}\n' for name in package_names))
+        output = io.StringIO()
+        with redirect_stdout(output):
+            try:
+                publish_packages.main(['publish-packages.py', str(self.manifest_path), str(self.packages_path), index_url])
+                exit_code = 0
+            except SystemExit as ex:
+                exit_code = ex.code
+        return exit_code, output.getvalue()
+
+    def write_dependent_packages(self):
+        self.write_package(self.packages_path, 'Bonsai.Core', '2.9.0')
+        self.write_package(self.packages_path, 'Bonsai.Design', '2.9.0', ['Bonsai.Core'])
+        self.write_package(self.packages_path, 'Bonsai.Editor', '2.9.0', ['Bonsai.Core', 'Bonsai.Design'])
+        self.write_package(self.packages_path, 'Bonsai.Vision', '2.9.0')
+
+    def test_packages_are_pushed_in_dependency_order(self):
+        self.write_dependent_packages()
+        index_url = self.start_feed()
+        exit_code, _ = self.publish(index_url, 'Bonsai.Editor', 'Bonsai.Design', 'Bonsai.Core', 'Bonsai.Vision')
+        self.assertEqual(exit_code, 0)
+
+        order = [name for name, _ in self.feed.pushed]
+        self.assertCountEqual(order, ['Bonsai.Core', 'Bonsai.Design', 'Bonsai.Editor', 'Bonsai.Vision'])
+        self.assertLess(order.index('Bonsai.Core'), order.index('Bonsai.Design'))
+        self.assertLess(order.index('Bonsai.Design'), order.index('Bonsai.Editor'))
+        self.assertIn("| Bonsai.Editor | 2.9.0 | ✅ Published |", self.summary_path.read_text())
+
+    def test_transient_failures_are_retried(self):
+        self.write_dependent_packages()
+        index_url = self.start_feed(transient_failure_count=3)
+        exit_code, _ = self.publish(index_url, 'Bonsai.Core', 'Bonsai.Design', 'Bonsai.Editor', 'Bonsai.Vision')
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(self.feed.transient_failures_remaining, 0)
+        self.assertEqual(len(self.feed.pushed), 4)
+
+    def test_transient_failures_give_up_eventually(self):
+        self.write_package(self.packages_path, 'Bonsai.Core', '2.9.0')
+        self.write_package(self.packages_path, 'Bonsai.Design', '2.9.0', ['Bonsai.Core'])
+        index_url = self.start_feed(transient_failure_count=2)
+        with mock.patch.dict(os.environ, { 'PUBLISH_ATTEMPTS': '2', 'PUBLISH_WORKERS': '1' }):
+            exit_code, output = self.publish(index_url, 'Bonsai.Core', 'Bonsai.Design')
+        self.assertEqual(exit_code, 1)
+        self.assertIn("::error::Pushing 'Bonsai.Core.2.9.0.nupkg' failed with HTTP 503", output)
+        self.assertIn("::error::'Bonsai.Design' was not published because one of its dependencies failed to publish.", output)
+        self.assertEqual(self.feed.pushed, [])
+
+    def test_duplicates_are_an_error_by_default(self):
+        self.write_dependent_packages()
+        self.write_package(self.feed_path, 'Bonsai.Core', '2.9.0')
+        index_url = self.start_feed()
+        exit_code, output = self.publish(index_url, 'Bonsai.Core', 'Bonsai.Design', 'Bonsai.Editor', 'Bonsai.Vision')
+        self.assertEqual(exit_code, 1)
+        self.assertIn("::error::'Bonsai.Core' 2.9.0 already exists on the feed.", output)
+        # Nothing is published since the release would be partial
+        self.assertEqual(self.feed.pushed, [])
+
+    def test_duplicates_can_be_skipped(self):
+        self.write_dependent_packages()
+        self.write_package(self.feed_path, 'Bonsai.Core', '2.9.0')
+        index_url = self.start_feed()
+        with mock.patch.dict(os.environ, { 'PUBLISH_SKIP_DUPLICATES': 'true' }):
+            exit_code, output = self.publish(index_url, 'Bonsai.Core', 'Bonsai.Design', 'Bonsai.Editor', 'Bonsai.Vision')
+        self.assertEqual(exit_code, 0)
+        self.assertIn("⬜ 'Bonsai.Core' 2.9.0 already exists on the feed", output)
+        self.assertCountEqual([name for name, _ in self.feed.pushed], ['Bonsai.Design', 'Bonsai.Editor', 'Bonsai.Vision'])
+
+    def test_concurrently_published_duplicates(self):
+        # Another run publishes the package after the feed was queried, which is only an error when duplicates aren't skipped
+        self.write_package(self.packages_path, 'Bonsai.Core', '2.9.0')
+        self.write_package(self.feed_path, 'Bonsai.Core', '2.9.0')
+        index_url = self.start_feed()
+        with mock.patch.object(publish_packages.Feed, 'get_versions', return_value=set()):
+            with mock.patch.dict(os.environ, { 'PUBLISH_SKIP_DUPLICATES': 'true' }):
+                exit_code, output = self.publish(index_url, 'Bonsai.Core')
+            self.assertEqual(exit_code, 0)
+            self.assertIn("⬜ 'Bonsai.Core' 2.9.0 was published by someone else in the meantime", output)
+
+            exit_code, output = self.publish(index_url, 'Bonsai.Core')
+            self.assertEqual(exit_code, 1)
+            self.assertIn("::error::Pushing 'Bonsai.Core.2.9.0.nupkg' failed with HTTP 409", output)
+        self.assertEqual(self.feed.pushed, [])
+
+    def test_unexpected_errors_only_fail_their_package(self):
+        self.write_dependent_packages()
+        index_url = self.start_feed()
+        real_push = publish_packages.FeedClient.push
+
+        def push(client, url: str, package_path: Path) -> bool:
+            if package_path.name.startswith('Bonsai.Design.'):
+                raise OSError("Disk on fire")
+            return real_push(client, url, package_path)
+
+        with mock.patch.object(publish_packages.FeedClient, 'push', autospec=True, side_effect=push):
+            exit_code, output = self.publish(index_url, 'Bonsai.Core', 'Bonsai.Design', 'Bonsai.Editor', 'Bonsai.Vision')
+        self.assertEqual(exit_code, 1)
+        self.assertIn("::error::Publishing 'Bonsai.Design' 2.9.0 failed: OSError('Disk on fire')", output)
+        self.assertCountEqual([name for name, _ in self.feed.pushed], ['Bonsai.Core', 'Bonsai.Vision'])
+        summary = self.summary_path.read_text()
+        self.assertIn("| Bonsai.Design | 2.9.0 | ❌ Failed |", summary)
+        self.assertIn("| Bonsai.Editor | 2.9.0 | ❌ Dependency failed |", summary)
+        self.assertIn("| Bonsai.Vision | 2.9.0 | ✅ Published |", summary)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import sys
+import tempfile
+import unittest
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import source_fingerprints
+
+class PackageCacheTests(unittest.TestCase):
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.path = Path(temporary_directory.name)
+
+    def test_dummy_builds_with_and_without_symbols_are_cached_separately(self):
+        fingerprint = 'ab' * 32
+        with_symbols = source_fingerprints.PackageCache(self.path, dummy_build_symbols=True)
+        without_symbols = source_fingerprints.PackageCache(self.path, dummy_build_symbols=False)
+
+        with_symbols.put('Bonsai.Core', fingerprint, { 'entries': [] })
+        self.assertIsNotNone(with_symbols.get('Bonsai.Core', fingerprint))
+        self.assertIsNone(without_symbols.get('Bonsai.Core', fingerprint))
+
+        without_symbols.put('Bonsai.Core', fingerprint, { 'entries': [] })
+        self.assertNotEqual(with_symbols.get('Bonsai.Core', fingerprint), without_symbols.get('Bonsai.Core', fingerprint))
+
+    def test_prune_keeps_the_newest_entries(self):
+        cache = source_fingerprints.PackageCache(self.path, dummy_build_symbols=False)
+        for index in range(3):
+            cache.put('Bonsai.Core', f'{index:02x}' * 32, { 'entries': [] })
+        self.assertEqual(cache.prune(5), 0)
+        self.assertEqual(cache.prune(3), 0)
+        self.assertEqual(cache.prune(1), 2)
+        self.assertEqual(len(list(self.path.rglob('*.json'))), 1)
+
+if __name__ == '__main__':
+    unittest.main()
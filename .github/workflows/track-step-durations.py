@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# Records how long each workflow step and Python script took and warns about steps which got slower than usual
+# The history file is meant to be carried between runs using the cache or an artifact
+import csv
+import datetime
+import json
+import os
+import statistics
+import sys
+
+from pathlib import Path
+
+import gha
+
+def get_environment_variable(name: str, default: str) -> str:
+    ret = os.getenv(name)
+    if ret is None or ret == '':
+        return default
+    return ret
+
+HISTORY_FIELDS = ['run_id', 'recorded_at', 'kind', 'name', 'seconds']
+
+def parse_timestamp(timestamp: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+
+def main(argv: list[str]) -> None:
+    if len(argv) < 3 or len(argv) > 4:
+        gha.print_error('Usage: track-step-durations.py <history-path> <jobs-json-path> [<profiles-path>]')
+        sys.exit(1)
+    else:
+        history_path = Path(argv[1])
+        jobs_json_path = Path(argv[2])
+        profiles_path = Path(argv[3]) if len(argv) > 3 else None
+
+    if not jobs_json_path.exists():
+        gha.print_error(f"Jobs JSON '{jobs_json_path}' does not exist.")
+
+    try:
+        # How many previous runs make up the baseline
+        baseline_runs = int(get_environment_variable('baseline_runs', '10'))
+        # How much slower than the baseline a step must be to be reported (as a fraction of the baseline)
+        regression_threshold = float(get_environment_variable('regression_threshold', '0.25'))
+        # Steps which only got slower by a few seconds are just noise
+        regression_minimum_seconds = float(get_environment_variable('regression_minimum_seconds', '15'))
+        # Older runs are dropped from the history so that it doesn't grow forever
+        history_limit = int(get_environment_variable('history_limit', '100'))
+    except ValueError as ex:
+        gha.print_error(f"Invalid configuration: {ex}")
+
+    run_id = get_environment_variable('GITHUB_RUN_ID', 'local')
+    gha.fail_if_errors()
+
+    #==============================================================================================
+    # Collect durations from this run
+    #==============================================================================================
+    durations: dict[tuple[str, str], float] = { }
+
+    # The jobs JSON is the output of the GitHub REST API for listing the jobs of a workflow run
+    # https://docs.github.com/en/rest/actions/workflow-jobs#list-jobs-for-a-workflow-run
+    with open(jobs_json_path, 'r', encoding='utf-8') as f:
+        jobs_json = json.load(f)
+
+    # `gh api --paginate` concatenates pages, so accept either a single page or a list of them
+    pages = jobs_json if isinstance(jobs_json, list) else [jobs_json]
+    for page in pages:
+        for job in page.get('jobs', []):
+            for step in job.get('steps', []):
+                # Steps which were skipped or haven't finished yet (such as the ones from the job running this script) don't have a meaningful duration
+                if step.get('conclusion') not in ('success', 'failure') or step.get('started_at') is None or step.get('completed_at') is None:
+                    continue
+
+                seconds = (parse_timestamp(step['completed_at']) - parse_timestamp(step['started_at'])).total_seconds()
+                durations[('step', f"{job['name']} / {step['name']}")] = seconds
+
+    # Python scripts are timed using the profiles saved by gha.py when GHA_PY_PROFILE is enabled
+    if profiles_path is not None and profiles_path.exists():
+        for profile_path in sorted(profiles_path.rglob('*.json')):
+            try:
+                with open(profile_path, 'r', encoding='utf-8') as f:
+                    profile = json.load(f)
+                key = ('script', profile['script'])
+                # Scripts can run more than once per workflow run (IE: in every matrix job), so durations are accumulated
+                durations[key] = durations.get(key, 0.0) + profile['total_seconds']
+            except Exception as ex:
+                gha.print_warning(f"Failed to read profile '{profile_path}': {ex}")
+
+    if len(durations) == 0:
+        gha.print_warning("No step durations were found for this run.")
+
+    #==============================================================================================
+    # Load the history and compare against the baseline
+    #==============================================================================================
+    history: list[dict[str, str]] = []
+    if history_path.exists():
+        with open(history_path, 'r', encoding='utf-8', newline='') as f:
+            history = [row for row in csv.DictReader(f) if row.get('run_id') != run_id]
+
+    # Rows are appended in run order, so the most recent runs are at the end
+    history_by_key: dict[tuple[str, str], list[float]] = { }
+    for row in history:
+        history_by_key.setdefault((row['kind'], row['name']), []).append(float(row['seconds']))
+
+    class Comparison:
+        def __init__(self, kind: str, name: str, seconds: float, baseline: float | None):
+            self.kind = kind
+            self.name = name
+            self.seconds = seconds
+            self.baseline = baseline
+            self.is_regression = baseline is not None and seconds > baseline * (1 + regression_threshold) and seconds - baseline >= regression_minimum_seconds
+
+    comparisons = []
+    for (kind, name), seconds in durations.items():
+        previous = history_by_key.get((kind, name), [])[-baseline_runs:]
+        # The median keeps a single unusually slow or fast run from skewing the baseline
+        baseline = statistics.median(previous) if len(previous) > 0 else None
+        comparisons.append(Comparison(kind, name, seconds, baseline))
+    comparisons.sort(key=lambda comparison: (comparison.kind, comparison.name))
+
+    regressions = [comparison for comparison in comparisons if comparison.is_regression]
+    for regression in regressions:
+        assert regression.baseline is not None
+        gha.print_warning(f"{regression.kind.capitalize()} '{regression.name}' took {regression.seconds:.0f} s, which is {regression.seconds / regression.baseline - 1:.0%} slower than its baseline of {regression.baseline:.0f} s.")
+
+    #==============================================================================================
+    # Save the history
+    #==============================================================================================
+    recorded_at = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+    for comparison in comparisons:
+        history.append({ 'run_id': run_id, 'recorded_at': recorded_at, 'kind': comparison.kind, 'name': comparison.name, 'seconds': f"{comparison.seconds:.3f}" })
+
+    run_ids = []
+    for row in history:
+        if row['run_id'] not in run_ids:
+            run_ids.append(row['run_id'])
+    kept_run_ids = set(run_ids[-history_limit:])
+
+    history_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(history_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, HISTORY_FIELDS)
+        writer.writeheader()
+        writer.writerows(row for row in history if row['run_id'] in kept_run_ids)
+
+    #==============================================================================================
+    # Report
+    #==============================================================================================
+    gha.set_output('regression-count', str(len(regressions)))
+    gha.set_output('regressions', json.dumps([regression.name for regression in regressions]))
+
+    with gha.JobSummary() as md:
+        md.write_line("# Step durations")
+        md.write_line()
+        md.write_line(f"Compared against the median of up to {baseline_runs} previous runs, regressions are steps at least {regression_threshold:.0%} and {regression_minimum_seconds:.0f} s slower than their baseline.")
+        md.write_line()
+        md.write_line("| | Kind | Name | Duration | Baseline | Change |")
+        md.write_line("|-|------|------|---------:|---------:|-------:|")
+        for comparison in comparisons:
+            if comparison.baseline is None:
+                baseline = change = '-'
+            else:
+                baseline = f"{comparison.baseline:.1f} s"
+                change = f"{comparison.seconds - comparison.baseline:+.1f} s"
+            md.write_line(f"| {'⚠' if comparison.is_regression else ''} | {comparison.kind} | {comparison.name} | {comparison.seconds:.1f} s | {baseline} | {change} |")
+
+    print(f"Recorded {len(comparisons)} durations, {len(regressions)} of which regressed.")
+    gha.fail_if_errors()
+
+if __name__ == '__main__':
+    gha.run_script(main)
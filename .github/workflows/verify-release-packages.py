@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# Verifies the packages which are about to be published so that a corrupt package fails the release before anything is uploaded
+# Every package (and symbol package) has its central directory read, the CRC of every entry checked, and its nuspec parsed and checked against its file name
+import concurrent.futures
+import os
+import sys
+
+from pathlib import Path
+from xml.etree import ElementTree
+from zipfile import ZipFile
+
+import gha
+import nuget
+
+# Returns the problems with a package, if any
+def verify_package(path: Path) -> list[str]:
+    parsed = nuget.parse_package_file_name(path.name)
+    if parsed is None:
+        return ["file name does not match the expected format for a NuGet package"]
+    name, version = parsed
+
+    problems = []
+    try:
+        with ZipFile(path, 'r') as package:
+            # This decompresses every entry and checks it against the CRC recorded in the central directory
+            corrupt_entry = package.testzip()
+            if corrupt_entry is not None:
+                problems.append(f"entry '{corrupt_entry}' does not match its CRC")
+
+            nuspec_info = nuget.find_nuspec(package)
+            if nuspec_info is None:
+                problems.append("it does not contain a nuspec")
+                return problems
+
+            with package.open(nuspec_info) as nuspec_file:
+                nuspec = nuget.Nuspec(ElementTree.parse(nuspec_file).getroot())
+    except (ElementTree.ParseError, ValueError) as ex:
+        problems.append(f"its nuspec could not be parsed: {ex}")
+        return problems
+    except Exception as ex:
+        problems.append(f"it could not be read: {ex}")
+        return problems
+
+    # Package IDs are case insensitive, versions must match exactly since they're what the feed uses to identify the package
+    if nuspec.id.lower() != name.lower():
+        problems.append(f"its nuspec has ID '{nuspec.id}' but its file name has '{name}'")
+    if nuspec.version != version:
+        problems.append(f"its nuspec has version '{nuspec.version}' but its file name has '{version}'")
+    return problems
+
+def main(argv: list[str]) -> None:
+    if len(argv) != 3:
+        gha.print_error('Usage: verify-release-packages.py <release-manifest-path> <packages-path>')
+        sys.exit(1)
+    else:
+        release_manifest_path = Path(argv[1])
+        packages_path = Path(argv[2])
+
+    if not release_manifest_path.exists():
+        gha.print_error(f"Release manifest '{release_manifest_path}' does not exist.")
+    if not packages_path.exists():
+        gha.print_error(f"Packages path '{packages_path}' does not exist.")
+
+    worker_count = os.cpu_count() or 1
+    worker_count_string = os.getenv('VERIFY_WORKERS')
+    if worker_count_string is not None and worker_count_string != '' and worker_count_string != 'auto':
+        if not worker_count_string.isdigit() or int(worker_count_string) < 1:
+            gha.print_error(f"VERIFY_WORKERS must be a positive integer or 'auto', got '{worker_count_string}'.")
+        else:
+            worker_count = int(worker_count_string)
+    gha.fail_if_errors()
+
+    release_packages = set()
+    with open(release_manifest_path, 'r') as release_manifest:
+        for line in release_manifest.readlines():
+            if line.strip() != '':
+                release_packages.add(line.strip())
+
+    index = nuget.PackageDirectoryIndex(packages_path)
+    problems: dict[str, list[str]] = { }
+    for name in sorted(release_packages):
+        if name not in index or index[name].nupkg_path is None:
+            problems[f"{name}.nupkg"] = ["it is in the release manifest but it does not exist"]
+
+    paths = sorted((path for package in index for path in (package.nupkg_path, package.snupkg_path) if path is not None), key=lambda path: path.name)
+    paths += index.unrecognized_files
+
+    # Checking CRCs is dominated by decompression, which releases the GIL
+    with gha.profile_phase('verify packages'), concurrent.futures.ThreadPoolExecutor(worker_count) as executor:
+        for path, package_problems in zip(paths, executor.map(verify_package, paths)):
+            if len(package_problems) > 0:
+                problems[path.name] = package_problems
+                print(f"❌ '{path.name}'")
+            else:
+                print(f"✅ '{path.name}'")
+
+    # Every problem is reported at once so a broken release can be fixed in one go
+    if len(problems) > 0:
+        gha.print_error(f"{len(problems)} packages failed verification: " + '; '.join(f"'{file_name}': {', '.join(package_problems)}" for file_name, package_problems in sorted(problems.items())))
+    else:
+        print(f"Verified {len(paths)} packages")
+
+    gha.fail_if_errors()
+
+if __name__ == '__main__':
+    gha.run_script(main)
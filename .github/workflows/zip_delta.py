@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+# Zip Delta
+# Creates and applies deltas between two versions of a zip file, which let users update a previous portable zip to a new one without downloading all of it
+#
+# The new zip is described as a list of segments which are concatenated to recreate it byte for byte:
+#   literal: bytes stored in the delta, used for headers and anything which can't be described any other way
+#   copy:    a range of the old zip, used for entries whose compressed data didn't change at all
+#   deflate: an entry which is recreated by applying a binary delta to the same entry of the old zip and compressing the result again
+# Compressed data changes everywhere after the first change in a file, so changed entries are diffed while uncompressed instead.
+# Recompressing only works if it results in the exact same bytes, so the delta records how the entry was compressed (see parallel_deflate.py)
+# and the hash of the result is always verified. (In theory a different version of zlib could compress differently, in which case applying the delta fails.)
+#
+# Binary deltas are in the style of bsdiff https://www.daemonology.net/bsdiff/
+# A binary delta is a list of controls along with a diff block and an extra block. Each control is a triple of:
+#   diff length:  the number of bytes to read from the old file, each one is added to the next byte of the diff block (modulo 256) and written out
+#   extra length: the number of bytes to copy from the extra block to the output unchanged
+#   seek:         how far to move in the old file before the next control
+# Regions which match exactly produce diff bytes of zero, which lzma compresses down to almost nothing.
+# Rather than bsdiff's suffix sort, matches are found by looking up blocks of the new file in an index of the aligned blocks of the old file.
+#
+# This file only uses the standard library so that it can be downloaded and used on its own to apply a delta:
+#   python zip_delta.py apply Bonsai.zip Bonsai-2.8.0-to-2.9.0.zip.delta Bonsai-2.9.0.zip
+import argparse
+import hashlib
+import io
+import json
+import lzma
+import struct
+import sys
+import zlib
+
+from pathlib import Path
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
+
+#==================================================================================================
+# Binary deltas
+#==================================================================================================
+BINARY_DELTA_MAGIC = b'BNSDLT01'
+BINARY_DELTA_HEADER = struct.Struct('<8sQQ32s32sQQQ')
+CONTROL = struct.Struct('<qqq')
+DEFAULT_BLOCK_SIZE = 64
+# Limits how far an approximate match is extended into the bytes which follow it, extending it is only worth it across small differences
+MAX_EXTENSION = 64 * 1024
+MATCH_COMPARISON_SIZE = 4096
+
+# Byte-wise addition and subtraction modulo 256, done on the whole segment at once using big integers rather than one byte at a time
+def add_bytes(a: bytes, b: bytes) -> bytes:
+    length = len(a)
+    high = int.from_bytes(b'\x80' * length, 'little')
+    low = int.from_bytes(b'\x7f' * length, 'little')
+    x = int.from_bytes(a, 'little')
+    y = int.from_bytes(b, 'little')
+    return (((x & low) + (y & low)) ^ ((x ^ y) & high)).to_bytes(length, 'little')
+
+def subtract_bytes(a: bytes, b: bytes) -> bytes:
+    length = len(a)
+    high = int.from_bytes(b'\x80' * length, 'little')
+    low = int.from_bytes(b'\x7f' * length, 'little')
+    x = int.from_bytes(a, 'little')
+    y = int.from_bytes(b, 'little')
+    return (((x | high) - (y & low)) ^ ((x ^ y ^ high) & high)).to_bytes(length, 'little')
+
+def get_match_length(old: bytes, old_start: int, new: bytes, new_start: int) -> int:
+    length = 0
+    maximum = min(len(old) - old_start, len(new) - new_start)
+    # Compare in large slices first and only go byte by byte in the slice with the difference
+    while length < maximum:
+        size = min(MATCH_COMPARISON_SIZE, maximum - length)
+        if old[old_start + length:old_start + length + size] == new[new_start + length:new_start + length + size]:
+            length += size
+            continue
+
+        while length < maximum and old[old_start + length] == new[new_start + length]:
+            length += 1
+        break
+    return length
+
+# Extends a match into the bytes after it as long as more than half of them still match (the same heuristic as bsdiff)
+def get_extension_length(old: bytes, old_start: int, new: bytes, new_start: int, maximum: int) -> int:
+    maximum = min(maximum, len(old) - old_start, MAX_EXTENSION)
+    best_length = 0
+    best_score = 0
+    matching = 0
+    for i in range(maximum):
+        if old[old_start + i] == new[new_start + i]:
+            matching += 1
+        score = matching * 2 - (i + 1)
+        if score > best_score:
+            best_score = score
+            best_length = i + 1
+    return best_length
+
+# Returns the exact matches between the files as (new offset, old offset, length)
+def find_matches(old: bytes, new: bytes, block_size: int) -> list[tuple[int, int, int]]:
+    index: dict[bytes, int] = { }
+    for offset in range(0, len(old) - block_size + 1, block_size):
+        index.setdefault(old[offset:offset + block_size], offset)
+
+    matches = []
+    previous_end = 0
+    scan = 0
+    while scan + block_size <= len(new):
+        old_start = index.get(new[scan:scan + block_size])
+        if old_start is None:
+            scan += 1
+            continue
+
+        # The block index is aligned, so the match might actually start before the block
+        while scan > previous_end and old_start > 0 and new[scan - 1] == old[old_start - 1]:
+            scan -= 1
+            old_start -= 1
+
+        length = get_match_length(old, old_start, new, scan)
+        matches.append((scan, old_start, length))
+        scan += length
+        previous_end = scan
+    return matches
+
+def create_binary_delta(old: bytes, new: bytes, block_size: int = DEFAULT_BLOCK_SIZE) -> bytes:
+    controls = bytearray()
+    diff = bytearray()
+    extra = bytearray()
+
+    # The region of the old file which the last control diffed against, the first control has no diff region
+    diff_old_start = 0
+    diff_new_start = 0
+    diff_length = 0
+
+    def emit(next_new_start: int, next_old_start: int):
+        extra_start = diff_new_start + diff_length
+        diff.extend(subtract_bytes(new[diff_new_start:extra_start], old[diff_old_start:diff_old_start + diff_length]))
+        extra.extend(new[extra_start:next_new_start])
+        controls.extend(CONTROL.pack(diff_length, next_new_start - extra_start, next_old_start - (diff_old_start + diff_length)))
+
+    matches = find_matches(old, new, block_size)
+    for i, (new_start, old_start, length) in enumerate(matches):
+        emit(new_start, old_start)
+
+        next_new_start = matches[i + 1][0] if i + 1 < len(matches) else len(new)
+        end = new_start + length
+        diff_old_start = old_start
+        diff_new_start = new_start
+        diff_length = length + get_extension_length(old, old_start + length, new, end, next_new_start - end)
+    emit(len(new), diff_old_start + diff_length)
+
+    blocks = [lzma.compress(bytes(block), preset=9) for block in (controls, diff, extra)]
+    header = BINARY_DELTA_HEADER.pack(BINARY_DELTA_MAGIC, len(old), len(new), hashlib.sha256(old).digest(), hashlib.sha256(new).digest(), *(len(block) for block in blocks))
+    return header + b''.join(blocks)
+
+# Raises ValueError if the delta isn't for the given old file or the result doesn't match the file the delta was created from
+def apply_binary_delta(old: bytes, delta: bytes) -> bytes:
+    if len(delta) < BINARY_DELTA_HEADER.size:
+        raise ValueError("The binary delta is truncated.")
+
+    magic, old_size, new_size, old_hash, new_hash, control_size, diff_size, extra_size = BINARY_DELTA_HEADER.unpack_from(delta)
+    if magic != BINARY_DELTA_MAGIC:
+        raise ValueError("The binary delta was created by an incompatible version of this tool.")
+    if len(old) != old_size or hashlib.sha256(old).digest() != old_hash:
+        raise ValueError("The binary delta was not created from this file.")
+    if len(delta) != BINARY_DELTA_HEADER.size + control_size + diff_size + extra_size:
+        raise ValueError("The binary delta is truncated.")
+
+    offset = BINARY_DELTA_HEADER.size
+    controls = lzma.decompress(delta[offset:offset + control_size])
+    offset += control_size
+    diff = lzma.decompress(delta[offset:offset + diff_size])
+    offset += diff_size
+    extra = lzma.decompress(delta[offset:offset + extra_size])
+
+    output = bytearray()
+    old_position = 0
+    diff_position = 0
+    extra_position = 0
+    for diff_length, extra_length, seek in CONTROL.iter_unpack(controls):
+        if diff_length < 0 or extra_length < 0 or old_position < 0 or old_position + diff_length > len(old):
+            raise ValueError("The binary delta is corrupt.")
+
+        diff_segment = diff[diff_position:diff_position + diff_length]
+        old_segment = old[old_position:old_position + diff_length]
+        # Most diff segments are exact matches, which don't need to be added
+        output.extend(old_segment if diff_segment.count(0) == diff_length else add_bytes(old_segment, diff_segment))
+        output.extend(extra[extra_position:extra_position + extra_length])
+        old_position += diff_length + seek
+        diff_position += diff_length
+        extra_position += extra_length
+
+    if len(output) != new_size or hashlib.sha256(output).digest() != new_hash:
+        raise ValueError("The result of applying the binary delta does not match the file it was created from.")
+    return bytes(output)
+
+#==================================================================================================
+# Zip deltas
+#==================================================================================================
+ZIP_DELTA_MAGIC = b'BNSZDL01'
+ZIP_DELTA_HEADER = struct.Struct('<8sQ')
+DEFLATE_WINDOW_SIZE = 32 * 1024
+
+# The ways entries are expected to have been compressed as (level, chunk size), a chunk size of None means the entry was compressed serially
+# The first is how parallel_deflate.py compresses large entries, the others are how zipfile compresses small ones
+DEFLATE_PARAMETERS = [(9, 256 * 1024), (9, None), (6, None)]
+
+# This must produce the exact same output as parallel_deflate.compress (it's duplicated here so that this file stands on its own)
+def deflate(data: bytes, level: int, chunk_size: int | None) -> bytes:
+    chunk_size = chunk_size or max(len(data), 1)
+    # parallel_deflate.py only uses chunks for entries of at least two chunks, smaller ones are compressed serially by zipfile
+    if len(data) < chunk_size * 2:
+        chunk_size = max(len(data), 1)
+
+    view = memoryview(data)
+    output = bytearray()
+    for start in range(0, max(len(data), 1), chunk_size):
+        end = min(start + chunk_size, len(data))
+        if start > 0:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=view[max(0, start - DEFLATE_WINDOW_SIZE):start])
+        else:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        output += compressor.compress(view[start:end])
+        output += compressor.flush(zlib.Z_FINISH if end == len(data) else zlib.Z_SYNC_FLUSH)
+    return bytes(output)
+
+# Returns where the still-compressed data of an entry starts
+def get_raw_data_offset(data: bytes, info: ZipInfo) -> int:
+    # The length of the name and extra field in the local file header can differ from the central directory so they must be read from the local header
+    signature, name_length, extra_length = struct.unpack_from('<4s22xHH', data, info.header_offset)
+    if signature != b'PK\x03\x04':
+        raise ValueError(f"Bad local file header for '{info.filename}'")
+    return info.header_offset + 30 + name_length + extra_length
+
+class ZipDeltaStatistics:
+    def __init__(self):
+        self.copied_entries = 0
+        self.diffed_entries = 0
+        self.literal_entries = 0
+
+def create(old: bytes, new: bytes, statistics: ZipDeltaStatistics | None = None) -> bytes:
+    statistics = statistics if statistics is not None else ZipDeltaStatistics()
+    old_zip = ZipFile(io.BytesIO(old))
+    new_zip = ZipFile(io.BytesIO(new))
+
+    # Entries can only be copied if their compressed data didn't change, which is likely for unchanged files since the portable zip is reproducible
+    old_infos = { info.filename: info for info in old_zip.infolist() }
+    old_raw_data: dict[tuple[int, int], list[int]] = { }
+    for info in old_zip.infolist():
+        old_raw_data.setdefault((info.CRC, info.compress_size), []).append(get_raw_data_offset(old, info))
+
+    segments: list[list] = []
+    literals = bytearray()
+    blobs: list[bytes] = []
+
+    def add_literal(start: int, end: int):
+        if end <= start:
+            return
+        if len(segments) > 0 and segments[-1][0] == 'literal':
+            segments[-1][2] += end - start
+        else:
+            segments.append(['literal', len(literals), end - start])
+        literals.extend(new[start:end])
+
+    def add_deflated_entry(info: ZipInfo, raw: bytes) -> bool:
+        if info.compress_type != ZIP_DEFLATED or info.is_dir():
+            return False
+
+        data = new_zip.read(info)
+        for level, chunk_size in DEFLATE_PARAMETERS:
+            if deflate(data, level, chunk_size) != raw:
+                continue
+
+            old_info = old_infos.get(info.filename)
+            base = old_zip.read(old_info) if old_info is not None and not old_info.is_dir() else b''
+            segments.append(['deflate', len(blobs), old_info.filename if old_info is not None else None, level, chunk_size])
+            blobs.append(create_binary_delta(base, data))
+            return True
+        return False
+
+    position = 0
+    for info in sorted(new_zip.infolist(), key=lambda info: info.header_offset):
+        data_offset = get_raw_data_offset(new, info)
+        add_literal(position, data_offset)
+        position = data_offset + info.compress_size
+        raw = new[data_offset:position]
+
+        old_offset = next((offset for offset in old_raw_data.get((info.CRC, info.compress_size), []) if old[offset:offset + info.compress_size] == raw), None)
+        if info.compress_size > 0 and old_offset is not None:
+            segments.append(['copy', old_offset, info.compress_size])
+            statistics.copied_entries += 1
+        elif info.compress_size > 0 and add_deflated_entry(info, raw):
+            statistics.diffed_entries += 1
+        else:
+            add_literal(data_offset, position)
+            statistics.literal_entries += 1
+
+    # The central directory (and anything else after the last entry)
+    add_literal(position, len(new))
+
+    recipe = {
+        'format': 1,
+        'old_size': len(old),
+        'old_sha256': hashlib.sha256(old).hexdigest(),
+        'new_size': len(new),
+        'new_sha256': hashlib.sha256(new).hexdigest(),
+        'segments': segments,
+        'literals_size': len(literals),
+        'blob_sizes': [len(blob) for blob in blobs],
+    }
+    compressed_recipe = lzma.compress(json.dumps(recipe).encode('utf-8'))
+    return ZIP_DELTA_HEADER.pack(ZIP_DELTA_MAGIC, len(compressed_recipe)) + compressed_recipe + lzma.compress(bytes(literals), preset=9) + b''.join(blobs)
+
+# Raises ValueError if the delta isn't for the given old zip or the result doesn't match the zip the delta was created from
+def apply(old: bytes, delta: bytes) -> bytes:
+    if len(delta) < ZIP_DELTA_HEADER.size:
+        raise ValueError("The delta is truncated.")
+
+    magic, recipe_size = ZIP_DELTA_HEADER.unpack_from(delta)
+    if magic != ZIP_DELTA_MAGIC:
+        raise ValueError("The file is not a zip delta or was created by an incompatible version of this tool.")
+
+    offset = ZIP_DELTA_HEADER.size
+    recipe = json.loads(lzma.decompress(delta[offset:offset + recipe_size]))
+    offset += recipe_size
+    if recipe.get('format') != 1:
+        raise ValueError("The delta was created by an incompatible version of this tool.")
+    if len(old) != recipe['old_size'] or hashlib.sha256(old).hexdigest() != recipe['old_sha256']:
+        raise ValueError("The delta was not created from this zip.")
+
+    blobs_size = sum(recipe['blob_sizes'])
+    decompressor = lzma.LZMADecompressor()
+    literals = decompressor.decompress(delta[offset:len(delta) - blobs_size])
+    if len(literals) != recipe['literals_size'] or not decompressor.eof:
+        raise ValueError("The delta is corrupt.")
+
+    blobs = []
+    offset = len(delta) - blobs_size
+    for blob_size in recipe['blob_sizes']:
+        blobs.append(delta[offset:offset + blob_size])
+        offset += blob_size
+
+    old_zip = ZipFile(io.BytesIO(old))
+    output = bytearray()
+    for segment in recipe['segments']:
+        if segment[0] == 'literal':
+            _, start, length = segment
+            output += literals[start:start + length]
+        elif segment[0] == 'copy':
+            _, start, length = segment
+            output += old[start:start + length]
+        elif segment[0] == 'deflate':
+            _, blob_index, base_name, level, chunk_size = segment
+            base = old_zip.read(base_name) if base_name is not None else b''
+            output += deflate(apply_binary_delta(base, blobs[blob_index]), level, chunk_size)
+        else:
+            raise ValueError(f"The delta contains an unknown segment type '{segment[0]}'.")
+
+    if len(output) != recipe['new_size'] or hashlib.sha256(output).hexdigest() != recipe['new_sha256']:
+        raise ValueError("The result of applying the delta does not match the zip it was created from, download the full zip instead.")
+    return bytes(output)
+
+def main(argv: list[str]) -> None:
+    parser = argparse.ArgumentParser(prog=Path(argv[0]).name, description='Create or apply a delta between two versions of a zip file.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    create_parser = subparsers.add_parser('create', help='create a delta which turns the old zip into the new one')
+    create_parser.add_argument('old', type=Path)
+    create_parser.add_argument('new', type=Path)
+    create_parser.add_argument('delta', type=Path)
+    apply_parser = subparsers.add_parser('apply', help='apply a delta to the old zip to recreate the new one')
+    apply_parser.add_argument('old', type=Path)
+    apply_parser.add_argument('delta', type=Path)
+    apply_parser.add_argument('new', type=Path)
+    args = parser.parse_args(argv[1:])
+
+    try:
+        if args.command == 'create':
+            delta = create(args.old.read_bytes(), args.new.read_bytes())
+            args.delta.write_bytes(delta)
+            print(f"Created '{args.delta}' ({len(delta):,} bytes) for '{args.new}' ({args.new.stat().st_size:,} bytes)")
+        else:
+            new = apply(args.old.read_bytes(), args.delta.read_bytes())
+            with open(args.new, 'xb') as f:
+                f.write(new)
+            print(f"Created '{args.new}' ({len(new):,} bytes), its contents were verified")
+    except (ValueError, FileExistsError) as ex:
+        print(f"Error: {ex}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv)